@@ -1,3 +1,4 @@
+import hashlib
 import inspect
 import types
 import django.db.models
@@ -5,6 +6,9 @@ from .graph import _valid_django_rel
 from . import count
 
 
+default_app_config = 'curious.apps.CuriousConfig'
+
+
 def deferred_to_real(objs):
   deferred_model = [type(obj) for obj in objs if obj.get_deferred_fields()]
   if len(deferred_model) == 0:
@@ -13,8 +17,42 @@ def deferred_to_real(objs):
   return model.objects.filter(pk__in=[obj.pk for obj in objs])
 
 
+def _config_value(value):
+  """
+  Hashable, process independent form of a manager attribute: functions are
+  identified by where they are defined.
+  """
+
+  if isinstance(value, (list, tuple)):
+    return tuple(_config_value(v) for v in value)
+  if isinstance(value, dict):
+    return tuple(sorted((k, _config_value(v)) for k, v in value.iteritems()))
+  if isinstance(value, types.FunctionType):
+    code = value.func_code
+    return (value.__module__, value.__name__, code.co_filename, code.co_firstlineno)
+  if callable(value):
+    return (getattr(value, '__module__', None),
+            getattr(value, '__name__', type(value).__name__))
+  return value
+
+
 class ModelManager(object):
 
+  # attributes included in the registry fingerprint: everything that changes
+  # which objects queries reach or how objects are serialized
+  FINGERPRINT_FIELDS = ('model_name', 'short_name', 'allowed_relationships',
+                        'disallowed_relationships', 'field_excludes', 'property_fields',
+                        'property_batch_functions', 'url_function', 'url_batch_function',
+                        'label_select_related')
+
+  @property
+  def config_state(self):
+    """
+    The current values of FINGERPRINT_FIELDS, as a hashable tuple that is the
+    same in every process for the same configuration.
+    """
+    return tuple(_config_value(getattr(self, f)) for f in ModelManager.FINGERPRINT_FIELDS)
+
   @staticmethod
   def model_name(model_class):
     if hasattr(model_class, '_meta'):
@@ -37,8 +75,26 @@ class ModelManager(object):
     # Fields returned by Curious represented by @properties of the model
     self.property_fields = []
 
+    # Functions computing property fields for many objects at once: maps
+    # field name to a function taking a list of objects and returning a
+    # dictionary of values keyed by pk. Used instead of reading properties
+    # one object at a time, e.g. if properties query the database.
+    self.property_batch_functions = {}
+
     self.url_function = None
 
+    # Function taking a list of objects and returning a dictionary of URLs
+    # keyed by pk; used instead of url_function if set
+    self.url_batch_function = None
+
+    # Relationships to load with select_related when fetching objects FKs
+    # point to, if the string form of the objects uses these relationships
+    self.label_select_related = []
+
+    # Relationships whose adjacency lists are cached across requests; only
+    # opt in relationships that are traversed often and rarely change
+    self.cached_relationships = []
+
   def is_rel_allowed(self, f):
     rel = getattr(self.model_class, f, None)
 
@@ -51,10 +107,20 @@ class ModelManager(object):
     return f in self.allowed_relationships
 
   def url_of(self, obj):
+    if self.url_batch_function is not None:
+      return self.url_batch_function([obj]).get(obj.pk)
     if self.url_function is not None:
       return self.url_function(obj)
     return None
 
+  def urls_of(self, objs):
+    if self.url_batch_function is not None:
+      urls = self.url_batch_function(objs)
+      return [urls.get(obj.pk) for obj in objs]
+    if self.url_function is not None:
+      return [self.url_function(obj) for obj in objs]
+    return [None] * len(objs)
+
   def getattr(self, method):
     if method.endswith("__count"):
       method = method[:-7]
@@ -65,7 +131,11 @@ class ModelManager(object):
       raise Exception('Unknown attribute "%s" in "%s"' % (method, self.model_name))
     if not self.is_rel_allowed(method):
       raise Exception('Not allowed to call "%s" in "%s"' % (method, self.model_name))
-    return getattr(self.model_class, method)
+    rel = getattr(self.model_class, method)
+    if method in self.cached_relationships:
+      from .cache import edge_cache
+      return edge_cache.wrap(self, method, rel)
+    return rel
 
 
 class ModelRegistry(object):
@@ -83,6 +153,8 @@ class ModelRegistry(object):
       to :meth:`~.clear`
     """
     self.__special_models = special_models
+    self.__version = 0
+    self.__fingerprint = (None, None)
     self.clear()
 
   def clear(self, force=False):
@@ -96,6 +168,10 @@ class ModelRegistry(object):
     """
     self.__managers = {}
     self.__short_names = {}
+    # indexes by model class, for looking up names of objects' models
+    self.__class_managers = {}
+    self.__display_names = {}
+    self.__version += 1
 
     if force:
       self.__special_models = None
@@ -103,13 +179,24 @@ class ModelRegistry(object):
       for model in self.__special_models:
         self.register(model)
 
+  def __update_display_names(self, short_name):
+    managers = self.__short_names.get(short_name, [])
+    for manager in managers:
+      if len(managers) == 1:
+        self.__display_names[manager.model_class] = manager.short_name
+      else:
+        self.__display_names[manager.model_class] = manager.model_name
+
   def __add_model_by_class(self, cls, short_name=None):
     manager = ModelManager(cls, short_name)
     if manager.model_name not in self.__managers:
       self.__managers[manager.model_name] = manager
+      self.__version += 1
       if manager.short_name not in self.__short_names:
         self.__short_names[manager.short_name] = []
       self.__short_names[manager.short_name].append(manager)
+      self.__class_managers.setdefault(cls, manager)
+      self.__update_display_names(manager.short_name)
 
   def register(self, model, short_name=None):
     if isinstance(model, types.ModuleType):
@@ -130,10 +217,17 @@ class ModelRegistry(object):
     # will error out if model_name is ambiguious
     full_model_name = self.__translate_name(model_name)
 
-    del self.__managers[full_model_name]
+    manager = self.__managers.pop(full_model_name)
+    self.__version += 1
 
-    # if we get here, we can be sure there's exactly one entry in short_names
-    del self.__short_names[model_name]
+    managers = self.__short_names[manager.short_name]
+    managers.remove(manager)
+    if len(managers) == 0:
+      del self.__short_names[manager.short_name]
+    if self.__class_managers.get(manager.model_class) is manager:
+      del self.__class_managers[manager.model_class]
+      del self.__display_names[manager.model_class]
+    self.__update_display_names(manager.short_name)
 
   def __translate_name(self, name):
     if name in self.__managers:
@@ -155,21 +249,51 @@ class ModelRegistry(object):
       return self.__managers[model_name]
     raise Exception("Unknown model '%s'" % model_name)
 
+  @property
+  def version(self):
+    """
+    A number changing whenever models are registered or unregistered
+    """
+    return self.__version
+
   @property
   def model_names(self):
     return [m.model_name for m in self.__managers.values()]
 
+  @property
+  def model_classes(self):
+    return [m.model_class for m in self.__managers.values()]
+
+  @property
+  def fingerprint(self):
+    """
+    A digest of the registered models and their configurations. Cached data
+    depending on what curious exposes should include the fingerprint in its
+    key, so registry changes do not serve outdated data.
+    """
+
+    # managers can be configured in place, e.g. by appending to lists, so the
+    # digest is only cached for the configuration it was computed from
+    state = tuple(sorted(m.config_state for m in self.__managers.values()))
+    if self.__fingerprint[0] != state:
+      self.__fingerprint = (state, hashlib.sha256(repr(state)).hexdigest())
+    return self.__fingerprint[1]
+
+  def get_manager_by_class(self, cls):
+    if cls in self.__class_managers:
+      return self.__class_managers[cls]
+    raise Exception("Unknown model '%s'" % ModelManager.model_name(cls))
+
   def get_name(self, cls):
-    managers = [m for m in self.__managers.values() if m.model_class == cls]
-    if len(managers) == 0:
+    """
+    Returns the name of a model class: its short name, unless other registered
+    models share the short name, or its full name.
+    """
+
+    name = self.__display_names.get(cls)
+    if name is None:
       return ModelManager.model_name(cls)
-    manager = managers[0]
-    if (
-      manager.short_name in self.__short_names
-      and len(self.__short_names[manager.short_name]) == 1
-    ):
-      return manager.short_name
-    return manager.model_name
+    return name
 
 
 model_registry = ModelRegistry(special_models=(count.CountObject,))
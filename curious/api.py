@@ -1,27 +1,26 @@
 import json
+import math
+import threading
 import types
-from decimal import Decimal
 from datetime import datetime
 from humanize import naturaltime
-from django.core.cache import caches, InvalidCacheBackendError
+from django.db import transaction
 from django.db.models.fields.related import ForeignKey
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.generic.base import View
 
-from curious import model_registry
+from curious import model_registry, ModelManager
+from .cache import cache, tiered_cache, make_key, admission, model_versions, query_log, \
+                   CACHE_TIMEOUT
+from .encoding import RawJSON, dumps, iterencode
 from .query import Query
-from .utils import report_time
+from .results import result_store, result_id_of
+from .serializer import get_serializer, row_models
+from .utils import report_time, map_in_threads, run_in_background
+from . import deadlines, incremental, jobs, settings, wire
 import time
 
 
-CACHE_VERSION = 5
-CACHE_TIMEOUT = 60 * 60
-try:
-  cache = caches['curious']
-except InvalidCacheBackendError:
-  cache = caches['default']
-
-
 def get_param_value(params, k, default):
   true_values = ('1', 'true', 'True', 1)
   false_values = ('0', 'false', 'False', 0)
@@ -32,11 +31,48 @@ def get_param_value(params, k, default):
   return default
 
 
+def get_param_list(params, k):
+  """
+  Returns a list parameter, given either as a list or a comma separated
+  string, or None if the parameter is missing.
+  """
+  if k not in params or params[k] is None:
+    return None
+  value = params[k]
+  if isinstance(value, basestring):
+    value = [v.strip() for v in value.split(',') if v.strip()]
+  return list(value)
+
+
+def get_timeout(params, max_timeout):
+  """
+  Returns the time budget of a request in seconds: the timeout parameter,
+  capped at max_timeout. Either can be None, for no limit. Raises ValueError
+  for bad timeouts.
+  """
+  timeout = float(params['timeout']) if params.get('timeout') not in (None, '') else None
+  if timeout is not None and (math.isnan(timeout) or math.isinf(timeout)):
+    raise ValueError('Timeout is not a number')
+  if timeout is not None and timeout < 0:
+    raise ValueError('Negative timeout')
+  if max_timeout is not None and (timeout is None or timeout > max_timeout):
+    timeout = max_timeout
+  return timeout
+
+
 class JSONView(View):
 
   def _return(self, code, result):
     res = {'result': result}
-    return HttpResponse(json.dumps(res), status=code, content_type='application/json')
+    return HttpResponse(dumps(res), status=code, content_type='application/json')
+
+  def _stream(self, code, result):
+    """
+    Returns result as a streaming response, encoding it incrementally.
+    """
+    res = {'result': result}
+    return StreamingHttpResponse(iterencode(res, settings.STREAM_CHUNK_SIZE), status=code,
+                                 content_type='application/json')
 
   def _error(self, code, message):
     res = {'error': {'message': message}}
@@ -49,6 +85,15 @@ class ModelListView(JSONView):
     return self._return(200, model_registry.model_names)
 
 
+class CacheStatsView(JSONView):
+  """
+  Returns counters of the query cache in this process, for tuning it.
+  """
+
+  def get(self, request):
+    return self._return(200, dict(admission=admission.counters, tiered=tiered_cache.counters))
+
+
 class ModelView(JSONView):
 
   @staticmethod
@@ -61,113 +106,197 @@ class ModelView(JSONView):
     return d
 
   @staticmethod
-  def objects_to_dict(objects, ignore_excludes=False, follow_fk=True):
+  def objects_to_dict(objects, ignore_excludes=False, follow_fk=True, fields=None):
     if len(objects) == 0:
       return dict(fields=[], objects=[])
+    serializer = get_serializer(objects[0].__class__, ignore_excludes, follow_fk, fields)
+    return serializer(objects)
 
-    fields = []
-    fk = []
-    is_model = True
-    add_pk = False
+  @staticmethod
+  def fetch_objects(model_class, ids, follow_fk, fields=None):
+    """
+    Fetches objects by ids. If `fields` is not None, only loads these fields
+    and only follows FKs among them.
+    """
 
-    obj = objects[0]
-    model_name = model_registry.get_name(obj.__class__)
-    model_manager = model_registry.get_manager(model_name)
-    if ignore_excludes is True:
-      excludes = []
-    else:
-      excludes = model_manager.field_excludes
+    if not hasattr(model_class, '_meta'):
+      return model_class.fetch(ids)
+
+    fks = []
+    only = [model_class._meta.pk.name]
+    for f in model_class._meta.fields:
+      if fields is not None and f.column not in fields:
+        continue
+      only.append(f.name)
+      if type(f) == ForeignKey:
+        fks.append(f)
+    q = model_class.objects.filter(pk__in=ids)
+
+    if len(fks) > 0 and follow_fk is True:
+      # objects FKs point to, and what their labels are built from
+      related = []
+      for f in fks:
+        related.append(f.name)
+        try:
+          related_manager = model_registry.get_manager_by_class(f.related_model)
+        except Exception:
+          # not a registered model
+          continue
+        related.extend('%s__%s' % (f.name, path) for path in related_manager.label_select_related)
+      q = q.select_related(*related)
+
+    # properties may use any field, load them all if properties are wanted
+    manager = model_registry.get_manager_by_class(model_class)
+    if fields is not None and not any(f in fields for f in manager.property_fields):
+      q = q.only(*only)
+    return list(q)
 
-    if hasattr(obj, '_meta'):
-      for f in obj._meta.fields:
-        if f.column not in excludes:
-          fields.append(f.column)
-          fk.append(f.name if type(f) == ForeignKey else None)
+  @staticmethod
+  def get_objects_as_json(model_class, ids, ignore_excludes, follow_fk, force_reload, app,
+                          fields=None):
+    """
+    Returns data of objects with the given ids, optionally only of the given
+    fields.
+    """
 
-      if 'id' not in fields:
-        fields.append('pk')
-        fk.append(None)
-        add_pk = True
+    r = ModelView.get_objects_as_raw_json(model_class, ids, ignore_excludes, follow_fk,
+                                          force_reload, app, fields)
+    return json.loads(dumps(r))
 
-      for f in model_manager.property_fields:
-        fields.append(f)
-        fk.append(None)
+  @staticmethod
+  def get_objects_as_raw_json(model_class, ids, ignore_excludes, follow_fk, force_reload, app,
+                              fields=None):
+    """
+    Like get_objects_as_json, but data from the cache is returned as RawJSON,
+    to be included in responses without decoding it first. Django model
+    objects are cached individually, so requests for overlapping sets of ids
+    share cached rows and only objects missing from the cache are fetched.
+    """
 
-    else:
-      is_model = False
-      for f in obj.fields():
-        fields.append(f)
-        fk.append(None)
-
-    packed = []
-    urls = []
-    for obj in objects:
-      obj_url = model_registry.get_manager(model_name).url_of(obj)
-      values = []
-
-      for column, fk_name in zip(fields, fk):
-        if is_model:
-          value = getattr(obj, column)
-        else:
-          value = obj.get(column)
-
-        if type(value) is Decimal:
-          value = float(value)
-        elif not type(value) in (long, int, float, bool, types.NoneType):
-          value = unicode(value)
-        if fk_name is not None and follow_fk is True:
-          v = getattr(obj, fk_name)
-          if v is not None:
-            fk_model_name = model_registry.get_name(v.__class__)
-            fk_url = None
-            try:
-              fk_url = model_registry.get_manager(fk_model_name).url_of(v)
-            except:
-              fk_url = None
-            value = (fk_model_name, v.pk, str(v), fk_url)
-        values.append(value)
-
-      urls.append(obj_url)
-      packed.append(values)
-
-    if add_pk is True:
-      assert fields[-1] == 'pk'
-      fields[-1] = 'id'
-    return dict(fields=fields, objects=packed, urls=urls)
+    if fields is not None:
+      fields = sorted(set(fields))
+
+    if not hasattr(model_class, '_meta'):
+      # custom models may not return objects with the pks they are fetched by,
+      # so cache their data as a whole
+      cache_k = make_key('object_data', app, ModelManager.model_name(model_class), ids,
+                         ignore_excludes, follow_fk, fields, model_registry.fingerprint)
+      cache_v = tiered_cache.get(cache_k) if app is not None and not force_reload else None
+      if cache_v is not None:
+        return RawJSON(cache_v)
+      objs = ModelView.fetch_objects(model_class, ids, follow_fk, fields)
+      r = ModelView.objects_to_dict(objs, ignore_excludes=ignore_excludes, follow_fk=follow_fk,
+                                    fields=fields)
+      if app is not None:
+        tiered_cache.set(cache_k, dumps(r), CACHE_TIMEOUT, new=not force_reload)
+      return r
+
+    pks = ModelView.to_pks(model_class, ids)
+    columns, rows, order = ModelView.get_object_rows(model_class, pks, ignore_excludes,
+                                                     follow_fk, force_reload, app, fields)
+    return ModelView.rows_to_dict(columns, rows, pks, order)
 
   @staticmethod
-  def get_objects_as_json(model_class, ids, ignore_excludes, follow_fk, force_reload, app):
-    cache_k = 'curious_cache_v%s_app_%s_object_data_%s/%s_%s_%s' % (
-      CACHE_VERSION, app, model_class, ids, ignore_excludes, follow_fk
-    )
-    cache_k = hash(cache_k)
-    if app is None or force_reload:
-      cache_v = None
-    else:
-      cache_v = cache.get(cache_k)
-
-    if cache_v is None:
-      if hasattr(model_class, '_meta'):
-        fks = []
-        for f in model_class._meta.fields:
-          if type(f) == ForeignKey:
-            fks.append(f.name)
-        q = model_class.objects.filter(pk__in=ids)
-        if len(fks) > 0 and follow_fk is True:
-          q = q.select_related(*fks)
-        r = ModelView.objects_to_dict(list(q), ignore_excludes=ignore_excludes, follow_fk=follow_fk)
+  def to_pks(model_class, ids):
+    """
+    Converts ids to pk values of a Django model, without duplicates or Nones.
+    """
 
-      else:
-        objs = model_class.fetch(ids)
-        r = ModelView.objects_to_dict(objs, ignore_excludes=ignore_excludes, follow_fk=follow_fk)
+    to_pk = model_class._meta.pk.to_python
+    pks = []
+    seen = set([None])
+    for pk in (to_pk(i) for i in ids):
+      if pk not in seen:
+        seen.add(pk)
+        pks.append(pk)
+    return pks
 
-      if app is not None:
-        cache.set(cache_k, json.dumps(r), CACHE_TIMEOUT)
+  @staticmethod
+  def get_object_rows(model_class, pks, ignore_excludes, follow_fk, force_reload, app, fields):
+    """
+    Returns the fields of a Django model, a dictionary of values and URL of
+    each object found with the given pks, keyed by pk, and the pks found in
+    the order the database returns the objects in. Fields, rows and order come
+    from the cache where possible; rows and order are cached under the
+    versions of the models they are built from, so changes to these models
+    are never served from the cache.
+    """
 
+    model_name = ModelManager.model_name(model_class)
+    fingerprint = model_registry.fingerprint
+    use_cache = app is not None
+    read_cache = use_cache and not force_reload
+    versions = model_versions.versions(row_models(model_class, follow_fk)) if use_cache else None
+
+    def row_key(pk):
+      return make_key('object_row', app, model_name, pk, ignore_excludes, follow_fk, fields,
+                      fingerprint, versions)
+    fields_k = make_key('object_fields', app, model_name, ignore_excludes, follow_fk, fields,
+                        fingerprint)
+    order_k = make_key('object_order', model_name, model_class._meta.ordering, sorted(pks),
+                       versions)
+
+    columns = None
+    rows = {}
+    cached_order = None
+    if read_cache:
+      keys = dict((row_key(pk), pk) for pk in pks)
+      cached = tiered_cache.get_many(keys.keys() + [fields_k, order_k])
+      columns = cached.pop(fields_k, None)
+      cached_order = cached.pop(order_k, None)
+      if columns is not None:
+        rows = dict((keys[k], (RawJSON(values), url)) for k, (values, url) in cached.iteritems())
+
+    missing = [pk for pk in pks if pk not in rows]
+    objs = []
+    to_cache = {}
+    if len(missing) > 0:
+      objs = ModelView.fetch_objects(model_class, missing, follow_fk, fields)
+      r = ModelView.objects_to_dict(objs, ignore_excludes=ignore_excludes, follow_fk=follow_fk,
+                                    fields=fields)
+      if len(objs) > 0:
+        columns = r['fields']
+        if use_cache:
+          to_cache[fields_k] = columns
+          for obj, values, url in zip(objs, r['objects'], r['urls']):
+            values = dumps(values)
+            to_cache[row_key(obj.pk)] = (values, url)
+            rows[obj.pk] = (RawJSON(values), url)
+        else:
+          for obj, values, url in zip(objs, r['objects'], r['urls']):
+            rows[obj.pk] = (values, url)
+
+    if len(objs) == len(rows):
+      order = [obj.pk for obj in objs]
+    elif cached_order is not None:
+      order = cached_order
+    elif model_class._meta.ordering:
+      # objects read from the cache come in the model's default ordering too
+      order = list(model_class.objects.filter(pk__in=rows.keys()).values_list('pk', flat=True))
     else:
-      r = json.loads(cache_v)
+      # without a default ordering, the database returns objects looked up by
+      # pk in pk order
+      order = sorted(rows)
+
+    if use_cache and (len(to_cache) > 0 or cached_order is None):
+      to_cache[order_k] = order
+      # rows just found missing are new, unless reloaded; the fields of the
+      # model, if cached, are the same
+      tiered_cache.set_many(to_cache, CACHE_TIMEOUT, new=read_cache)
 
-    return r
+    return columns, rows, order
+
+  @staticmethod
+  def rows_to_dict(columns, rows, pks, order):
+    # rows are in the order the database returns them, whether they came from
+    # the cache or the database
+    wanted = set(pks)
+    found = [rows[pk] for pk in order if pk in wanted]
+    if len(found) == 0:
+      return dict(fields=[], objects=[])
+    return dict(fields=columns,
+                objects=[values for values, url in found],
+                urls=[url for values, url in found])
 
   def get(self, request, model_name):
     try:
@@ -200,7 +329,10 @@ class ModelView(JSONView):
       return self._error(404, "Unknown model '%s'" % model_name)
 
     ignore_excludes = get_param_value(data, 'x', False)
-    r = ModelView.get_objects_as_json(cls, data['ids'], ignore_excludes, True, True, app)
+    force = get_param_value(data, 'r', False)
+    fields = get_param_list(data, 'fields')
+    r = ModelView.get_objects_as_raw_json(cls, data['ids'], ignore_excludes, True, force, app,
+                                          fields)
     return self._return(200, r)
 
 
@@ -248,63 +380,299 @@ class ObjectView(JSONView):
 
 class QueryView(JSONView):
 
-  # if query takes longer than this number of seconds, cache it
-  QUERY_TIME_CACHING_THRESHOLD = 10
+  # keys of queries being refreshed in the background by this process
+  _refreshing = set()
+  _refreshing_lock = threading.Lock()
 
-  def get_query_results(self, query, force_reload, force_cache, app):
-    cache_k = 'curious_cache_v%s_query_%s' % (CACHE_VERSION, query.query_string)
-    cache_k = hash(cache_k)
-    if app is None or force_reload:
-      cache_v = None
-    else:
-      cache_v = cache.get(cache_k)
+  # called with the index of each step of a query as it completes and the
+  # number of result rows so far, e.g. to report progress of a job
+  progress = None
+
+  # if set, results of queries taking longer than this many seconds are
+  # always cached, regardless of the admission policy
+  QUERY_TIME_CACHING_THRESHOLD = None
 
-    if cache_v is None:
+  @staticmethod
+  def query_key(query):
+    return make_key('query', query.canonical_string, model_registry.fingerprint)
+
+  @staticmethod
+  def cache_results(cache_k, results, versions, levels=None):
+    result_id = result_id_of(cache_k, results['computed_on'])
+    result_store.save(result_id, results)
+    if levels is not None:
+      # levels can be big; only the result id they are stored under is cached
+      result_store.save_levels(result_id, levels)
+    tiered_cache.set(cache_k, dict(result_id=result_id, cached_at=time.time(), versions=versions,
+                                   incremental=levels is not None),
+                     settings.QUERY_CACHE_TIMEOUT)
+
+  def update_results(self, query, cache_k, cached):
+    """
+    Updates and caches results of a simple query after objects it read
+    changed, without computing the results again. Returns None if the results
+    cannot be updated.
+    """
+
+    versions, changes = model_versions.changes(cached['versions'], settings.INCREMENTAL_MAX_CHANGES)
+    chain = incremental.chain_of(query)
+    if changes is None or chain is None:
+      return None
+    levels = result_store.load_levels(cached['result_id'])
+    if levels is None:
+      return None
+
+    levels = incremental.update(chain, levels, changes)
+    results = dict(incremental.results_of(chain, levels), computed_on=datetime.now())
+    QueryView.cache_results(cache_k, results, versions, levels)
+    return results
+
+  def refresh_results(self, query, cache_k):
+    """
+    Recomputes and caches results of a query in the background, unless this
+    or another process sharing the cache is already doing so. Returns True if
+    a refresh was started.
+    """
+
+    with QueryView._refreshing_lock:
+      if cache_k in QueryView._refreshing:
+        return False
+      QueryView._refreshing.add(cache_k)
+
+    lease_k = make_key('query_refresh', cache_k)
+    if not cache.add(lease_k, True, settings.QUERY_REFRESH_TIMEOUT):
+      with QueryView._refreshing_lock:
+        QueryView._refreshing.discard(cache_k)
+      return False
+
+    def refresh():
+      try:
+        QueryView.cache_results(cache_k, *self.run_versioned_query(query, True))
+      finally:
+        cache.delete(lease_k)
+        with QueryView._refreshing_lock:
+          QueryView._refreshing.discard(cache_k)
+
+    run_in_background(refresh)
+    return True
+
+  def join_computation(self, cache_k):
+    """
+    Coalesces identical concurrent queries. Returns (None, lease key) if this
+    process took the lease to compute the results, or (results, None) with
+    the results computed by the process holding the lease. Returns (None,
+    None) if waiting timed out, or the other process finished without
+    sharing up to date results.
+    """
+
+    lease_k = make_key('query_lease', cache_k)
+    done_k = make_key('query_done', cache_k)
+    if cache.add(lease_k, True, settings.QUERY_COALESCE_TIMEOUT):
+      # results shared by an earlier computation may be out of date
+      cache.delete(done_k)
+      return None, lease_k
+
+    deadline = time.time()+settings.QUERY_COALESCE_TIMEOUT
+    while time.time() < deadline:
+      deadlines.check()
+      time.sleep(settings.QUERY_COALESCE_POLL)
+      done = cache.get(done_k)
+      if done is not None and model_versions.unchanged(done['versions']):
+        results = result_store.load(done['result_id'])
+        if results is not None:
+          return results, None
+      if cache.get(lease_k) is None:
+        break
+    return None, None
+
+  def get_query_results(self, query, force_reload, force_cache, app):
+    cache_k = QueryView.query_key(query)
+    slow_k = make_key('query_slow', cache_k)
+    results = None
+    slow = False
+    if app is not None:
+      admission.requested(cache_k)
+    if app is not None and not force_reload:
+      # the cache only holds the id of results kept in the result store
+      found = tiered_cache.get_many([cache_k, slow_k])
+      cached = found.get(cache_k)
+      slow = found.get(slow_k, False)
+      # results are out of date once models they were computed from change
+      if cached is not None and model_versions.unchanged(cached['versions']):
+        results = result_store.load(cached['result_id'])
+        # stale results are returned as they are while they are refreshed
+        if results is not None and time.time()-cached['cached_at'] > settings.QUERY_SOFT_TTL:
+          results['stale'] = True
+          self.refresh_results(query, cache_k)
+      elif cached is not None and cached['incremental']:
+        results = self.update_results(query, cache_k, cached)
+
+    # only queries known to be slow are worth waiting for
+    lease_k = None
+    if results is None and slow:
+      results, lease_k = self.join_computation(cache_k)
+
+    if results is None:
       t = time.time()
-      cache_v = self.run_query(query)
+      try:
+        results, versions, levels = self.run_versioned_query(query, app is not None)
+      except Exception:
+        if lease_k is not None:
+          cache.delete(lease_k)
+        raise
       t = time.time() - t
 
+      if lease_k is not None:
+        # share results with processes waiting for them
+        result_id = result_id_of(cache_k, results['computed_on'])
+        result_store.save(result_id, results)
+        cache.set(make_key('query_done', cache_k), dict(result_id=result_id, versions=versions),
+                  settings.QUERY_COALESCE_TIMEOUT)
+        cache.delete(lease_k)
+      elif app is not None and t > settings.QUERY_COALESCE_MIN_TIME:
+        tiered_cache.set(slow_k, True, settings.QUERY_CACHE_TIMEOUT)
+
       if app is not None:
-        if t > QueryView.QUERY_TIME_CACHING_THRESHOLD or force_cache:
-          cache.set(cache_k, cache_v, CACHE_TIMEOUT)
-        else:
-          # remove old cache if there are any
-          cache.set(cache_k, None)
+        size = sum(len(r['objects']) for r in results['results'])
+        threshold = self.QUERY_TIME_CACHING_THRESHOLD
+        force_admit = force_cache or (threshold is not None and t > threshold)
+        if admission.admit(cache_k, t, size, force=force_admit):
+          QueryView.cache_results(cache_k, results, versions, levels)
+        elif force_reload:
+          # cached results, if any, are out of date
+          tiered_cache.delete(cache_k)
+
+    return results
+
+  @staticmethod
+  def result_to_dict(obj_src, join_index, tree):
+    model = None
+    for obj, src in obj_src:
+      if obj is not None:
+        model = obj.__class__
+        if hasattr(model, '_deferred') and model._deferred:
+          model = model.__base__
+        break
+
+    if model is not None:
+      model_name = model_registry.get_name(model)
+    else:
+      model_name = None
+
+    return {
+      'model': model_name,
+      'join_index': join_index,
+      'objects': [(obj.pk, src) if obj is not None else (None, src) for obj, src in obj_src],
+      'tree': tree,
+    }
+
+  @staticmethod
+  def page_of(result, offset, limit):
+    """
+    Returns a result with only a page of its objects, plus the total number
+    of objects and the offset of the next page, or None on the last page.
+    """
+    count = len(result['objects'])
+    return dict(result, objects=result['objects'][offset:offset+limit], count=count,
+                offset=offset, next=offset+limit if offset+limit < count else None)
 
-    return cache_v
+  def run_versioned_query(self, query, keep_levels=False):
+    """
+    Runs a query, returning its results and the versions of the models it
+    read, taken before running it so changes made meanwhile are not missed.
+    With keep_levels, e.g. for results to be cached, simple queries are run
+    keeping the objects reached at each step, also returned, so the results
+    can be updated incrementally; these levels are None for other queries.
+    """
+
+    models = query.models
+    versions = model_versions.versions(models)
+
+    chain = None
+    if keep_levels and settings.INCREMENTAL_MAX_CHANGES > 0:
+      chain = incremental.chain_of(query)
+    if chain is not None:
+      with deadlines.statement_timeout():
+        levels = incremental.run_chain(chain, progress=self.progress,
+                                       max_paths=settings.INCREMENTAL_MAX_PATHS)
+      if levels is not None:
+        results = dict(incremental.results_of(chain, levels), computed_on=datetime.now())
+        return results, versions, levels
+
+    with deadlines.statement_timeout():
+      results = self.run_query(query)
+
+    # outputs of function relationships are only known now
+    outputs = set(model_registry.get_manager(r['model']).model_class
+                  for r in results['results'] if r['model'] is not None)
+    outputs = [m for m in outputs if hasattr(m, '_meta') and m not in models]
+    if len(outputs) > 0:
+      versions.update(model_versions.versions(outputs))
+    return results, versions, None
 
   @report_time
   def run_query(self, query):
-    res, last_model = query()
-    results = []
-
-    for obj_src, join_index, tree in res:
-      model = None
-      for obj, src in obj_src:
-        if obj is not None:
-          model = obj.__class__
-          if hasattr(model, '_deferred') and model._deferred:
-            model = model.__base__
-          break
-
-      if model is not None:
-        model_name = model_registry.get_name(model)
-      else:
-        model_name = None
-
-      d = {
-        'model': model_name,
-        'join_index': join_index,
-        'objects': [(obj.pk, src) if obj is not None else (None, src) for obj, src in obj_src],
-        'tree': tree,
-      }
-      results.append(d)
+    if self.progress is None:
+      res, last_model = query()
+    else:
+      res, last_model = [], None
+      for event, value in query.iterate():
+        if event == 'result':
+          res.append(value)
+        elif event == 'model':
+          last_model = value
+        elif event == 'step':
+          self.progress(value[0], sum(len(r[0]) for r in res))
+    results = [QueryView.result_to_dict(*r) for r in res]
 
     if last_model is not None:
       last_model = model_registry.get_name(last_model)
 
     return dict(last_model=last_model, results=results, computed_on=datetime.now())
 
+  @report_time
+  def load_data(self, results, ignore_excludes, follow_fk, force_reload, app, fields):
+    """
+    Loads data of objects in each result. Objects of a Django model are fetched
+    once for all results, possibly concurrently with objects of other models,
+    then handed out to each result.
+    """
+
+    if fields is not None:
+      fields = sorted(set(fields))
+
+    models = {}
+    result_pks = []
+    for result in results:
+      pks = None
+      if result['model']:
+        model = model_registry.get_manager(result['model']).model_class
+        if hasattr(model, '_meta'):
+          pks = ModelView.to_pks(model, [obj[0] for obj in result['objects']])
+          models.setdefault(model, set()).update(pks)
+      result_pks.append(pks)
+
+    def load(model):
+      return ModelView.get_object_rows(model, list(models[model]), ignore_excludes, follow_fk,
+                                       force_reload, app, fields)
+    model_list = models.keys()
+    model_rows = dict(zip(model_list, map_in_threads(load, model_list, settings.DATA_LOAD_THREADS)))
+
+    data = []
+    for result, pks in zip(results, result_pks):
+      if not result['model']:
+        data.append([])
+      elif pks is None:
+        model = model_registry.get_manager(result['model']).model_class
+        ids = [obj[0] for obj in result['objects']]
+        data.append(ModelView.get_objects_as_raw_json(model, ids, ignore_excludes, follow_fk,
+                                                      force_reload, app, fields))
+      else:
+        model = model_registry.get_manager(result['model']).model_class
+        columns, rows, order = model_rows[model]
+        data.append(ModelView.rows_to_dict(columns, rows, pks, order))
+    return data
+
   @report_time
   def _process(self, params):
 
@@ -318,8 +686,24 @@ class QueryView(JSONView):
     ignore_excludes = get_param_value(params, 'x', False)
     force = get_param_value(params, 'r', False)
     force_cache = get_param_value(params, 'fc', False)
+    fields = get_param_list(params, 'fields')
+    stream = get_param_value(params, 's', False)
+    fmt = params.get('format', 'json')
     app = params['app'] if 'app' in params else None
 
+    if fmt not in wire.FORMATS:
+      return self._error(400, "Unknown format '%s'" % fmt)
+    try:
+      page_size = int(params['p']) if 'p' in params else None
+    except ValueError:
+      return self._error(400, 'Bad page size')
+    if page_size is not None and page_size < 1:
+      return self._error(400, 'Bad page size')
+    try:
+      timeout = get_timeout(params, settings.QUERY_MAX_TIMEOUT)
+    except ValueError:
+      return self._error(400, 'Bad timeout')
+
     try:
       query = Query(q)
     except Exception as e:
@@ -331,32 +715,41 @@ class QueryView(JSONView):
     if check_only:
       return self._return(200, dict(query=q))
 
+    if app is not None:
+      query_log.record(query.canonical_string, query.query_string, app)
+
     try:
-      results = self.get_query_results(query, force, force_cache, app)
+      with deadlines.within(timeout):
+        results = self.get_query_results(query, force, force_cache, app)
+    except deadlines.QueryTimeout as e:
+      return self._error(408, str(e))
     except Exception as e:
       import traceback
       traceback.print_exc()
       return self._error(400, str(e))
 
+    # paged mode: store results, return the first page of each result
+    if page_size is not None:
+      result_id = result_id_of(QueryView.query_key(query), results['computed_on'])
+      result_store.save(result_id, results)
+      results = dict(results, result_id=result_id,
+                     results=[QueryView.page_of(r, 0, page_size) for r in results['results']])
+
     t = datetime.now() - results['computed_on']
     if t.seconds > 300:
       results['computed_since'] = str(naturaltime(results['computed_on']))
     results['computed_on'] = str(results['computed_on'])
 
     # data mode
-    objects = []
     if load_data:
-      for result in results['results']:
-        if result['model']:
-          model = model_registry.get_manager(result['model']).model_class
-          ids = [obj[0] for obj in result['objects']]
-          objs = ModelView.get_objects_as_json(model, ids, ignore_excludes, follow_fk, force, app)
-          objects.append(objs)
-        else:
-          objects.append([])
-      results['data'] = objects
+      results['data'] = self.load_data(results['results'], ignore_excludes, follow_fk, force,
+                                       app, fields)
+
+    results = wire.encode_results(results, fmt)
 
     # print results
+    if stream:
+      return self._stream(200, results)
     return self._return(200, results)
 
   def get(self, request):
@@ -371,3 +764,203 @@ class QueryView(JSONView):
     except:
       return self._error(400, 'Cannot parse request')
     return self._process(params)
+
+
+class ResultView(QueryView):
+  """
+  Pages through query results stored in paged mode. Returns objects of the
+  i-th result from an offset, with their data in data mode.
+  """
+
+  http_method_names = ['get']
+
+  def get(self, request, result_id):
+    params = request.GET
+    summary = result_store.summary(result_id)
+    if summary is None:
+      return self._error(404, "Unknown or expired result '%s'" % result_id)
+
+    try:
+      index = int(params.get('i', 0))
+      offset = int(params.get('offset', 0))
+      limit = int(params.get('limit', settings.RESULT_PAGE_SIZE))
+    except ValueError:
+      return self._error(400, 'Bad result index, offset or limit')
+    if index < 0 or index >= len(summary['results']) or offset < 0 or limit < 1:
+      return self._error(400, 'Bad result index, offset or limit')
+
+    objects = result_store.page(result_id, index, offset, limit)
+    if objects is None:
+      return self._error(404, "Unknown or expired result '%s'" % result_id)
+
+    r = summary['results'][index]
+    count = r['count']
+    result = dict(r, objects=objects, offset=offset,
+                  next=offset+limit if offset+limit < count else None)
+
+    if get_param_value(params, 'd', False):
+      result['data'] = self.load_data([result],
+                                      get_param_value(params, 'x', False),
+                                      get_param_value(params, 'fk', True),
+                                      get_param_value(params, 'r', False),
+                                      params.get('app'),
+                                      get_param_list(params, 'fields'))[0]
+
+    return self._return(200, dict(result_id=result_id, index=index,
+                                  last_model=summary['last_model'],
+                                  computed_on=str(summary['computed_on']), result=result))
+
+
+class QueryStreamView(QueryView):
+  """
+  Executes a query, streaming newline delimited JSON records as the query
+  progresses: a "step" record with the time taken by each step, a "result"
+  record as soon as each result is complete, with its data in data mode, and
+  a final "done" record with the last model. Errors after the response has
+  started are reported with an "error" record.
+  """
+
+  def _records(self, query, load_data, ignore_excludes, follow_fk, force, app, fields, timeout):
+    started = time.time()
+
+    def record(kind, **kwargs):
+      kwargs['type'] = kind
+      kwargs['elapsed'] = time.time()-started
+      return dumps(kwargs)+'\n'
+
+    try:
+      index = 0
+      with deadlines.within(timeout), deadlines.statement_timeout():
+        for event, value in query.iterate():
+          if event == 'step':
+            yield record('step', step=value[0], time=value[1])
+          elif event == 'result':
+            result = QueryView.result_to_dict(*value)
+            if load_data:
+              result['data'] = self.load_data([result], ignore_excludes, follow_fk, force,
+                                              app, fields)[0]
+            yield record('result', index=index, result=result)
+            index += 1
+          elif event == 'model':
+            last_model = model_registry.get_name(value) if value is not None else None
+            yield record('done', last_model=last_model, computed_on=str(datetime.now()))
+    except deadlines.QueryTimeout as e:
+      # results already sent are complete, the ones not sent yet are missing
+      yield record('error', message=str(e), timeout=True)
+    except Exception as e:
+      import traceback
+      traceback.print_exc()
+      yield record('error', message=str(e))
+
+  def _process(self, params):
+
+    if 'q' not in params:
+      return self._error(400, 'Missing query')
+
+    load_data = get_param_value(params, 'd', False)
+    follow_fk = get_param_value(params, 'fk', True)
+    ignore_excludes = get_param_value(params, 'x', False)
+    force = get_param_value(params, 'r', False)
+    fields = get_param_list(params, 'fields')
+    app = params['app'] if 'app' in params else None
+
+    try:
+      timeout = get_timeout(params, settings.QUERY_MAX_TIMEOUT)
+    except ValueError:
+      return self._error(400, 'Bad timeout')
+
+    try:
+      query = Query(params['q'])
+    except Exception as e:
+      return self._error(400, str(e))
+
+    records = self._records(query, load_data, ignore_excludes, follow_fk, force, app, fields,
+                            timeout)
+    return StreamingHttpResponse(records, status=200, content_type='application/x-ndjson')
+
+
+class JobListView(QueryView):
+  """
+  Submits a query to run as a job, returning the job. Poll JobView for the
+  job's status and progress; once done, its results are paged through with
+  ResultView.
+  """
+
+  http_method_names = ['post']
+
+  @staticmethod
+  def job_to_dict(job):
+    return dict(job, created_at=str(job['created_at']), updated_at=str(job['updated_at']))
+
+  def _process(self, params):
+    if 'q' not in params:
+      return self._error(400, 'Missing query')
+
+    force = get_param_value(params, 'r', False)
+    force_cache = get_param_value(params, 'fc', False)
+    app = params['app'] if 'app' in params else None
+    try:
+      timeout = get_timeout(params, settings.JOB_MAX_TIMEOUT)
+    except ValueError:
+      return self._error(400, 'Bad timeout')
+
+    try:
+      query = Query(params['q'])
+    except Exception as e:
+      return self._error(400, str(e))
+
+    store = jobs.get_job_store()
+    job_id = store.create(query.query_string, app)
+
+    def cancelled():
+      job = store.get(job_id)
+      return job is None or job['status'] == jobs.CANCELLED
+
+    def run():
+      if not store.start(job_id):
+        return
+      view = JobListView(progress=lambda step, rows: store.update(job_id, step=step, rows=rows))
+      try:
+        with deadlines.within(timeout, cancelled):
+          results = view.get_query_results(query, force, force_cache, app)
+        result_id = result_id_of(QueryView.query_key(query), results['computed_on'])
+        result_store.save(result_id, results)
+      except deadlines.QueryCancelled:
+        return
+      except Exception as e:
+        import traceback
+        traceback.print_exc()
+        store.finish(job_id, jobs.FAILED, error=str(e))
+      else:
+        # jobs cancelled after their query finished stay cancelled
+        store.finish(job_id, jobs.DONE, result_id=result_id,
+                     rows=sum(len(r['objects']) for r in results['results']))
+
+    # with ATOMIC_REQUESTS, the job is only visible to workers once the request
+    # commits; until then, cancelled() would not find it
+    transaction.on_commit(lambda: jobs.job_runner.submit(run))
+    return self._return(202, JobListView.job_to_dict(store.get(job_id)))
+
+
+class JobView(JSONView):
+  """
+  Returns the status and progress of a job: the index of the last step
+  completed, the number of result rows so far and, once done, the id of its
+  results in the result store. Deleting a job cancels it, if it has not
+  finished yet.
+  """
+
+  def get(self, request, job_id):
+    job = jobs.get_job_store().get(job_id)
+    if job is None:
+      return self._error(404, "Unknown job '%s'" % job_id)
+    return self._return(200, JobListView.job_to_dict(job))
+
+  def delete(self, request, job_id):
+    store = jobs.get_job_store()
+    job = store.get(job_id)
+    if job is None:
+      return self._error(404, "Unknown job '%s'" % job_id)
+    if not store.cancel(job_id):
+      return self._error(409, "Job '%s' already finished" % job_id)
+    return self._return(200, JobListView.job_to_dict(store.get(job_id)))
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class CuriousConfig(AppConfig):
+  name = 'curious'
+
+  def ready(self):
+    # connect cache invalidation to model signals in every process using
+    # curious, not only in processes serving the curious API
+    from . import cache  # noqa
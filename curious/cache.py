@@ -0,0 +1,514 @@
+"""
+Caching for curious. Query results, object data and relationship adjacency
+lists are stored in the ``curious`` cache, or in the default cache if no
+``curious`` cache is configured. Query results and object data are also kept
+in memory by each process, see TieredCache.
+"""
+
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from django.apps import apps
+from django.core.cache import caches, InvalidCacheBackendError
+from django.db import router
+
+from . import changes, settings
+from .graph import traverse, get_related_model
+from .utils import CountMinSketch, LRUCache
+
+
+CACHE_VERSION = 5
+CACHE_TIMEOUT = 60 * 60
+try:
+  cache = caches['curious']
+except InvalidCacheBackendError:
+  cache = caches['default']
+
+
+def make_key(*parts):
+  """
+  Builds a cache key from a digest of the canonical JSON form of the given
+  parts and the cache version. Unlike Python's hash(), the digest is the same
+  in every process, so all workers sharing a cache can use each other's
+  entries.
+  """
+
+  canonical = json.dumps([CACHE_VERSION] + list(parts),
+                         sort_keys=True, separators=(',', ':'), default=unicode)
+  return 'curious:%s' % hashlib.sha256(canonical).hexdigest()
+
+
+def _approximate_size(value, depth=2):
+  """
+  Estimates the memory used by a cached value without serializing it again:
+  the length of strings, and sizes of items of containers, a few levels deep.
+  """
+
+  if isinstance(value, basestring):
+    return len(value)
+  if depth > 0 and isinstance(value, dict):
+    return sys.getsizeof(value) + sum(_approximate_size(k, depth-1)+_approximate_size(v, depth-1)
+                                      for k, v in value.iteritems())
+  if depth > 0 and isinstance(value, (list, tuple)):
+    return sys.getsizeof(value) + sum(_approximate_size(v, depth-1) for v in value)
+  return sys.getsizeof(value)
+
+
+class TieredCache(object):
+  """
+  A bounded in-process LRU cache, sized in approximate bytes, in front of a
+  shared cache. Reads are served from memory when possible; writes and
+  deletes go to both tiers.
+
+  Keys overwritten or deleted are appended to an invalidation log in the
+  shared cache; keys written for the first time are not, as no process can
+  hold copies of them. At most every sync_interval seconds, each process
+  drops its copies of keys logged since it last looked, or all its copies if
+  it cannot tell which changed, e.g. because the shared cache was cleared.
+  Values must not be changed once cached, as processes share them with
+  callers.
+  """
+
+  # log entries are dropped after this many seconds; processes further
+  # behind drop all their copies
+  LOG_TIMEOUT = 60 * 5
+  # processes more than this many log entries behind drop all their copies
+  # rather than reading the log
+  MAX_LOG_READ = 1000
+
+  def __init__(self, backend, max_bytes, sync_interval, timeout):
+    self.backend = backend
+    self.enabled = max_bytes > 0
+    self.sync_interval = sync_interval
+    self.local = LRUCache(max_bytes, sizeof=_approximate_size, timeout=timeout)
+    self.__counters = dict(local_hits=0, shared_hits=0, misses=0)
+    self.__seen = None
+    self.__synced_at = 0
+    self.__lock = threading.Lock()
+
+  @property
+  def counters(self):
+    """
+    Numbers of keys read from memory, read from the shared cache, and missing
+    from both, in this process.
+    """
+    with self.__lock:
+      return dict(self.__counters)
+
+  def __count(self, **counts):
+    with self.__lock:
+      for counter, n in counts.iteritems():
+        self.__counters[counter] += n
+
+  @staticmethod
+  def _log_key(seq):
+    return make_key('invalidation', seq)
+
+  def _sync(self):
+    with self.__lock:
+      if time.time()-self.__synced_at < self.sync_interval:
+        return
+      # log entries since the last sync have expired if it was long ago
+      expired = time.time()-self.__synced_at > TieredCache.LOG_TIMEOUT
+      self.__synced_at = time.time()
+      seen = self.__seen
+
+    # read the log without holding the lock, reads meanwhile use the copies
+    # as they are
+    seq_k = make_key('invalidation_seq')
+    seq = self.backend.get(seq_k)
+    log = None
+    if seq is None:
+      # no log, e.g. after the shared cache was cleared
+      self.backend.add(seq_k, 0, None)
+      seq = self.backend.get(seq_k)
+    elif seen is not None and seen < seq and not expired and seq-seen <= TieredCache.MAX_LOG_READ:
+      log = self.backend.get_many([TieredCache._log_key(i) for i in range(seen+1, seq+1)])
+      if len(log) < seq-seen:
+        log = None
+    elif seq == seen:
+      return
+
+    with self.__lock:
+      if log is None or self.__seen is None:
+        self.__seen = seq
+      else:
+        # our own writes may have moved past seq meanwhile
+        self.__seen = max(self.__seen, seq)
+    if log is None:
+      self.local.clear()
+    else:
+      for k in log.itervalues():
+        self.local.delete(k)
+
+  def _log(self, keys):
+    seq_k = make_key('invalidation_seq')
+    try:
+      seq = self.backend.incr(seq_k, len(keys))
+    except ValueError:
+      self.backend.add(seq_k, 0, None)
+      seq = self.backend.incr(seq_k, len(keys))
+    first = seq-len(keys)+1
+    self.backend.set_many(dict((TieredCache._log_key(first+i), k) for i, k in enumerate(keys)),
+                          TieredCache.LOG_TIMEOUT)
+    # skip our own writes when syncing, unless others wrote since last sync
+    with self.__lock:
+      if self.__seen == first-1:
+        self.__seen = seq
+
+  def get_many(self, keys):
+    if not self.enabled:
+      return self.backend.get_many(keys)
+
+    self._sync()
+    found = {}
+    missing = []
+    for k in keys:
+      value = self.local.get(k)
+      if value is None:
+        missing.append(k)
+      else:
+        found[k] = value
+
+    fetched = {}
+    if len(missing) > 0:
+      fetched = self.backend.get_many(missing)
+      for k, value in fetched.iteritems():
+        self.local.set(k, value)
+      found.update(fetched)
+    self.__count(local_hits=len(found)-len(fetched), shared_hits=len(fetched),
+                 misses=len(missing)-len(fetched))
+    return found
+
+  def get(self, k, default=None):
+    return self.get_many([k]).get(k, default)
+
+  def set_many(self, data, timeout, new=False):
+    """
+    Writes to both tiers. If new is True, the keys were just found missing
+    from the shared cache, so other processes hold no copies to drop.
+    """
+
+    self.backend.set_many(data, timeout)
+    if not self.enabled or len(data) == 0:
+      return
+    self._sync()
+    for k, value in data.iteritems():
+      self.local.set(k, value)
+    if not new:
+      self._log(data.keys())
+
+  def set(self, k, value, timeout, new=False):
+    self.set_many({k: value}, timeout, new)
+
+  def delete(self, k):
+    self.backend.delete(k)
+    if self.enabled:
+      self.local.delete(k)
+      self._log([k])
+
+  def clear(self):
+    self.backend.clear()
+    self.local.clear()
+
+
+class AdmissionPolicy(object):
+  """
+  Decides which query results are worth caching. Results are cached if the
+  computing time saved by serving them from the cache, estimated as
+  computing time times how often the query was recently requested in this
+  process, is at least CACHE_ADMIT_MIN_SAVING seconds for each
+  CACHE_ADMIT_SIZE_UNIT objects in the results, and results have at most
+  CACHE_ADMIT_MAX_SIZE objects.
+  """
+
+  def __init__(self):
+    self.requests = CountMinSketch()
+    self.__counters = dict(admitted=0, rejected=0, forced=0)
+    self.__lock = threading.Lock()
+
+  def __count(self, counter):
+    with self.__lock:
+      self.__counters[counter] += 1
+
+  @property
+  def counters(self):
+    """
+    Numbers of results admitted, rejected and forced into the cache by this
+    process, for tuning the policy.
+    """
+    with self.__lock:
+      return dict(self.__counters)
+
+  def requested(self, k):
+    self.requests.add(k)
+
+  def admit(self, k, seconds, size, force=False):
+    if force:
+      self.__count('forced')
+      return True
+
+    saving = seconds * max(self.requests.estimate(k), 1)
+    required = settings.CACHE_ADMIT_MIN_SAVING * (1 + size / float(settings.CACHE_ADMIT_SIZE_UNIT))
+    if saving >= required and size <= settings.CACHE_ADMIT_MAX_SIZE:
+      self.__count('admitted')
+      return True
+    self.__count('rejected')
+    return False
+
+
+admission = AdmissionPolicy()
+tiered_cache = TieredCache(cache, settings.LOCAL_CACHE_MAX_BYTES,
+                           settings.LOCAL_CACHE_SYNC_INTERVAL, settings.LOCAL_CACHE_TIMEOUT)
+
+
+class QueryLog(object):
+  """
+  A sample of recent query requests, kept in the shared cache as a ring of
+  (canonical query, app, query) entries. Queries are counted by their
+  canonical string, so queries differing only in whitespace or argument order
+  count as one.
+  """
+
+  def __init__(self, backend):
+    self.__backend = backend
+
+  def record(self, canonical_string, query_string, app):
+    if random.random() >= settings.QUERY_LOG_SAMPLE_RATE:
+      return
+    seq_k = make_key('query_log_seq')
+    try:
+      seq = self.__backend.incr(seq_k)
+    except ValueError:
+      self.__backend.add(seq_k, 0, None)
+      seq = self.__backend.incr(seq_k)
+    self.__backend.set(make_key('query_log', seq % settings.QUERY_LOG_SIZE),
+                       (canonical_string, app, query_string), None)
+
+  def most_frequent(self, n):
+    """
+    Returns (query, app) pairs of the n most frequent queries in the log.
+    """
+
+    keys = [make_key('query_log', i) for i in range(settings.QUERY_LOG_SIZE)]
+    counts = {}
+    query_strings = {}
+    for canonical_string, app, query_string in self.__backend.get_many(keys).itervalues():
+      counts[(canonical_string, app)] = counts.get((canonical_string, app), 0)+1
+      query_strings[(canonical_string, app)] = query_string
+    return [(query_strings[k], k[1])
+            for k, count in sorted(counts.iteritems(), key=lambda t: -t[1])[:n]]
+
+
+query_log = QueryLog(cache)
+
+
+class ModelVersions(object):
+  """
+  Version counters of Django models, bumped whenever instances of the models
+  change. Results derived from some models are up to date as long
+  as the versions of these models are the same as when the results were
+  computed. Versions missing from the cache start at a random number, so
+  versions lost from the cache are not mistaken for old ones.
+  """
+
+  def __init__(self, backend):
+    self.__backend = backend
+
+  @staticmethod
+  def _key(label):
+    return make_key('model_version', label)
+
+  @staticmethod
+  def _changes_key(label, version):
+    return make_key('model_changes', label, version)
+
+  def _start(self, k):
+    self.__backend.add(k, random.randint(0, 2**62), None)
+
+  def model_changed(self, model, pks):
+    # queries also read models that are not registered, e.g. in lookups
+    if not hasattr(model, '_meta'):
+      return
+    k = ModelVersions._key(model._meta.label)
+    try:
+      version = self.__backend.incr(k)
+    except ValueError:
+      self._start(k)
+      version = self.__backend.incr(k)
+    # changed pks of each version, for updating results incrementally
+    self.__backend.set(ModelVersions._changes_key(model._meta.label, version), pks,
+                       settings.QUERY_CACHE_TIMEOUT)
+
+  def versions(self, models):
+    """
+    Returns versions of the given Django models, keyed by model label.
+    """
+
+    labels = dict((ModelVersions._key(m._meta.label), m._meta.label) for m in models)
+    found = self.__backend.get_many(labels.keys())
+    for k in labels:
+      if k not in found:
+        self._start(k)
+        found[k] = self.__backend.get(k)
+    return dict((labels[k], v) for k, v in found.iteritems())
+
+  def changes(self, versions, max_versions):
+    """
+    Returns current versions of models, keyed by label, and the pks changed
+    since the given versions, as sets keyed by model; changed pks are None if
+    they are not all known, or if a model changed more than max_versions
+    times.
+    """
+
+    keys = dict((ModelVersions._key(label), label) for label in versions)
+    found = self.__backend.get_many(keys.keys())
+    current = dict((label, found.get(k)) for k, label in keys.iteritems())
+
+    change_keys = {}
+    for label, version in current.iteritems():
+      old = versions[label]
+      if version == old:
+        continue
+      if version is None or version < old or version-old > max_versions:
+        return current, None
+      for v in range(old+1, version+1):
+        change_keys[ModelVersions._changes_key(label, v)] = label
+
+    found = self.__backend.get_many(change_keys.keys())
+    changed = {}
+    for k, label in change_keys.iteritems():
+      if found.get(k) is None:
+        return current, None
+      changed.setdefault(apps.get_model(label), set()).update(found[k])
+    return current, changed
+
+  def unchanged(self, versions):
+    """
+    Returns True if models still have the given versions, keyed by label.
+    """
+
+    keys = dict((ModelVersions._key(label), label) for label in versions)
+    found = self.__backend.get_many(keys.keys())
+    return all(found.get(k) == versions[label] for k, label in keys.iteritems())
+
+
+model_versions = ModelVersions(cache)
+changes.listen(model_versions.model_changed)
+
+
+class EdgeCache(object):
+  """
+  Caches adjacency lists of relationships: for each source pk, the pks of the
+  objects the relationship leads to. Only relationships listed in a model
+  manager's ``cached_relationships`` are cached, and only unfiltered
+  traversals use the cache.
+
+  Each relationship has a generation, part of all its keys; changing an
+  instance of the source or target model of the relationship starts a new
+  generation, invalidating all cached adjacency lists of the relationship.
+  """
+
+  def __init__(self, backend):
+    self.__backend = backend
+    # output models of function relationships, learned when traversing them
+    self.__targets = {}
+
+  @staticmethod
+  def _generation_key(model_name, method):
+    return make_key('edges_generation', model_name, method)
+
+  @staticmethod
+  def _edge_key(generation, model_name, method, pk):
+    return make_key('edges', generation, model_name, method, pk)
+
+  def _generation(self, model_name, method):
+    k = EdgeCache._generation_key(model_name, method)
+    generation = self.__backend.get(k)
+    if generation is None:
+      self.__backend.add(k, uuid.uuid4().hex, None)
+      generation = self.__backend.get(k)
+    return generation
+
+  def invalidate(self, model_name, method):
+    k = EdgeCache._generation_key(model_name, method)
+    self.__backend.set(k, uuid.uuid4().hex, None)
+
+  def target_model(self, model_class, model_name, method):
+    target = get_related_model(getattr(model_class, method, None))
+    if target is None:
+      target = self.__targets.get((model_name, method))
+    return target
+
+  def model_changed(self, model, pks):
+    from curious import model_registry
+
+    for name in model_registry.model_names:
+      manager = model_registry.get_manager(name)
+      for method in manager.cached_relationships:
+        target = self.target_model(manager.model_class, manager.model_name, method)
+        if model in (manager.model_class, target):
+          self.invalidate(manager.model_name, method)
+
+  def wrap(self, manager, method, relationship):
+    """
+    Returns a relationship function traversing `relationship` through the
+    cache.
+    """
+
+    model_name = manager.model_name
+
+    def cached_relationship(instances, filter_f):
+      if getattr(filter_f, 'filters', None):
+        return traverse(instances, relationship, filters=filter_f)
+
+      generation = self._generation(model_name, method)
+      keys = dict((EdgeCache._edge_key(generation, model_name, method, obj.pk), obj)
+                  for obj in instances)
+      hits = self.__backend.get_many(keys.keys())
+
+      obj_src = []
+      for k, (label, pks) in hits.iteritems():
+        if len(pks) == 0:
+          continue
+        src = keys[k].pk
+        model = apps.get_model(label)
+        db = router.db_for_read(model)
+        pk_attname = model._meta.pk.attname
+        obj_src.extend((model.from_db(db, [pk_attname], [pk]), src) for pk in pks)
+
+      missing = [obj for k, obj in keys.iteritems() if k not in hits]
+      if len(missing) == 0:
+        return obj_src
+
+      fetched = traverse(missing, relationship, filters=filter_f)
+      adjacency = dict((obj.pk, []) for obj in missing)
+      label = None
+      for obj, src in fetched:
+        if not hasattr(obj, '_meta'):
+          # cannot rebuild instances of custom models from their pks
+          label = None
+          break
+        label = obj._meta.label
+        adjacency.setdefault(src, []).append(obj.pk)
+
+      if label is not None:
+        self.__targets[(model_name, method)] = apps.get_model(label)
+      if label is not None or len(fetched) == 0:
+        self.__backend.set_many(
+          dict((EdgeCache._edge_key(generation, model_name, method, src), (label, pks))
+               for src, pks in adjacency.iteritems()),
+          CACHE_TIMEOUT
+        )
+
+      return obj_src + fetched
+
+    return cached_relationship
+
+
+edge_cache = EdgeCache(cache)
+changes.listen(edge_cache.model_changed)
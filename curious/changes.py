@@ -0,0 +1,86 @@
+"""
+Tracking changes to model instances. Curious caches derived data (adjacency
+lists, serialized objects, query results) and uses Django model signals to
+learn when the underlying rows change. Listeners are notified once the
+transaction making the changes commits, so data computed meanwhile from
+uncommitted rows is not mistaken for up to date, and only of changes to
+models curious reads.
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+
+_listeners = []
+
+# (registry version, models reachable from registered models)
+_watched = (None, frozenset())
+
+
+def listen(f):
+  """
+  Registers a function to call when model instances change. The function is
+  called with the model class and a list of changed pks; the list is None if
+  the changed pks are not known, e.g. after clearing a M2M relationship.
+  """
+
+  if f not in _listeners:
+    _listeners.append(f)
+  return f
+
+
+def notify(model, pks):
+  for f in list(_listeners):
+    f(model, pks)
+
+
+def watched_models():
+  """
+  Returns the Django models curious reads: registered models, and models
+  reached from them through relationships, e.g. by lookups in filters.
+  """
+
+  global _watched
+  from curious import model_registry
+
+  version = model_registry.version
+  if _watched[0] != version:
+    models = set()
+    todo = [m for m in model_registry.model_classes if hasattr(m, '_meta')]
+    while len(todo) > 0:
+      model = todo.pop()
+      if model in models:
+        continue
+      models.add(model)
+      for f in model._meta.get_fields(include_hidden=True):
+        if f.is_relation and f.related_model is not None:
+          todo.append(f.related_model)
+    _watched = (version, frozenset(models))
+  return _watched[1]
+
+
+def _notify_on_commit(model, pks, using):
+  if model in watched_models():
+    transaction.on_commit(lambda: notify(model, pks), using=using)
+
+
+def _on_save(sender, instance, using, **kwargs):
+  _notify_on_commit(sender, [instance.pk], using)
+
+
+def _on_delete(sender, instance, using, **kwargs):
+  _notify_on_commit(sender, [instance.pk], using)
+
+
+def _on_m2m_changed(sender, instance, action, model, pk_set, using, **kwargs):
+  if action not in ('post_add', 'post_remove', 'post_clear'):
+    return
+  # both sides of the relationship change; the through model does not get
+  # its own save or delete signals
+  _notify_on_commit(instance.__class__, [instance.pk], using)
+  _notify_on_commit(model, list(pk_set) if pk_set is not None else None, using)
+
+
+post_save.connect(_on_save, weak=False, dispatch_uid='curious_changes_post_save')
+post_delete.connect(_on_delete, weak=False, dispatch_uid='curious_changes_post_delete')
+m2m_changed.connect(_on_m2m_changed, weak=False, dispatch_uid='curious_changes_m2m_changed')
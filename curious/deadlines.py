@@ -0,0 +1,136 @@
+"""
+Time budgets and cancellation of queries. A deadline is set for the current
+thread with `within`; queries call `check` between steps and between levels
+of recursive traversals, which raises QueryTimeout once the deadline has
+passed, or QueryCancelled once the deadline's cancel check returns True.
+Statements sent to PostgreSQL and MySQL databases while running a query, in
+`statement_timeout`, are also stopped by the database at the deadline.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+
+
+class QueryTimeout(Exception):
+  pass
+
+
+class QueryCancelled(Exception):
+  pass
+
+
+# statements setting and resetting the statement timeout, in milliseconds, by
+# database vendor
+STATEMENT_TIMEOUTS = {
+  'postgresql': ('SET statement_timeout = %d', 'SET statement_timeout TO DEFAULT'),
+  'mysql': ('SET SESSION max_execution_time = %d', 'SET SESSION max_execution_time = DEFAULT'),
+}
+
+# seconds between calls to cancel checks, which may hit a job store
+CANCEL_CHECK_INTERVAL = 1
+
+_local = threading.local()
+
+
+class Deadline(object):
+
+  def __init__(self, seconds, cancelled, outer=None):
+    self.seconds = seconds
+    self.at = time.time()+seconds if seconds is not None else None
+    self.cancelled = cancelled
+    self.checked_at = 0
+    self.outer = outer
+
+  def remaining(self):
+    return self.at-time.time() if self.at is not None else None
+
+  def check(self):
+    if self.at is not None and time.time() >= self.at:
+      raise QueryTimeout('Query did not finish within %s seconds' % self.seconds)
+    if self.cancelled is not None and time.time()-self.checked_at >= CANCEL_CHECK_INTERVAL:
+      self.checked_at = time.time()
+      if self.cancelled():
+        raise QueryCancelled('Query was cancelled')
+    if self.outer is not None:
+      self.outer.check()
+
+
+def _set_statement_timeouts(seconds):
+  """
+  Sets the statement timeout of connections in use, and of the default
+  connection, to the given number of seconds, or resets it if None.
+  """
+
+  for alias in connections:
+    conn = connections[alias]
+    if conn.vendor not in STATEMENT_TIMEOUTS or \
+       (conn.connection is None and alias != DEFAULT_DB_ALIAS):
+      continue
+    set_timeout, reset_timeout = STATEMENT_TIMEOUTS[conn.vendor]
+    try:
+      with conn.cursor() as cursor:
+        if seconds is None:
+          cursor.execute(reset_timeout)
+        else:
+          cursor.execute(set_timeout % max(1, int(seconds*1000)))
+    except DatabaseError:
+      # e.g. MySQL before 5.7.8; the budget is still checked between steps
+      pass
+
+
+@contextmanager
+def within(seconds, cancelled=None):
+  """
+  Runs the enclosed code with a time budget of the given number of seconds,
+  or no budget if None, and a function returning True once the code should
+  stop. Deadlines nest; the enclosed code stops at the earliest one.
+  """
+
+  outer = getattr(_local, 'deadline', None)
+  if outer is not None and outer.at is not None and \
+     (seconds is None or outer.remaining() < seconds):
+    seconds = max(0, outer.remaining())
+  deadline = Deadline(seconds, cancelled, outer)
+
+  _local.deadline = deadline
+  try:
+    yield deadline
+  except DatabaseError:
+    # statements stopped by the database at the deadline
+    if deadline.at is not None and time.time() >= deadline.at:
+      raise QueryTimeout('Query did not finish within %s seconds' % deadline.seconds)
+    raise
+  finally:
+    _local.deadline = outer
+
+
+@contextmanager
+def statement_timeout():
+  """
+  Sets a statement timeout on database connections for the enclosed code, at
+  the current deadline, if any. Only wraps code running queries, so requests
+  answered from the cache send no extra statements.
+  """
+
+  deadline = getattr(_local, 'deadline', None)
+  if deadline is None or deadline.at is None:
+    yield
+    return
+
+  _set_statement_timeouts(max(0, deadline.remaining()))
+  try:
+    yield
+  finally:
+    _set_statement_timeouts(None)
+
+
+def check():
+  """
+  Raises QueryTimeout or QueryCancelled if the current query should stop.
+  """
+
+  deadline = getattr(_local, 'deadline', None)
+  if deadline is not None:
+    deadline.check()
@@ -0,0 +1,84 @@
+"""
+JSON encoding of API responses. Parts of a response that are already JSON
+encoded, such as object data read from the cache, are wrapped in RawJSON and
+spliced into the output as they are, instead of being decoded and encoded
+again. simplejson is used for encoding if it is installed.
+
+Large responses can also be encoded incrementally with iterencode, for
+streaming.
+"""
+
+import re
+import uuid
+
+try:
+  import simplejson as backend
+except ImportError:
+  import json as backend
+
+
+class RawJSON(object):
+  """
+  Already encoded JSON, included in encoded output as is.
+  """
+
+  __slots__ = ('encoded',)
+
+  def __init__(self, encoded):
+    self.encoded = encoded
+
+
+def dumps(obj):
+  fragments = []
+  # placeholders for fragments must not collide with strings in the output
+  token = uuid.uuid4().hex
+
+  def default(o):
+    if isinstance(o, RawJSON):
+      fragments.append(o.encoded)
+      return '%s%d' % (token, len(fragments)-1)
+    raise TypeError('%r is not JSON serializable' % (o,))
+
+  encoded = backend.dumps(obj, default=default)
+  if len(fragments) == 0:
+    return encoded
+  return re.sub('"%s(\\d+)"' % token, lambda m: fragments[int(m.group(1))], encoded)
+
+
+def _encode_key(k):
+  return backend.dumps(k if isinstance(k, basestring) else unicode(k))
+
+
+def iterencode(obj, chunk_size=1000):
+  """
+  Encodes obj as JSON in pieces. Dictionaries and lists of dictionaries are
+  encoded one item at a time, other lists chunk_size items at a time, so only
+  one chunk is encoded in memory at any time.
+  """
+
+  if isinstance(obj, dict):
+    yield '{'
+    for i, (k, v) in enumerate(obj.iteritems()):
+      yield '%s%s:' % (',' if i > 0 else '', _encode_key(k))
+      for piece in iterencode(v, chunk_size):
+        yield piece
+    yield '}'
+
+  elif isinstance(obj, (list, tuple)) and len(obj) > 0 and isinstance(obj[0], dict):
+    yield '['
+    for i, v in enumerate(obj):
+      if i > 0:
+        yield ','
+      for piece in iterencode(v, chunk_size):
+        yield piece
+    yield ']'
+
+  elif isinstance(obj, (list, tuple)):
+    yield '['
+    for i in range(0, len(obj), chunk_size):
+      # strip the brackets of each encoded chunk
+      yield '%s%s' % (',' if i > 0 else '', dumps(list(obj[i:i+chunk_size]))[1:-1])
+    yield ']'
+
+  else:
+    yield dumps(obj)
@@ -76,6 +76,9 @@ def mk_filter_function(filters):
 
     q = q.only('pk')
     return q
+
+  # let relationship wrappers tell unfiltered traversals apart
+  apply_filters.filters = filters
   return apply_filters
 
 
@@ -88,6 +91,26 @@ def _valid_django_rel(rel_obj_descriptor):
                                       ReverseOneToOneDescriptor)
 
 
+def get_related_model(rel_obj_descriptor):
+  """
+  Returns the model class a Django relationship descriptor leads to, or None
+  if the relationship is a function, whose output model is only known after
+  calling it.
+  """
+
+  t = type(rel_obj_descriptor)
+  if t in (ForwardManyToOneDescriptor, ForwardOneToOneDescriptor):
+    return rel_obj_descriptor.field.related_model
+  elif t == ReverseOneToOneDescriptor:
+    return rel_obj_descriptor.related.related_model
+  elif t == ManyToManyDescriptor:
+    rel = rel_obj_descriptor.rel
+    return rel.related_model if rel_obj_descriptor.reverse else rel.model
+  elif t == ReverseManyToOneDescriptor:
+    return rel_obj_descriptor.rel.related_model
+  return None
+
+
 # Use this attr of a query output object to determine the input object
 # producing the output object using the query.
 INPUT_ATTR_PREFIX = '_origin_'
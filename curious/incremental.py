@@ -0,0 +1,154 @@
+"""
+Incremental maintenance of cached results of simple queries: an object query
+followed by a chain of Django relationships, without joins, subqueries, OR
+queries or recursion, whose filters only look at fields of the objects they
+filter.
+
+Such queries are run keeping, for each step of the chain, which object of
+the object query each object came from. When some objects change, only the
+starting objects whose paths may go through the changed objects, before or
+after the change, are run through the chain again, and their paths replace
+their old ones.
+"""
+
+from curious import model_registry
+from curious.graph import mk_filter_function, get_related_model
+from .query import Query
+from . import deadlines
+
+
+def _local_filters(model, filters):
+  for f in filters or []:
+    if f.get('method') not in ('filter', 'exclude'):
+      return False
+    for lookup in f['kwargs']:
+      if len(Query._lookup_models(model, lookup)) > 0:
+        return False
+  return True
+
+
+def _lookup_to(model, method):
+  """
+  Returns the name to look up objects a relationship of a model leads to in
+  filters on the model.
+  """
+
+  for f in model._meta.get_fields():
+    if not f.is_relation:
+      continue
+    if f.concrete and f.name == method:
+      return f.name
+    if not f.concrete and f.get_accessor_name() == method:
+      return f.name
+  return None
+
+
+def chain_of(query):
+  """
+  Returns the chain of models of a query that can be maintained
+  incrementally, as a list of dicts, one for the object query followed by
+  one for each step, or None if the query cannot be maintained
+  incrementally.
+  """
+
+  obj_query = query.object_query
+  if obj_query['method'] is not None:
+    return None
+  model = model_registry.get_manager(obj_query['model']).model_class
+  if not hasattr(model, '_meta') or not _local_filters(model, obj_query['filters']):
+    return None
+  chain = [dict(model=model, filters=obj_query['filters'])]
+
+  for step in query.steps:
+    if 'orquery' in step or 'subquery' in step or step.get('join') or step.get('recursive'):
+      return None
+    if model_registry.get_manager(step['model']).model_class != model:
+      return None
+    target = get_related_model(getattr(model, step['method'], None))
+    lookup = _lookup_to(model, step['method'])
+    if target is None or lookup is None or not _local_filters(target, step['filters']):
+      return None
+    chain.append(dict(model=target, filters=step['filters'], step=step, lookup=lookup))
+    model = target
+
+  return chain
+
+
+def run_chain(chain, sources=None, progress=None, max_paths=None):
+  """
+  Runs a chain, from all objects of the object query, or only from the ones
+  with the given pks. Returns (pk, starting object pk) pairs of the objects
+  reached at each step, starting with the object query. If given, progress is
+  called with the index of each step completed and the number of objects it
+  reached. Returns None if max_paths is given and a step reaches its objects
+  from more than max_paths starting objects each on average, as levels would
+  then be much bigger than the results, which only have each object once.
+  """
+
+  deadlines.check()
+  q = chain[0]['model'].objects.all()
+  if sources is not None:
+    q = q.filter(pk__in=list(sources))
+  objects = list(mk_filter_function(chain[0]['filters'])(q))
+
+  obj_src = [(obj, obj.pk) for obj in objects]
+  levels = [[(obj.pk, src) for obj, src in obj_src]]
+  for link in chain[1:]:
+    deadlines.check()
+    step = link['step']
+    step_f = model_registry.get_manager(step['model']).getattr(step['method'])
+    obj_src = Query._graph_step(obj_src, step['model'], step_f, step['filters'])
+    level = [(obj.pk, src) for obj, src in obj_src]
+    if max_paths is not None and len(level) > max_paths*len(set(pk for pk, src in level)):
+      return None
+    levels.append(level)
+    if progress is not None:
+      progress(len(levels)-2, len(obj_src))
+  return levels
+
+
+def results_of(chain, levels):
+  """
+  Returns query results, in the format returned by QueryView.run_query
+  without the computation time, from the objects reached at each step.
+  """
+
+  pks = list(set(pk for pk, src in levels[-1]))
+  model = chain[-1]['model'] if len(pks) > 0 else None
+  model_name = model_registry.get_name(model) if model is not None else None
+  result = dict(model=model_name, join_index=-1, objects=[(pk, None) for pk in pks], tree=None)
+  return dict(last_model=model_name, results=[result])
+
+
+def update(chain, levels, changes):
+  """
+  Updates the objects reached at each step after objects changed; changes
+  are sets of changed pks keyed by model. Returns the updated levels.
+  """
+
+  affected = set()
+  for i, link in enumerate(chain):
+    changed = changes.get(link['model'])
+    if not changed:
+      continue
+
+    # starting objects whose paths went through the changed objects
+    affected.update(src for pk, src in levels[i] if pk in changed)
+
+    # starting objects whose paths may go through them now; filters are
+    # checked when running the chain again
+    pks = list(changed)
+    for j in range(i, 0, -1):
+      if len(pks) == 0:
+        break
+      previous = chain[j-1]['model']
+      pks = list(previous.objects.filter(**{'%s__in' % chain[j]['lookup']: pks})
+                                 .values_list('pk', flat=True).distinct())
+    affected.update(pks)
+
+  if len(affected) == 0:
+    return levels
+
+  rerun = run_chain(chain, affected)
+  return [[pair for pair in level if pair[1] not in affected] + new
+          for level, new in zip(levels, rerun)]
@@ -0,0 +1,208 @@
+"""
+Asynchronous query jobs. Jobs are run by a pool of worker threads in each
+process, and their status and progress are kept in a job store, so clients
+can submit a long running query and poll for it instead of holding a request
+open. See JobListView and JobView in curious.api.
+"""
+
+import threading
+import uuid
+from Queue import Queue
+from django.db import connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import settings
+from .cache import cache, make_key
+from .models import QueryJob
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# fields of a job, besides its id
+JOB_FIELDS = ('query', 'app', 'status', 'step', 'rows', 'result_id', 'error',
+              'created_at', 'updated_at')
+
+
+class JobStore(object):
+  """
+  Keeps jobs, as dictionaries of JOB_FIELDS and an id. Changes of status are
+  conditional on the current status, as jobs are cancelled by requests while
+  workers run them: queued jobs start running, queued or running jobs are
+  cancelled, and running jobs finish.
+  """
+
+  def create(self, query, app):
+    """
+    Records a queued job, returning its id.
+    """
+    raise NotImplementedError
+
+  def get(self, job_id):
+    """
+    Returns a job, or None if there is no such job.
+    """
+    raise NotImplementedError
+
+  def update(self, job_id, **fields):
+    """
+    Records progress of a job; does not change its status.
+    """
+    raise NotImplementedError
+
+  def start(self, job_id):
+    """
+    Marks a queued job as running. Returns False if it is not queued, e.g.
+    because it was cancelled.
+    """
+    raise NotImplementedError
+
+  def cancel(self, job_id):
+    """
+    Cancels a queued or running job. Returns False if it already finished.
+    """
+    raise NotImplementedError
+
+  def finish(self, job_id, status, **fields):
+    """
+    Sets the final status of a running job. Returns False, leaving the job as
+    is, if it is no longer running, e.g. because it was cancelled.
+    """
+    raise NotImplementedError
+
+
+class DatabaseJobStore(JobStore):
+  """
+  Keeps jobs in the QueryJob table.
+  """
+
+  def create(self, query, app):
+    job = QueryJob(id=uuid.uuid4().hex, query=query, app=app, status=QUEUED)
+    job.save()
+    return job.id
+
+  def get(self, job_id):
+    try:
+      job = QueryJob.objects.get(id=job_id)
+    except QueryJob.DoesNotExist:
+      return None
+    return dict([(f, getattr(job, f)) for f in JOB_FIELDS], id=job.id)
+
+  def __change(self, job_id, statuses, **fields):
+    return QueryJob.objects.filter(id=job_id, status__in=statuses)\
+                           .update(updated_at=timezone.now(), **fields) > 0
+
+  def update(self, job_id, **fields):
+    QueryJob.objects.filter(id=job_id).update(updated_at=timezone.now(), **fields)
+
+  def start(self, job_id):
+    return self.__change(job_id, [QUEUED], status=RUNNING)
+
+  def cancel(self, job_id):
+    return self.__change(job_id, [QUEUED, RUNNING], status=CANCELLED)
+
+  def finish(self, job_id, status, **fields):
+    return self.__change(job_id, [RUNNING], status=status, **fields)
+
+
+class CacheJobStore(JobStore):
+  """
+  Keeps jobs in the shared cache, for deployments without the QueryJob table.
+  Jobs expire after JOB_TIMEOUT seconds. A job is only written by the worker
+  running it; its final status is kept under a separate key, added by
+  whichever of the worker or a cancelling request gets there first.
+  """
+
+  @staticmethod
+  def _key(job_id):
+    return make_key('job', job_id)
+
+  @staticmethod
+  def _end_key(job_id):
+    return make_key('job_end', job_id)
+
+  def create(self, query, app):
+    job_id = uuid.uuid4().hex
+    now = timezone.now()
+    job = dict([(f, None) for f in JOB_FIELDS], query=query, app=app, status=QUEUED, rows=0,
+               created_at=now, updated_at=now)
+    cache.set(CacheJobStore._key(job_id), job, settings.JOB_TIMEOUT)
+    return job_id
+
+  def get(self, job_id):
+    found = cache.get_many([CacheJobStore._key(job_id), CacheJobStore._end_key(job_id)])
+    job = found.get(CacheJobStore._key(job_id))
+    if job is None:
+      return None
+    return dict(job, id=job_id, **found.get(CacheJobStore._end_key(job_id), {}))
+
+  def update(self, job_id, **fields):
+    job = cache.get(CacheJobStore._key(job_id))
+    if job is not None:
+      job.update(fields, updated_at=timezone.now())
+      cache.set(CacheJobStore._key(job_id), job, settings.JOB_TIMEOUT)
+
+  def start(self, job_id):
+    job = self.get(job_id)
+    if job is None or job['status'] != QUEUED:
+      return False
+    self.update(job_id, status=RUNNING)
+    return True
+
+  def __end(self, job_id, status, **fields):
+    end = dict(fields, status=status, updated_at=timezone.now())
+    return cache.add(CacheJobStore._end_key(job_id), end, settings.JOB_TIMEOUT)
+
+  def cancel(self, job_id):
+    return self.get(job_id) is not None and self.__end(job_id, CANCELLED)
+
+  def finish(self, job_id, status, **fields):
+    job = self.get(job_id)
+    return job is not None and job['status'] == RUNNING and self.__end(job_id, status, **fields)
+
+
+def get_job_store():
+  return import_string(settings.JOB_STORE)()
+
+
+class JobRunner(object):
+  """
+  Runs jobs on worker threads, started on the first job. Without workers,
+  jobs run in the thread submitting them.
+  """
+
+  def __init__(self):
+    self.__queue = Queue()
+    self.__threads = []
+    self.__lock = threading.Lock()
+
+  def __work(self):
+    while True:
+      f = self.__queue.get()
+      try:
+        f()
+      except Exception:
+        import traceback
+        traceback.print_exc()
+      finally:
+        connections.close_all()
+
+  def submit(self, f):
+    if settings.JOB_WORKERS == 0:
+      f()
+      return
+
+    with self.__lock:
+      while len(self.__threads) < settings.JOB_WORKERS:
+        thread = threading.Thread(target=self.__work)
+        thread.daemon = True
+        thread.start()
+        self.__threads.append(thread)
+    self.__queue.put(f)
+
+
+job_runner = JobRunner()
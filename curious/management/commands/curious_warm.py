@@ -0,0 +1,104 @@
+"""
+Computes queries and caches their results under the keys QueryView reads, so
+requests for them are answered from the cache. Queries are taken from the
+CURIOUS_WARM_QUERIES setting, a list of (query, app) pairs, or with --top from
+the most frequent queries in the sampled log of recent requests. With
+--interval, queries are computed again every so many seconds.
+"""
+
+import threading
+import time
+from Queue import Queue, Empty
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from curious import settings
+from curious.api import QueryView
+from curious.cache import query_log
+from curious.query import Query
+
+
+class Command(BaseCommand):
+  help = 'Computes and caches results of configured or frequent queries'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--top', type=int, default=None,
+                        help='Warm the N most frequent queries in the request log')
+    parser.add_argument('--parallel', type=int, default=1,
+                        help='Number of queries computed at the same time')
+    parser.add_argument('--interval', type=int, default=None,
+                        help='Warm queries again every so many seconds, until interrupted')
+
+  def handle(self, *args, **options):
+    if options['parallel'] < 1:
+      raise CommandError('--parallel must be at least 1')
+
+    while True:
+      if options['top'] is not None:
+        queries = query_log.most_frequent(options['top'])
+      else:
+        queries = [tuple(entry) for entry in settings.WARM_QUERIES]
+
+      if len(queries) == 0:
+        self.stdout.write('No queries to warm')
+      else:
+        self.warm(queries, options['parallel'])
+
+      if options['interval'] is None:
+        break
+      time.sleep(options['interval'])
+
+  def warm(self, queries, parallel):
+    t = time.time()
+    reports = self.run_all(queries, parallel)
+    failed = 0
+    for (query_string, app), (secs, count, error) in zip(queries, reports):
+      if error is not None:
+        failed += 1
+        self.stderr.write('%s [%s]: failed, %s' % (query_string, app, error))
+      else:
+        self.stdout.write('%s [%s]: %d objects in %.3fs' % (query_string, app, count, secs))
+    self.stdout.write('Warmed %d of %d queries in %.3fs' %
+                      (len(queries)-failed, len(queries), time.time()-t))
+
+  @staticmethod
+  def run_one(query_string, app):
+    """
+    Computes a query, replacing any cached results. Returns seconds taken,
+    number of objects and error, if any.
+    """
+
+    t = time.time()
+    try:
+      results = QueryView().get_query_results(Query(query_string), True, True, app)
+    except Exception as e:
+      return (time.time()-t, 0, str(e))
+    count = sum(len(r['objects']) for r in results['results'])
+    return (time.time()-t, count, None)
+
+  def run_all(self, queries, parallel):
+    if parallel == 1:
+      return [self.run_one(query_string, app) for query_string, app in queries]
+
+    reports = [None] * len(queries)
+    todo = Queue()
+    for i, query in enumerate(queries):
+      todo.put((i, query))
+
+    def work():
+      try:
+        while True:
+          try:
+            i, (query_string, app) = todo.get_nowait()
+          except Empty:
+            return
+          reports[i] = self.run_one(query_string, app)
+      finally:
+        connections.close_all()
+
+    threads = [threading.Thread(target=work) for i in range(min(parallel, len(queries)))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return reports
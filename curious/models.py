@@ -0,0 +1,18 @@
+from django.db import models
+
+
+class QueryJob(models.Model):
+  """
+  An asynchronous query job, see curious.jobs.DatabaseJobStore.
+  """
+
+  id = models.CharField(max_length=32, primary_key=True)
+  query = models.TextField()
+  app = models.CharField(max_length=255, null=True)
+  status = models.CharField(max_length=16)
+  step = models.IntegerField(null=True)
+  rows = models.IntegerField(default=0)
+  result_id = models.CharField(max_length=64, null=True)
+  error = models.TextField(null=True)
+  created_at = models.DateTimeField(auto_now_add=True)
+  updated_at = models.DateTimeField(auto_now=True)
@@ -1,6 +1,7 @@
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor
 
+import json
 from time import mktime
 from datetime import datetime
 import parsedatetime
@@ -8,6 +9,10 @@ import parsedatetime
 from .grammar import QUERY_PEG
 
 
+# compiling the grammar takes much longer than parsing a query with it
+GRAMMAR = Grammar(QUERY_PEG)
+
+
 class Parser(object):
   """
   Parses a Wire program into step definitions and connections.
@@ -18,8 +23,7 @@ class Parser(object):
     self.steps = []
 
     # parsing:
-    grammar = Grammar(QUERY_PEG)
-    self.__nodes = grammar.parse(code)
+    self.__nodes = GRAMMAR.parse(code)
     self._translate()
 
   def _translate(self):
@@ -28,6 +32,46 @@ class Parser(object):
     self.object_query = query[0]
     self.steps = query[1:]
 
+  @property
+  def canonical_form(self):
+    """
+    A normalized string form of the parsed query, identical for queries that
+    differ only in whitespace, order of filter arguments, duplicates or order
+    of values in ``__in`` lookups, or quoting of ids.
+    """
+
+    return json.dumps(_canonical([self.object_query]+self.steps),
+                      sort_keys=True, separators=(',', ':'), default=_canonical_json)
+
+
+def _canonical_arg(name, value):
+  if name.endswith('__in') and type(value) == list:
+    return sorted(set(value))
+  if name in ('id', 'pk') and isinstance(value, basestring) and value.isdigit() \
+     and str(int(value)) == value:
+    return int(value)
+  return value
+
+
+def _canonical(node):
+  if type(node) == list:
+    return [_canonical(n) for n in node]
+  if type(node) == dict:
+    d = {}
+    for k, v in node.iteritems():
+      if k == 'kwargs':
+        d[k] = dict((name, _canonical_arg(name, value)) for name, value in v.iteritems())
+      else:
+        d[k] = _canonical(v)
+    return d
+  return node
+
+
+def _canonical_json(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return unicode(value)
+
 
 from parsimonious.nodes import NodeVisitor
 
@@ -1,7 +1,8 @@
 import time
 from curious import model_registry
-from curious.graph import traverse, mk_filter_function
+from curious.graph import traverse, mk_filter_function, get_related_model
 from .parser import Parser
+from . import deadlines
 from .utils import report_time
 
 
@@ -10,6 +11,7 @@ class Query(object):
   def __init__(self, query):
     parser = Parser(query)
     self.__query = query
+    self.__canonical = parser.canonical_form
     self.__obj_query = parser.object_query
     self.__steps = parser.steps
     self.__validate()
@@ -20,6 +22,24 @@ class Query(object):
     return self.__query
 
 
+  @property
+  def object_query(self):
+    return self.__obj_query
+
+
+  @property
+  def steps(self):
+    return self.__steps
+
+
+  @property
+  def canonical_string(self):
+    """
+    Normalized form of the query, for identifying queries with the same results
+    """
+    return self.__canonical
+
+
   @staticmethod
   def _validate(query):
     """
@@ -47,11 +67,69 @@ class Query(object):
     Query._validate([self.__obj_query]+self.__steps)
 
 
+  @staticmethod
+  def _lookup_models(model, lookup):
+    """
+    Returns models a filter lookup, e.g. entry__authors__name, goes through.
+    """
+
+    models = []
+    for part in lookup.split('__'):
+      try:
+        related = model._meta.get_field(part).related_model
+      except Exception:
+        break
+      if related is None:
+        break
+      models.append(related)
+      model = related
+    return models
+
+
+  @staticmethod
+  def _models(query, models):
+    for rel in query:
+      if 'orquery' in rel:
+        for q in rel['orquery']:
+          Query._models(q, models)
+      elif 'subquery' in rel:
+        Query._models(rel['subquery'], models)
+      else:
+        model = model_registry.get_manager(rel['model']).model_class
+        if not hasattr(model, '_meta'):
+          continue
+        models.add(model)
+        # filters apply to objects the step leads to
+        target = model
+        if rel['method'] is not None:
+          target = get_related_model(getattr(model, rel['method'], None))
+        if target is None:
+          continue
+        models.add(target)
+        for f in rel['filters'] or []:
+          for lookup in f.get('kwargs', {}):
+            models.update(Query._lookup_models(target, lookup))
+
+
+  @property
+  def models(self):
+    """
+    Django models the query reads: models of each step, models known to be
+    reached by relationships, and models filters look up. Outputs of function
+    relationships are not known until the query runs.
+    """
+
+    models = set()
+    Query._models([self.__obj_query]+self.__steps, models)
+    return models
+
+
   def __get_objects(self):
     """
     Get initial objects from object query.
     """
 
+    deadlines.check()
     model = self.__obj_query['model']
     method = self.__obj_query['method']
     filters = self.__obj_query['filters']
@@ -158,6 +236,7 @@ class Query(object):
     visited = {}
 
     while len(obj_src) > 0:
+      deadlines.check()
       # prevent loops by removing previously encountered edges; because many
       # edges can lead to the same object, preventing revisit of edges rather
       # than objects avoids loops without missing out on an edge.
@@ -300,19 +379,15 @@ class Query(object):
 
 
   @staticmethod
-  def _query(objects, query, demux_first=True):
+  def _iter_query(objects, query, demux_first=True):
     """
-    Executes a query. A query consists of one or more subqueries. Each subquery
-    is an array of model relationships. In most cases the outputs of a subquery
-    becomes the inputs to the next query. 
-    
-    Input objects should be an array of model instances. Returns an array of
-    subquery results. Each subquery result is an array of tuples. First member
-    of tuple is output object from query. Second member of tuple is the pk of
-    the input object that produced the output.
+    Executes a query step by step, yielding events as the query progresses:
+    ('step', (step index, seconds)) after each step, ('result', result) for
+    each subquery result as soon as it is complete, and finally ('model',
+    last model). See _query for the format of results.
     """
 
-    res = []
+    n_results = 0
     more_results = True
     last_non_sub_index = -1
     last_tree = None
@@ -322,16 +397,22 @@ class Query(object):
     else:
       obj_src = [(obj, None) for obj in objects]
 
-    for step in query:
+    for i, step in enumerate(query):
+      deadlines.check()
+      subquery_result = None
 
       if ('join' in step and step['join'] is True) or\
          ('subquery' in step and (step['having'] is None or step['having'] == '?')):
         if more_results:
-          res.append((obj_src, last_non_sub_index, last_tree))
-          last_non_sub_index = len(res)-1
+          yield 'result', (obj_src, last_non_sub_index, last_tree)
+          n_results += 1
+          last_non_sub_index = n_results-1
           more_results = False
           obj_src = list(set([(obj, obj.pk) for obj, src in obj_src]))
 
+      # time the step after handing out the previous result
+      t = time.time()
+
       if 'orquery' in step:
         #print 'orquery %s' % step
         obj_src = Query._or(obj_src, step)
@@ -345,7 +426,7 @@ class Query(object):
 
         if step['having'] is None or step['having'] == '?': 
           # add subquery result to results, even if there are no results from subquery
-          res.append((subquery_res, last_non_sub_index, last_tree))
+          subquery_result = (subquery_res, last_non_sub_index, last_tree)
           # don't increase last_non_sub_index, so caller knows next query
           # should still join with the last non sub query results.
           more_results = False
@@ -356,8 +437,13 @@ class Query(object):
         #print 'completed query'
         more_results = True
 
+      yield 'step', (i, time.time()-t)
+      if subquery_result is not None:
+        yield 'result', subquery_result
+        n_results += 1
+
     if more_results:
-      res.append((obj_src, last_non_sub_index, last_tree))
+      yield 'result', (obj_src, last_non_sub_index, last_tree)
 
     # last model, can be None if left join and got no data
     t = None
@@ -368,6 +454,29 @@ class Query(object):
           t = t.__base__
         break
 
+    yield 'model', t
+
+
+  @staticmethod
+  def _query(objects, query, demux_first=True):
+    """
+    Executes a query. A query consists of one or more subqueries. Each subquery
+    is an array of model relationships. In most cases the outputs of a subquery
+    becomes the inputs to the next query. 
+    
+    Input objects should be an array of model instances. Returns an array of
+    subquery results. Each subquery result is an array of tuples. First member
+    of tuple is output object from query. Second member of tuple is the pk of
+    the input object that produced the output.
+    """
+
+    res = []
+    t = None
+    for event, value in Query._iter_query(objects, query, demux_first):
+      if event == 'result':
+        res.append(value)
+      elif event == 'model':
+        t = value
     return res, t
 
 
@@ -382,3 +491,17 @@ class Query(object):
 
     objects = list(self.__get_objects())
     return Query._query(objects, self.__steps, demux_first=False)
+
+
+  def iterate(self):
+    """
+    Executes the current query, yielding events as the query progresses; see
+    _iter_query. Fetching the initial objects is reported as step -1. Results
+    are the same as the ones returned by calling the query.
+    """
+
+    t = time.time()
+    objects = list(self.__get_objects())
+    yield 'step', (-1, time.time()-t)
+    for event in Query._iter_query(objects, self.__steps, demux_first=False):
+      yield event
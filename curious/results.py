@@ -0,0 +1,234 @@
+"""
+Stored query results, for paging through big results without recomputing
+the query. Each computed result gets a result id; pages of objects of each
+subquery result are then read by offset.
+
+Results are kept in the cache, or, if CURIOUS_RESULT_STORE_DIR is set, in
+files in that directory with only their summary in the cache.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import uuid
+
+from .cache import tiered_cache, make_key, TieredCache
+from .wire import int_encoding
+from . import settings
+
+
+def result_id_of(query_key, computed_on):
+  """
+  Returns the result id of results of a query computed at a given time; the
+  same results, e.g. read from the query cache, keep the same id.
+  """
+
+  return hashlib.sha1('%s:%s' % (query_key, computed_on)).hexdigest()
+
+
+class ResultStore(object):
+  """
+  Stores query results in the cache: a summary of the results, plus the
+  objects of each subquery result under their own key, so reading a page of
+  a result does not read the other results.
+  """
+
+  def __init__(self, backend):
+    self.backend = backend
+
+  @staticmethod
+  def _summary_key(result_id):
+    return make_key('result', result_id)
+
+  @staticmethod
+  def _objects_key(result_id, index):
+    return make_key('result_objects', result_id, index)
+
+  def _set(self, k, value):
+    # stored results are never overwritten, as result ids are unique to each
+    # computation; other processes hold no copies to drop
+    if isinstance(self.backend, TieredCache):
+      self.backend.set(k, value, settings.RESULT_TIMEOUT, new=True)
+    else:
+      self.backend.set(k, value, settings.RESULT_TIMEOUT)
+
+  def _save_objects(self, result_id, index, objects):
+    self._set(ResultStore._objects_key(result_id, index), objects)
+
+  def _objects(self, result_id, index, offset, limit):
+    objects = self.backend.get(ResultStore._objects_key(result_id, index))
+    if objects is None:
+      return None
+    if limit is None:
+      return objects[offset:]
+    return objects[offset:offset+limit]
+
+  def save(self, result_id, results):
+    summary_k = ResultStore._summary_key(result_id)
+    if self.backend.get(summary_k) is not None:
+      return
+
+    summary = dict(last_model=results['last_model'], computed_on=results['computed_on'],
+                   results=[])
+    for i, result in enumerate(results['results']):
+      summary['results'].append(dict(model=result['model'], join_index=result['join_index'],
+                                     tree=result['tree'], count=len(result['objects'])))
+      self._save_objects(result_id, i, result['objects'])
+    # summary last, so a stored summary means all objects are stored
+    self._set(summary_k, summary)
+
+  @staticmethod
+  def _levels_id(result_id):
+    return '%s_levels' % result_id
+
+  def save_levels(self, result_id, levels):
+    """
+    Stores the objects reached at each step of a simple query, for updating
+    its results incrementally, along with its results.
+    """
+
+    levels_id = ResultStore._levels_id(result_id)
+    for i, level in enumerate(levels):
+      self._save_objects(levels_id, i, level)
+    # count last, so a stored count means all levels are stored
+    self._set(make_key('result_levels', result_id), len(levels))
+
+  def load_levels(self, result_id):
+    """
+    Returns stored levels of results, or None if they are not stored.
+    """
+
+    count = self.backend.get(make_key('result_levels', result_id))
+    if count is None:
+      return None
+    levels = [self._objects(ResultStore._levels_id(result_id), i, 0, None) for i in range(count)]
+    if any(level is None for level in levels):
+      return None
+    return [list(level) for level in levels]
+
+  def summary(self, result_id):
+    return self.backend.get(ResultStore._summary_key(result_id))
+
+  def page(self, result_id, index, offset, limit):
+    """
+    Returns a page of objects of the index-th result, or None if the results
+    are not stored.
+    """
+
+    return self._objects(result_id, index, offset, limit)
+
+  def load(self, result_id):
+    """
+    Returns stored results, in the format returned by QueryView.run_query, or
+    None if the results are not stored.
+    """
+
+    summary = self.summary(result_id)
+    if summary is None:
+      return None
+
+    results = []
+    for i, r in enumerate(summary['results']):
+      objects = self._objects(result_id, i, 0, None)
+      if objects is None:
+        return None
+      results.append(dict(model=r['model'], join_index=r['join_index'], tree=r['tree'],
+                          objects=objects))
+    return dict(last_model=summary['last_model'], computed_on=summary['computed_on'],
+                results=results)
+
+
+class FileResultStore(ResultStore):
+  """
+  Stores objects of results in files in a local directory instead of the
+  cache, as arrays of little-endian int64 (pk, src) pairs, read back with
+  mmap. Only the summary is kept in the cache, so results are not limited by
+  the cache's item size. Results with pks or sources that are not integers
+  are kept in the cache.
+
+  Once files take more than max_bytes, the least recently used files are
+  removed; results missing files are treated as not stored.
+  """
+
+  # stands for None in stored pairs
+  NULL = -2**63
+  PAIR = struct.Struct('<qq')
+
+  def __init__(self, backend, directory, max_bytes):
+    super(FileResultStore, self).__init__(backend)
+    self.directory = directory
+    self.max_bytes = max_bytes
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def _path(self, result_id, index):
+    return os.path.join(self.directory, '%s-%d.pairs' % (result_id, index))
+
+  def _save_objects(self, result_id, index, objects):
+    encoding = int_encoding([v for pair in objects for v in pair])
+    if len(objects) == 0 or encoding is None:
+      return super(FileResultStore, self)._save_objects(result_id, index, objects)
+
+    path = self._path(result_id, index)
+    tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    null = FileResultStore.NULL
+    pack = FileResultStore.PAIR.pack
+    with open(tmp, 'wb') as f:
+      for pk, src in objects:
+        f.write(pack(null if pk is None else pk, null if src is None else src))
+    os.rename(tmp, path)
+    self._evict()
+
+  def _objects(self, result_id, index, offset, limit):
+    path = self._path(result_id, index)
+    try:
+      f = open(path, 'rb')
+    except IOError:
+      return super(FileResultStore, self)._objects(result_id, index, offset, limit)
+
+    with f:
+      # reading marks the file as recently used
+      os.utime(path, None)
+      mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        size = FileResultStore.PAIR.size
+        count = len(mm) / size
+        end = count if limit is None else min(count, offset+limit)
+        if offset >= end:
+          return []
+        values = struct.unpack_from('<%dq' % ((end-offset)*2), mm, offset*size)
+      finally:
+        mm.close()
+
+    null = FileResultStore.NULL
+    values = [None if v == null else v for v in values]
+    return zip(values[0::2], values[1::2])
+
+  def _evict(self):
+    files = []
+    for name in os.listdir(self.directory):
+      if not name.endswith('.pairs'):
+        continue
+      try:
+        st = os.stat(os.path.join(self.directory, name))
+      except OSError:
+        continue
+      files.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for mtime, size, name in files)
+    for mtime, size, name in sorted(files):
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(os.path.join(self.directory, name))
+      except OSError:
+        pass
+      total -= size
+
+
+if settings.RESULT_STORE_DIR:
+  result_store = FileResultStore(tiered_cache, settings.RESULT_STORE_DIR,
+                                 settings.RESULT_STORE_MAX_BYTES)
+else:
+  result_store = ResultStore(tiered_cache)
@@ -0,0 +1,311 @@
+"""
+Serializing objects into the data mode format: a list of fields, plus a list
+of values and a URL for each object. Serializers for Django models are
+compiled once per model and options, with a converter picked for each column
+up front, and reused until the model registry changes.
+"""
+
+import types
+from decimal import Decimal
+from operator import attrgetter
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.fields.related import ForeignKey
+from django.urls import NoReverseMatch
+
+from curious import model_registry
+from . import changes, settings
+from .cache import model_versions
+from .utils import LRUCache
+
+
+# Django fields whose values never need converting to be JSON serializable
+PLAIN_FIELDS = ('AutoField', 'BigAutoField', 'BigIntegerField', 'BooleanField', 'FloatField',
+                'IntegerField', 'NullBooleanField', 'PositiveIntegerField',
+                'PositiveSmallIntegerField', 'SmallIntegerField')
+
+
+# errors of URL functions for objects without a URL, e.g. missing related
+# objects or URL patterns
+URL_ERRORS = (AttributeError, ObjectDoesNotExist, NoReverseMatch)
+
+
+def to_json_value(value):
+  if type(value) is Decimal:
+    return float(value)
+  elif not type(value) in (long, int, float, bool, types.NoneType):
+    return unicode(value)
+  return value
+
+
+def _urls_of(cls, objs):
+  """
+  Returns URLs of objects of the given class, or None for objects whose URL
+  cannot be determined.
+  """
+
+  try:
+    manager = model_registry.get_manager_by_class(cls)
+  except Exception:
+    # not a registered model
+    return [None] * len(objs)
+
+  if manager.url_batch_function is not None:
+    try:
+      return manager.urls_of(objs)
+    except URL_ERRORS:
+      return [None] * len(objs)
+
+  urls = []
+  for obj in objs:
+    try:
+      urls.append(manager.url_of(obj))
+    except URL_ERRORS:
+      urls.append(None)
+  return urls
+
+
+def label_models(model, manager):
+  """
+  Returns the models labels of objects of a model are built from: the model,
+  and the models reached through the manager's label_select_related.
+  """
+
+  models = [model]
+  for path in (manager.label_select_related if manager is not None else []):
+    related = model
+    for name in path.split('__'):
+      related = related._meta.get_field(name).related_model
+    models.append(related)
+  return models
+
+
+def row_models(model, follow_fk):
+  """
+  Returns the models serialized objects of a model are built from: the model
+  and, if FKs are followed, the models labels of objects they point to are
+  built from.
+  """
+
+  models = set([model])
+  if follow_fk:
+    for f in model._meta.fields:
+      if type(f) == ForeignKey:
+        try:
+          manager = model_registry.get_manager_by_class(f.related_model)
+        except Exception:
+          manager = None
+        models.update(label_models(f.related_model, manager))
+  return models
+
+
+class FKLabels(object):
+  """
+  Resolves labels of objects FKs point to: model name, pk, string form and URL.
+  Labels are kept in a bounded LRU cache by model and pk, along with the
+  versions of the models they were built from, so changes in any process to
+  these models make them stale; labels also expire after a timeout, for
+  string forms using other models. Labels missing from the cache are
+  resolved for all objects of a model at once, with one query for objects
+  not yet loaded.
+  """
+
+  def __init__(self, max_size, timeout):
+    self.cache = LRUCache(max_size, timeout=timeout)
+    self.__registry_version = None
+
+  def model_changed(self, model, pks):
+    if pks is None:
+      self.cache.clear()
+    else:
+      for pk in pks:
+        self.cache.delete((model, pk))
+
+  def resolve(self, field, targets):
+    """
+    Returns labels of objects a FK field points to, keyed by FK value.
+    `targets` maps FK values to the objects they point to, or to None if the
+    objects are not loaded.
+    """
+
+    # model names in labels depend on the registry
+    if self.__registry_version != model_registry.version:
+      self.cache.clear()
+      self.__registry_version = model_registry.version
+
+    related_model = field.related_model
+    try:
+      manager = model_registry.get_manager_by_class(related_model)
+    except Exception:
+      manager = None
+    # cached URLs are only good for the URL functions that produced them
+    providers = (manager.url_function, manager.url_batch_function) if manager else None
+    target_field = field.target_field
+    cacheable = target_field.primary_key
+    versions = None
+    if cacheable:
+      versions = model_versions.versions(label_models(related_model, manager))
+
+    labels = {}
+    missing = []
+    for value in targets:
+      cached = self.cache.get((related_model, value)) if cacheable else None
+      if cached is not None and cached[1] == providers and cached[2] == versions:
+        labels[value] = cached[0]
+      else:
+        missing.append(value)
+
+    objs = dict((value, targets[value]) for value in missing if targets[value] is not None)
+    to_fetch = [value for value in missing if targets[value] is None]
+    if len(to_fetch) > 0:
+      q = related_model._base_manager.filter(**{'%s__in' % target_field.name: to_fetch})
+      if manager is not None and len(manager.label_select_related) > 0:
+        q = q.select_related(*manager.label_select_related)
+      for obj in q:
+        objs[getattr(obj, target_field.attname)] = obj
+
+    by_class = {}
+    for value, obj in objs.iteritems():
+      by_class.setdefault(obj.__class__, []).append((value, obj))
+
+    for cls, cls_objs in by_class.iteritems():
+      model_name = model_registry.get_name(cls)
+      urls = _urls_of(cls, [obj for value, obj in cls_objs])
+      for (value, obj), url in zip(cls_objs, urls):
+        labels[value] = (model_name, obj.pk, str(obj), url)
+        if cacheable:
+          self.cache.set((related_model, value), (labels[value], providers, versions))
+
+    return labels
+
+
+fk_labels = FKLabels(settings.FK_LABEL_CACHE_SIZE, settings.FK_LABEL_CACHE_TIMEOUT)
+changes.listen(fk_labels.model_changed)
+
+
+class ModelSerializer(object):
+  """
+  Serializes instances of a Django model. If `fields` is not None, only
+  includes these fields, plus the id, and only follows FKs among them.
+  """
+
+  def __init__(self, model_class, manager, ignore_excludes, follow_fk, fields=None):
+    excludes = [] if ignore_excludes is True else manager.field_excludes
+    self.manager = manager
+    self.fields = []
+    attrs = []
+    # (column index, converter) for columns needing conversion
+    self.converters = []
+    # (column index, FK field, FK cache attribute) for followed FKs
+    self.fks = []
+    # (column index, property name) for properties computed in batches
+    self.batch_properties = []
+
+    for f in model_class._meta.fields:
+      if f.column in excludes or \
+         (fields is not None and f.column not in fields and not f.primary_key):
+        continue
+      i = len(self.fields)
+      if f.get_internal_type() not in PLAIN_FIELDS:
+        self.converters.append((i, to_json_value))
+      if type(f) == ForeignKey and follow_fk is True:
+        self.fks.append((i, f, f.get_cache_name()))
+      self.fields.append(f.column)
+      attrs.append(f.attname)
+
+    if 'id' not in self.fields:
+      self.converters.append((len(self.fields), to_json_value))
+      self.fields.append('id')
+      attrs.append('pk')
+
+    for f in manager.property_fields:
+      if fields is not None and f not in fields:
+        continue
+      if f in manager.property_batch_functions:
+        self.batch_properties.append((len(self.fields), f))
+        # placeholder, filled in after reading the other columns
+        attrs.append('pk')
+      else:
+        self.converters.append((len(self.fields), to_json_value))
+        attrs.append(f)
+      self.fields.append(f)
+
+    get_values = attrgetter(*attrs)
+    if len(attrs) == 1:
+      self.get_values = lambda obj: (get_values(obj),)
+    else:
+      self.get_values = get_values
+
+  def __call__(self, objects):
+    get_values = self.get_values
+    converters = self.converters
+    packed = []
+
+    # objects often share FK targets, only resolve each target once; use
+    # targets already loaded on the objects, e.g. with select_related
+    fks = [(i, field, cache_name, {}) for i, field, cache_name in self.fks]
+
+    for obj in objects:
+      values = list(get_values(obj))
+      for i, field, cache_name, targets in fks:
+        value = values[i]
+        if value is not None and targets.get(value) is None:
+          targets[value] = obj.__dict__.get(cache_name)
+      for i, convert in converters:
+        values[i] = convert(values[i])
+      packed.append(values)
+
+    for i, field, cache_name, targets in fks:
+      labels = fk_labels.resolve(field, targets)
+      labels = dict((to_json_value(value), label) for value, label in labels.iteritems())
+      for values in packed:
+        if values[i] in labels:
+          values[i] = labels[values[i]]
+
+    for i, name in self.batch_properties:
+      computed = self.manager.property_batch_functions[name](objects)
+      for obj, values in zip(objects, packed):
+        values[i] = to_json_value(computed.get(obj.pk))
+
+    return dict(fields=list(self.fields), objects=packed, urls=self.manager.urls_of(objects))
+
+
+class CustomModelSerializer(object):
+  """
+  Serializes instances of custom, non Django, models. Custom objects list
+  their own fields, so there is nothing to compile.
+  """
+
+  def __init__(self, manager, fields=None):
+    self.manager = manager
+    self.only = fields
+
+  def __call__(self, objects):
+    fields = list(objects[0].fields())
+    if self.only is not None:
+      fields = [f for f in fields if f in self.only or f == 'id']
+    packed = [[to_json_value(obj.get(f)) for f in fields] for obj in objects]
+    return dict(fields=fields, objects=packed, urls=self.manager.urls_of(objects))
+
+
+_serializers = {}
+_registry_version = [None]
+
+
+def get_serializer(model_class, ignore_excludes, follow_fk, fields=None):
+  if _registry_version[0] != model_registry.version:
+    _serializers.clear()
+    _registry_version[0] = model_registry.version
+
+  manager = model_registry.get_manager_by_class(model_class)
+  # managers are configured by setting attributes, which can happen any time
+  fields = frozenset(fields) if fields is not None else None
+  k = (model_class, ignore_excludes, follow_fk, fields,
+       tuple(manager.field_excludes), tuple(manager.property_fields),
+       tuple(sorted(manager.property_batch_functions)))
+
+  if k not in _serializers:
+    if hasattr(model_class, '_meta'):
+      _serializers[k] = ModelSerializer(model_class, manager, ignore_excludes, follow_fk, fields)
+    else:
+      _serializers[k] = CustomModelSerializer(manager, fields)
+  return _serializers[k]
@@ -1,3 +1,96 @@
 from django.conf import settings
 
 DEBUG = getattr(settings, 'CURIOUS_DEBUG', False)
+
+# Number of threads loading data of different models concurrently in data
+# mode; each thread uses its own database connection
+DATA_LOAD_THREADS = getattr(settings, 'CURIOUS_DATA_LOAD_THREADS', 1)
+
+# Number of FK labels (string form and URL of objects FKs point to) kept in
+# memory, and seconds they are kept; changes in other processes are only
+# seen after this many seconds
+FK_LABEL_CACHE_SIZE = getattr(settings, 'CURIOUS_FK_LABEL_CACHE_SIZE', 10000)
+FK_LABEL_CACHE_TIMEOUT = getattr(settings, 'CURIOUS_FK_LABEL_CACHE_TIMEOUT', 5 * 60)
+
+# Number of object pairs or data rows encoded at a time when streaming query
+# results
+STREAM_CHUNK_SIZE = getattr(settings, 'CURIOUS_STREAM_CHUNK_SIZE', 1000)
+
+# Seconds query results are cached. Cached results are only used while the
+# models the query touches are unchanged, so this can be long.
+QUERY_CACHE_TIMEOUT = getattr(settings, 'CURIOUS_QUERY_CACHE_TIMEOUT', 60 * 60)
+
+# Seconds stored query results can be paged through, at least as long as
+# query results are cached, and default number of objects per page
+RESULT_TIMEOUT = getattr(settings, 'CURIOUS_RESULT_TIMEOUT', QUERY_CACHE_TIMEOUT)
+RESULT_PAGE_SIZE = getattr(settings, 'CURIOUS_RESULT_PAGE_SIZE', 500)
+
+# Directory to store query results in, instead of the cache, and the most
+# bytes of results kept there; see curious.results.FileResultStore
+RESULT_STORE_DIR = getattr(settings, 'CURIOUS_RESULT_STORE_DIR', None)
+RESULT_STORE_MAX_BYTES = getattr(settings, 'CURIOUS_RESULT_STORE_MAX_BYTES', 1024 ** 3)
+
+# Seconds after which cached query results are stale: they are still
+# returned, but recomputed in the background, at most once at a time per query
+# across processes sharing the cache; a refresh taking longer than
+# QUERY_REFRESH_TIMEOUT seconds is assumed to have failed
+QUERY_SOFT_TTL = getattr(settings, 'CURIOUS_QUERY_SOFT_TTL', 15 * 60)
+QUERY_REFRESH_TIMEOUT = getattr(settings, 'CURIOUS_QUERY_REFRESH_TIMEOUT', 10 * 60)
+
+# Identical slow queries running at the same time in processes sharing the
+# cache are computed once: other processes wait up to QUERY_COALESCE_TIMEOUT
+# seconds for the results, checking every QUERY_COALESCE_POLL seconds, then
+# compute the results themselves. Queries are slow once computing them took
+# more than QUERY_COALESCE_MIN_TIME seconds.
+QUERY_COALESCE_TIMEOUT = getattr(settings, 'CURIOUS_QUERY_COALESCE_TIMEOUT', 60)
+QUERY_COALESCE_POLL = getattr(settings, 'CURIOUS_QUERY_COALESCE_POLL', 0.1)
+QUERY_COALESCE_MIN_TIME = getattr(settings, 'CURIOUS_QUERY_COALESCE_MIN_TIME', 1)
+
+# Query results are cached if computing time times recent requests for the
+# query is at least CACHE_ADMIT_MIN_SAVING seconds for each
+# CACHE_ADMIT_SIZE_UNIT objects in the results, and results have at most
+# CACHE_ADMIT_MAX_SIZE objects; see curious.cache.AdmissionPolicy
+CACHE_ADMIT_MIN_SAVING = getattr(settings, 'CURIOUS_CACHE_ADMIT_MIN_SAVING', 10)
+CACHE_ADMIT_SIZE_UNIT = getattr(settings, 'CURIOUS_CACHE_ADMIT_SIZE_UNIT', 100000)
+CACHE_ADMIT_MAX_SIZE = getattr(settings, 'CURIOUS_CACHE_ADMIT_MAX_SIZE', 10000000)
+
+# Most bytes of query results and object data each process keeps in memory in
+# front of the curious cache, 0 to disable; seconds between checks for
+# entries changed by other processes; and seconds entries are kept
+LOCAL_CACHE_MAX_BYTES = getattr(settings, 'CURIOUS_LOCAL_CACHE_MAX_BYTES', 64 * 1024 ** 2)
+LOCAL_CACHE_SYNC_INTERVAL = getattr(settings, 'CURIOUS_LOCAL_CACHE_SYNC_INTERVAL', 1)
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'CURIOUS_LOCAL_CACHE_TIMEOUT', 5 * 60)
+
+# Cached results of simple queries are updated incrementally after up to this
+# many changes to each model they read, instead of being computed again; 0 to
+# always compute them again. See curious.incremental.
+INCREMENTAL_MAX_CHANGES = getattr(settings, 'CURIOUS_INCREMENTAL_MAX_CHANGES', 100)
+# Simple queries reaching objects from more than this many starting objects
+# each, on average, are computed as other queries and not updated
+# incrementally, as the objects kept for updating them would far outnumber the
+# results.
+INCREMENTAL_MAX_PATHS = getattr(settings, 'CURIOUS_INCREMENTAL_MAX_PATHS', 10)
+
+# (query, app) pairs the curious_warm management command computes and caches
+WARM_QUERIES = getattr(settings, 'CURIOUS_WARM_QUERIES', [])
+
+# Fraction of cacheable query requests recorded in a log of recent requests
+# in the cache, and number of requests the log keeps; curious_warm can warm
+# the most frequent queries in the log
+QUERY_LOG_SAMPLE_RATE = getattr(settings, 'CURIOUS_QUERY_LOG_SAMPLE_RATE', 0.1)
+QUERY_LOG_SIZE = getattr(settings, 'CURIOUS_QUERY_LOG_SIZE', 1000)
+
+# Threads running asynchronous query jobs in each process; 0 to run jobs in
+# the request submitting them
+JOB_WORKERS = getattr(settings, 'CURIOUS_JOB_WORKERS', 4)
+
+# Where job status and progress are kept: a dotted path to a JobStore class,
+# see curious.jobs. Jobs in the cache expire after JOB_TIMEOUT seconds, like
+# the results they point to.
+JOB_STORE = getattr(settings, 'CURIOUS_JOB_STORE', 'curious.jobs.DatabaseJobStore')
+JOB_TIMEOUT = getattr(settings, 'CURIOUS_JOB_TIMEOUT', RESULT_TIMEOUT)
+
+# Longest time, in seconds, queries run for in requests and in jobs, or None
+# for no limit; requests can ask for less with the timeout parameter
+QUERY_MAX_TIMEOUT = getattr(settings, 'CURIOUS_QUERY_MAX_TIMEOUT', None)
+JOB_MAX_TIMEOUT = getattr(settings, 'CURIOUS_JOB_MAX_TIMEOUT', None)
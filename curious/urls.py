@@ -1,7 +1,8 @@
 from django.conf.urls import *
 from django.views.generic.base import TemplateView
 from django.http import HttpResponseRedirect
-from .api import ObjectView, ModelView, ModelListView, QueryView
+from .api import ObjectView, ModelView, ModelListView, QueryView, QueryStreamView, \
+                 ResultView, JobListView, JobView, CacheStatsView
 
 def redirect_to_static(request):
   path = request.get_full_path()
@@ -12,6 +13,11 @@ urlpatterns = [
   url(r'^models/(?P<model_name>[\w\-]+)/$', ModelView.as_view()),
   url(r'^models/$', ModelListView.as_view()),
   url(r'^q/$', QueryView.as_view()),
+  url(r'^q/stream/$', QueryStreamView.as_view()),
+  url(r'^results/(?P<result_id>\w+)/$', ResultView.as_view()),
+  url(r'^jobs/$', JobListView.as_view()),
+  url(r'^cache/stats/$', CacheStatsView.as_view()),
+  url(r'^jobs/(?P<job_id>\w+)/$', JobView.as_view()),
 
   # sometimes you need to get to the curious query page via Django, e.g. to
   # work with authentication. here we serve the curious.html via Django
@@ -1,5 +1,11 @@
+from collections import OrderedDict
 from functools import wraps
+import hashlib
+import struct
+from multiprocessing.pool import ThreadPool
+import threading
 import time
+from django.db import connections
 from . import settings
 
 # for development/debugging
@@ -12,3 +18,153 @@ def report_time(f):
       print '%s.%s: %.4f' % (f.__module__, f.func_name, time.time()-t)
     return r
   return wrap
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def map_in_threads(f, items, threads):
+  """
+  Maps f over items, on a pool of the given number of threads if there is
+  more than one thread and item. Threads close their database connections
+  after each item.
+  """
+
+  if threads <= 1 or len(items) <= 1:
+    return [f(item) for item in items]
+
+  with _pools_lock:
+    if threads not in _pools:
+      _pools[threads] = ThreadPool(threads)
+    pool = _pools[threads]
+
+  def run(item):
+    try:
+      return f(item)
+    finally:
+      connections.close_all()
+
+  return pool.map(run, items)
+
+
+def run_in_background(f):
+  """
+  Runs f on a daemon thread, which closes its database connections when f
+  returns. Exceptions are printed.
+  """
+
+  def run():
+    try:
+      f()
+    except Exception:
+      import traceback
+      traceback.print_exc()
+    finally:
+      connections.close_all()
+
+  thread = threading.Thread(target=run)
+  thread.daemon = True
+  thread.start()
+  return thread
+
+
+class LRUCache(object):
+  """
+  A thread safe, in-process cache evicting least recently used entries once
+  the total size of entries exceeds max_size. Entry sizes are given by the
+  sizeof function, 1 per entry by default. Entries can also expire after a
+  timeout, in seconds.
+  """
+
+  def __init__(self, max_size, sizeof=None, timeout=None):
+    self.max_size = max_size
+    self.timeout = timeout
+    self.__sizeof = sizeof if sizeof is not None else (lambda v: 1)
+    self.__entries = OrderedDict()
+    self.__size = 0
+    self.__lock = threading.Lock()
+
+  @property
+  def size(self):
+    return self.__size
+
+  def __len__(self):
+    return len(self.__entries)
+
+  def __remove(self, k):
+    value, size, expires = self.__entries.pop(k)
+    self.__size -= size
+
+  def get(self, k, default=None):
+    with self.__lock:
+      if k not in self.__entries:
+        return default
+      value, size, expires = self.__entries.pop(k)
+      if expires is not None and expires < time.time():
+        self.__size -= size
+        return default
+      # re-insert as most recently used
+      self.__entries[k] = (value, size, expires)
+      return value
+
+  def set(self, k, value):
+    size = self.__sizeof(value)
+    expires = time.time() + self.timeout if self.timeout is not None else None
+    with self.__lock:
+      if k in self.__entries:
+        self.__remove(k)
+      if size > self.max_size:
+        return
+      self.__entries[k] = (value, size, expires)
+      self.__size += size
+      while self.__size > self.max_size:
+        self.__remove(next(iter(self.__entries)))
+
+  def delete(self, k):
+    with self.__lock:
+      if k in self.__entries:
+        self.__remove(k)
+
+  def clear(self):
+    with self.__lock:
+      self.__entries.clear()
+      self.__size = 0
+
+
+class CountMinSketch(object):
+  """
+  Approximate, thread safe, counts of string keys in fixed memory, using up
+  to 4 rows. Counts can only be overestimated. All counts are halved every
+  `decay_every` additions, so counts reflect recent activity.
+  """
+
+  def __init__(self, width=1024, depth=4, decay_every=10240):
+    self.width = width
+    self.depth = depth
+    self.decay_every = decay_every
+    self.__rows = [[0] * width for i in range(depth)]
+    self.__additions = 0
+    self.__lock = threading.Lock()
+
+  def __cells(self, k):
+    digest = hashlib.md5(k).digest()
+    return [(row, h % self.width) for row, h in
+            enumerate(struct.unpack('<%dI' % self.depth, digest[:4*self.depth]))]
+
+  def add(self, k):
+    cells = self.__cells(k)
+    with self.__lock:
+      for row, i in cells:
+        self.__rows[row][i] += 1
+      self.__additions += 1
+      if self.__additions >= self.decay_every:
+        self.__additions = 0
+        for row in self.__rows:
+          for i in range(len(row)):
+            row[i] /= 2
+
+  def estimate(self, k):
+    cells = self.__cells(k)
+    with self.__lock:
+      return min(self.__rows[row][i] for row, i in cells)
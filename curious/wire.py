@@ -0,0 +1,113 @@
+"""
+Alternative encodings of query results, more compact than the default lists
+of [pk, src] pairs and data rows:
+
+  grouped    objects of each result as [src, [pk, ...]] pairs, one per source
+  columnar   pks and sources of each result as parallel columns, packed as
+             base64 encoded little-endian int32 or int64 arrays when all
+             values are integers; data rows as one list per field
+"""
+
+import base64
+import json
+import struct
+
+from .encoding import RawJSON
+
+
+FORMATS = ('json', 'grouped', 'columnar')
+
+# packed integer types, narrowest first: name, struct format, bound; the
+# smallest value of each type stands for None
+INT_TYPES = (('int32', 'i', 2**31), ('int64', 'q', 2**63))
+
+
+def group_objects(objects):
+  groups = {}
+  order = []
+  for pk, src in objects:
+    if src not in groups:
+      groups[src] = []
+      order.append(src)
+    groups[src].append(pk)
+  return [[src, groups[src]] for src in order]
+
+
+def int_encoding(values):
+  """
+  Returns the narrowest packed integer type holding all values, or None if
+  some values are not integers or are out of range.
+  """
+
+  lo = hi = 0
+  for v in values:
+    if v is None:
+      continue
+    if type(v) not in (int, long):
+      return None
+    if v < lo:
+      lo = v
+    elif v > hi:
+      hi = v
+  for name, fmt, bound in INT_TYPES:
+    if -bound < lo and hi < bound:
+      return name
+  return None
+
+
+def pack_ints(values, encoding):
+  fmt, bound = [(t[1], t[2]) for t in INT_TYPES if t[0] == encoding][0]
+  values = [-bound if v is None else v for v in values]
+  return base64.b64encode(struct.pack('<%d%s' % (len(values), fmt), *values))
+
+
+def unpack_ints(encoded, encoding):
+  fmt, bound = [(t[1], t[2]) for t in INT_TYPES if t[0] == encoding][0]
+  packed = base64.b64decode(encoded)
+  values = struct.unpack('<%d%s' % (len(packed)/struct.calcsize(fmt), fmt), packed)
+  return [None if v == -bound else v for v in values]
+
+
+def columnar_objects(objects):
+  pks = [pk for pk, src in objects]
+  srcs = [src for pk, src in objects]
+  encoding = int_encoding(pks+srcs)
+  if encoding is not None:
+    return dict(encoding=encoding, pks=pack_ints(pks, encoding), srcs=pack_ints(srcs, encoding))
+  return dict(encoding='json', pks=pks, srcs=srcs)
+
+
+def columnar_data(data):
+  # results without a model have no data
+  if isinstance(data, list):
+    return data
+  # e.g. cached data of custom models
+  if isinstance(data, RawJSON):
+    data = json.loads(data.encoded)
+  rows = [json.loads(row.encoded) if isinstance(row, RawJSON) else row
+          for row in data['objects']]
+  columns = [list(column) for column in zip(*rows)]
+  if len(columns) == 0:
+    columns = [[] for f in data['fields']]
+  d = dict(fields=data['fields'], columns=columns)
+  if 'urls' in data:
+    d['urls'] = data['urls']
+  return d
+
+
+def encode_results(results, fmt):
+  """
+  Returns query results with objects, and data if loaded, encoded in the
+  given format.
+  """
+
+  if fmt == 'json':
+    return results
+
+  encode = group_objects if fmt == 'grouped' else columnar_objects
+  encoded = dict(results, format=fmt)
+  encoded['results'] = [dict(result, objects=encode(result['objects']))
+                        for result in results['results']]
+  if fmt == 'columnar' and 'data' in results:
+    encoded['data'] = [columnar_data(data) for data in results['data']]
+  return encoded
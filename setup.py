@@ -131,7 +131,8 @@ setup(
     'install_bower': BowerBuildCommand,
   },
 
-  packages=['curious'],
+  packages=['curious', 'curious.management', 'curious.management.commands',
+            'curious.migrations'],
   include_package_data=True,
   zip_safe=True,
 
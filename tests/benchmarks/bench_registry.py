@@ -0,0 +1,39 @@
+"""
+Benchmark model registry lookups with many registered models.
+
+  python tests/benchmarks/bench_registry.py [models]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dummy.settings')
+
+import django
+django.setup()
+
+from curious import ModelRegistry
+
+
+def main(n):
+  registry = ModelRegistry()
+  classes = [type('Model%d' % i, (object,), {}) for i in range(n)]
+  for cls in classes:
+    registry.register(cls)
+
+  lookups = 100000
+  times = []
+  for i in range(3):
+    t = time.time()
+    for j in xrange(lookups):
+      registry.get_name(classes[j % n])
+    times.append(time.time()-t)
+  t = min(times)
+  print 'get_name, %d models, %d lookups: %.3fs (%.2f us/lookup)' % (
+    n, lookups, t, t*1000000/lookups)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,44 @@
+"""
+Benchmark serializing model objects into the data mode format, using
+unsaved objects so no database is needed.
+
+  python tests/benchmarks/bench_serializer.py [rows]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dummy.settings')
+
+import django
+django.setup()
+
+from curious import model_registry
+from curious.api import ModelView
+from curious_tests.models import Blog, Entry
+import curious_tests.models
+
+
+def main(n):
+  model_registry.register(curious_tests.models)
+  model_registry.get_manager('Entry').url_function = lambda obj: '/entries/%s' % obj.pk
+
+  blogs = [Blog(id=i, name='Blog %s' % i) for i in range(200)]
+  entries = [Entry(id=i, blog=blogs[i % len(blogs)], headline='Entry %s' % i, related_blog_id=i)
+             for i in range(n)]
+
+  for follow_fk in (False, True):
+    times = []
+    for i in range(3):
+      t = time.time()
+      ModelView.objects_to_dict(entries, follow_fk=follow_fk)
+      times.append(time.time()-t)
+    t = min(times)
+    print 'objects_to_dict, %d rows, follow_fk=%s: %.3fs (%.1f us/row)' % (
+      n, follow_fk, t, t*1000000/n)
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,44 @@
+"""
+Benchmark encoding query results in each wire format: bytes on the wire and
+time to encode, for results of synthetic object pairs and data rows.
+
+  python tests/benchmarks/bench_wire.py [pairs]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dummy.settings')
+
+import django
+django.setup()
+
+from curious import wire
+from curious.encoding import dumps
+
+
+def main(n):
+  random.seed(0)
+  srcs = range(1, n/50+1)
+  objects = [(random.randint(1, 10*n), random.choice(srcs)) for i in range(n)]
+  rows = [[pk, 'Entry %s' % pk, [u'Blog', src, u'Blog %s' % src, None]] for pk, src in objects]
+  pairs_only = dict(last_model='Entry', computed_on='2017-01-01 00:00:00',
+                    results=[dict(model='Entry', join_index=-1, objects=objects, tree=None)])
+  with_data = dict(pairs_only, data=[dict(fields=['id', 'headline', 'blog_id'], objects=rows,
+                                          urls=[None]*n)])
+
+  for label, results in (('pairs', pairs_only), ('pairs+data', with_data)):
+    for fmt in wire.FORMATS:
+      times = []
+      for i in range(3):
+        t = time.time()
+        encoded = dumps(wire.encode_results(results, fmt))
+        times.append(time.time()-t)
+      print '%-10s %-9s %d pairs: %9d bytes, %.3fs' % (label, fmt, n, len(encoded), min(times))
+
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
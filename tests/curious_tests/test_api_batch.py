@@ -1,14 +1,20 @@
 import json
-from django.test import TestCase
+import re
+from django.test import TransactionTestCase
 from django.db import connection
 from curious import model_registry
+from curious.api import ModelView
+from curious.cache import cache, model_versions
+from curious.serializer import label_models
 from curious_tests.models import Blog, Entry
 import curious_tests.models
 
-class TestBatchFetch(TestCase):
+
+class TestBatchFetch(TransactionTestCase):
   N = 20
 
   def setUp(self):
+    cache.clear()
     blog = Blog(name='Databases')
     blog.save()
     self.blog = blog
@@ -24,13 +30,16 @@ class TestBatchFetch(TestCase):
 
   def tearDown(self):
     model_registry.clear()
+    cache.clear()
 
   def test_fetch_objects_and_related_objects(self):
     data = dict(ids=[e.id for e in self.entries])
-    r = self.client.post('/curious/models/Entry/', data=json.dumps(data), content_type='application/json')
+    r = self.client.post('/curious/models/Entry/', data=json.dumps(data),
+                         content_type='application/json')
     self.assertEquals(r.status_code, 200)
     results = json.loads(r.content)['result']
-    self.assertEquals(results['fields'], ["id", "blog_id", "headline", "response_to_id", "related_blog_id"])
+    self.assertEquals(results['fields'],
+                      ["id", "blog_id", "headline", "response_to_id", "related_blog_id"])
     self.assertItemsEqual(results['urls'], [None for e in self.entries])
     self.assertItemsEqual(results['objects'],
                           [[e.id,
@@ -39,3 +48,138 @@ class TestBatchFetch(TestCase):
                             None,
                             None]
                            for e in self.entries])
+
+  def _fetch(self, ids, **kwargs):
+    data = dict(ids=ids, app='test', **kwargs)
+    r = self.client.post('/curious/models/Entry/', data=json.dumps(data),
+                         content_type='application/json')
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def test_uses_cached_objects(self):
+    ids = [e.id for e in self.entries]
+    results = self._fetch(ids)
+    with self.assertNumQueries(0):
+      cached_results = self._fetch(ids)
+    self.assertEquals(cached_results, results)
+
+  def test_cached_objects_are_refreshed_after_changes(self):
+    ids = [e.id for e in self.entries]
+    self._fetch(ids)
+    self.entries[0].headline = 'Postgres'
+    self.entries[0].save()
+    results = self._fetch(ids)
+    self.assertEquals(results['objects'][0][2], 'Postgres')
+
+    # labels of objects FKs point to are part of the rows too
+    self.blog.name = 'Key value stores'
+    self.blog.save()
+    results = self._fetch(ids)
+    self.assertEquals(set(row[1][2] for row in results['objects']), set(['Key value stores']))
+
+  def test_objects_as_json_are_decoded(self):
+    ids = [e.id for e in self.entries]
+    for i in range(2):
+      r = ModelView.get_objects_as_json(Entry, ids, False, True, False, 'test')
+      self.assertEquals(json.loads(json.dumps(r)), r)
+
+  def test_only_fetches_objects_missing_from_cache(self):
+    ids = [e.id for e in self.entries]
+    self._fetch(ids[:10])
+
+    with self.assertNumQueries(1) as ctx:
+      results = self._fetch(ids)
+    fetched = re.findall(r'\d+', ctx.captured_queries[0]['sql'].split(' IN ')[-1])
+    self.assertEquals(fetched, [str(i) for i in ids[10:]])
+    self.assertEquals([row[0] for row in results['objects']], ids)
+    self.assertEquals(results['fields'],
+                      ["id", "blog_id", "headline", "response_to_id", "related_blog_id"])
+
+  def test_reload_ignores_cached_objects(self):
+    ids = [e.id for e in self.entries]
+    self._fetch(ids)
+    Entry.objects.filter(id=ids[0]).update(headline='Changed')
+
+    results = self._fetch(ids)
+    self.assertEquals(results['objects'][0][2], self.entries[0].headline)
+    results = self._fetch(ids, r=1)
+    self.assertEquals(results['objects'][0][2], 'Changed')
+
+  def test_fetch_only_some_fields(self):
+    ids = [e.id for e in self.entries]
+    with self.assertNumQueries(1) as ctx:
+      results = self._fetch(ids, fields=['headline'])
+    self.assertNotIn('blog', ctx.captured_queries[0]['sql'])
+    self.assertEquals(results['fields'], ['id', 'headline'])
+    self.assertEquals(results['objects'], [[e.id, e.headline] for e in self.entries])
+
+  def test_fetch_only_some_fields_following_fks(self):
+    ids = [e.id for e in self.entries]
+    # one query for the entries, joined with the blogs they point to
+    with self.assertNumQueries(1) as ctx:
+      results = self._fetch(ids, fields=['blog_id'])
+    self.assertNotIn('headline', ctx.captured_queries[0]['sql'])
+    self.assertEquals(results['fields'], ['id', 'blog_id'])
+    self.assertEquals(results['objects'][0],
+                      [ids[0], [self.blog.__class__.__name__, self.blog.pk, self.blog.name, None]])
+
+  def test_fk_labels_are_cached(self):
+    ids = [e.id for e in self.entries]
+    self._fetch(ids[:1], fields=['blog_id'])
+    with self.assertNumQueries(1):
+      results = self._fetch(ids[1:], fields=['blog_id'])
+    self.assertEquals(results['objects'][0][1],
+                      [self.blog.__class__.__name__, self.blog.pk, self.blog.name, None])
+
+  def test_fk_labels_are_invalidated_by_other_processes(self):
+    ids = [e.id for e in self.entries]
+    self._fetch(ids[:1], fields=['blog_id'])
+    # a change in another process only bumps the shared model version
+    Blog.objects.filter(pk=self.blog.pk).update(name='Key value stores')
+    model_versions.model_changed(Blog, [self.blog.pk])
+    results = self._fetch(ids[1:], fields=['blog_id'])
+    self.assertEquals(results['objects'][0][1][2], 'Key value stores')
+
+  def test_fk_labels_depend_on_label_select_related_models(self):
+    manager = model_registry.get_manager('Entry')
+    self.assertEquals(label_models(Entry, manager), [Entry])
+    manager.label_select_related = ['blog']
+    self.assertEquals(label_models(Entry, manager), [Entry, Blog])
+
+  def test_fk_labels_are_invalidated_when_targets_change(self):
+    ids = [e.id for e in self.entries]
+    self._fetch(ids[:1], fields=['blog_id'])
+    self.blog.name = 'Key value stores'
+    self.blog.save()
+    results = self._fetch(ids[1:], fields=['blog_id'])
+    self.assertEquals(results['objects'][0][1][2], 'Key value stores')
+
+  def test_cached_objects_are_specific_to_fields(self):
+    ids = [e.id for e in self.entries]
+    self._fetch(ids, fields=['headline'])
+    results = self._fetch(ids)
+    self.assertEquals(results['fields'],
+                      ["id", "blog_id", "headline", "response_to_id", "related_blog_id"])
+
+  def test_objects_come_in_database_order(self):
+    headlines = ['B', 'D', 'A', 'C']
+    for entry, headline in zip(self.entries, headlines):
+      entry.headline = headline
+      entry.save()
+    ids = [e.id for e in self.entries[:4]]
+
+    ordering = Entry._meta.ordering
+    Entry._meta.ordering = ['headline']
+    try:
+      # fetched, then partly and fully read from the cache
+      for fetched in (ids[:2], ids, ids):
+        results = self._fetch(fetched)
+        self.assertEquals([row[2] for row in results['objects']],
+                          sorted(headlines[:len(fetched)]))
+      with self.assertNumQueries(0):
+        self._fetch(ids)
+    finally:
+      Entry._meta.ordering = ordering
+
+    results = self._fetch(list(reversed(ids)))
+    self.assertEquals([row[0] for row in results['objects']], sorted(ids))
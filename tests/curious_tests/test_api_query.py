@@ -1,5 +1,7 @@
 import json
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from curious import model_registry
 from curious.count import CountObject
 from curious.api import ModelView
@@ -162,3 +164,65 @@ class TestQueryAPI(TestCase):
       self.person.example_property_field,
       self.person.gender,
     ])
+
+  def test_streaming_query_results(self):
+    params = dict(d=1, q='Blog(%s), Blog.entry_set' % self.blog.pk)
+    expected = json.loads(self.client.get('/curious/q/', params).content)
+    params['s'] = 1
+    r = self.client.get('/curious/q/', params)
+    self.assertEquals(r.status_code, 200)
+    self.assertTrue(r.streaming)
+    streamed = json.loads(''.join(r.streaming_content))
+    self.assertEquals(streamed['result']['results'], expected['result']['results'])
+    self.assertEquals(streamed['result']['data'], expected['result']['data'])
+
+  def test_streaming_query_progress(self):
+    params = dict(d=1, q='Blog(%s), Blog.entry_set' % self.blog.pk)
+    expected = json.loads(self.client.get('/curious/q/', params).content)['result']
+    r = self.client.get('/curious/q/stream/', params)
+    self.assertEquals(r.status_code, 200)
+    self.assertEquals(r['Content-Type'], 'application/x-ndjson')
+    records = [json.loads(line) for line in ''.join(r.streaming_content).splitlines()]
+
+    self.assertEquals([rec['type'] for rec in records],
+                      ['step', 'result', 'step', 'result', 'done'])
+    results = [rec for rec in records if rec['type'] == 'result']
+    self.assertEquals([rec['index'] for rec in results], [0, 1])
+    for rec, result, data in zip(results, expected['results'], expected['data']):
+      self.assertEquals(rec['result']['model'], result['model'])
+      self.assertEquals(rec['result']['join_index'], result['join_index'])
+      self.assertItemsEqual(rec['result']['objects'], result['objects'])
+      self.assertEquals(rec['result']['data'], data)
+    self.assertEquals(records[-1]['last_model'], 'Entry')
+
+  def test_streaming_query_reports_errors(self):
+    r = self.client.get('/curious/q/stream/', dict(q='Blog(%s) Entry.authors' % self.blog.pk))
+    self.assertEquals(r.status_code, 200)
+    records = [json.loads(line) for line in ''.join(r.streaming_content).splitlines()]
+    self.assertEquals(records[-1]['type'], 'error')
+
+  def test_getting_some_fields_with_query(self):
+    r = self.client.get('/curious/q/', dict(d=1, fields='headline',
+                                            q='Blog(%s), Blog.entry_set' % self.blog.pk))
+    self.assertEquals(r.status_code, 200)
+    data = json.loads(r.content)['result']['data']
+    self.assertEquals(data[0]['fields'], ['id'])
+    self.assertEquals(data[0]['objects'], [[self.blog.pk]])
+    self.assertEquals(data[1]['fields'], ['id', 'headline'])
+    self.assertItemsEqual(data[1]['objects'], [[e.pk, e.headline] for e in self.entries])
+
+  def test_loads_data_of_each_model_once(self):
+    qs = 'Blog(%s), Blog.entry_set, Entry.blog' % self.blog.pk
+    with CaptureQueriesContext(connection) as ctx:
+      # not following FKs, which loads blogs for FK labels
+      r = self.client.get('/curious/q/', dict(d=1, fk=0, q=qs))
+    self.assertEquals(r.status_code, 200)
+    data = json.loads(r.content)['result']['data']
+    self.assertEquals(len(data), 3)
+    self.assertEquals(data[0], ModelView.objects_to_dict([self.blog], follow_fk=False))
+    self.assertEquals(data[2], data[0])
+
+    blog_data_queries = [q for q in ctx.captured_queries
+                         if q['sql'].startswith('SELECT "curious_tests_blog"."id", '
+                                                '"curious_tests_blog"."name"')]
+    self.assertEquals(len(blog_data_queries), 1)
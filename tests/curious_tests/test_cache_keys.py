@@ -0,0 +1,77 @@
+import hashlib
+import json
+from django.test import TestCase
+from curious import model_registry
+from curious.cache import cache, make_key, CACHE_VERSION
+from curious_tests.models import Blog
+import curious_tests.models
+
+
+class TestCacheKeys(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    blog = Blog(name='Databases')
+    blog.save()
+    self.blog = blog
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+    cache.clear()
+
+  def test_keys_are_stable_digests(self):
+    k = make_key('query', 'Blog(1)', 'abc')
+    self.assertEquals(k, make_key('query', 'Blog(1)', 'abc'))
+    self.assertNotEquals(k, make_key('query', 'Blog(2)', 'abc'))
+    canonical = '[%s,"query","Blog(1)","abc"]' % CACHE_VERSION
+    self.assertEquals(k, 'curious:%s' % hashlib.sha256(canonical).hexdigest())
+
+  def test_keys_do_not_depend_on_dict_order(self):
+    self.assertEquals(make_key(dict(a=1, b=2)), make_key(dict(b=2, a=1)))
+
+  def test_registry_fingerprint_changes_with_configuration(self):
+    fingerprint = model_registry.fingerprint
+    self.assertEquals(fingerprint, model_registry.fingerprint)
+    model_registry.get_manager('Blog').field_excludes = ['name']
+    self.assertNotEquals(fingerprint, model_registry.fingerprint)
+
+  def test_registry_fingerprint_is_computed_once_per_configuration(self):
+    fingerprint = model_registry.fingerprint
+    self.assertIs(fingerprint, model_registry.fingerprint)
+    self.assertEquals(len(fingerprint), 64)
+
+  def test_registry_fingerprint_covers_serialization_settings(self):
+    manager = model_registry.get_manager('Blog')
+    fingerprints = [model_registry.fingerprint]
+    manager.field_excludes.append('name')
+    fingerprints.append(model_registry.fingerprint)
+    manager.url_function = lambda obj: None
+    fingerprints.append(model_registry.fingerprint)
+    manager.property_batch_functions['x'] = lambda objs: {}
+    fingerprints.append(model_registry.fingerprint)
+    manager.label_select_related.append('entry')
+    fingerprints.append(model_registry.fingerprint)
+    self.assertEquals(len(set(fingerprints)), len(fingerprints))
+
+  def test_query_results_are_cached_under_stable_key(self):
+    params = dict(q='Blog(%s)' % self.blog.pk, app='test', fc=1)
+    r = self.client.get('/curious/q/', params)
+    self.assertEquals(r.status_code, 200)
+
+    with self.assertNumQueries(0):
+      r = self.client.get('/curious/q/', params)
+    self.assertEquals(r.status_code, 200)
+    self.assertEquals(json.loads(r.content)['result']['results'][0]['objects'],
+                      [[self.blog.pk, None]])
+
+  def test_equivalent_queries_share_cached_results(self):
+    r = self.client.get('/curious/q/', dict(q='Blog(id__in=[%s, 0])' % self.blog.pk, app='test',
+                                            fc=1))
+    self.assertEquals(r.status_code, 200)
+
+    with self.assertNumQueries(0):
+      r = self.client.get('/curious/q/', dict(q='Blog( id__in = [0,%s] )' % self.blog.pk,
+                                              app='test'))
+    self.assertEquals(json.loads(r.content)['result']['results'][0]['objects'],
+                      [[self.blog.pk, None]])
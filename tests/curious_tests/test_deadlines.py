@@ -0,0 +1,154 @@
+import json
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from curious import deadlines, model_registry
+from curious.cache import cache
+from curious.deadlines import QueryTimeout, QueryCancelled
+from curious.jobs import get_job_store
+from curious.models import QueryJob
+from curious.query import Query
+from curious.results import result_store
+from curious_tests.models import Blog, Entry
+import curious.settings
+import curious_tests.models
+
+
+class TestQueryDeadlines(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    self.entries = [Entry(headline='Entry %s' % i, blog=self.blog) for i in range(4)]
+    for entry in self.entries:
+      entry.save()
+    for entry, response in zip(self.entries, self.entries[1:]):
+      response.response_to = entry
+      response.save()
+    model_registry.register(curious_tests.models)
+    self.settings = (curious.settings.QUERY_MAX_TIMEOUT, deadlines.CANCEL_CHECK_INTERVAL)
+
+  def tearDown(self):
+    curious.settings.QUERY_MAX_TIMEOUT, deadlines.CANCEL_CHECK_INTERVAL = self.settings
+    model_registry.clear()
+    cache.clear()
+
+  def _query(self, **params):
+    params.update(q='Blog(%s) Blog.entry_set' % self.blog.pk, app='test')
+    return self.client.get('/curious/q/', params)
+
+  def test_queries_within_budget_return_results(self):
+    r = self._query(timeout=60)
+    self.assertEquals(r.status_code, 200)
+    self.assertEquals(len(json.loads(r.content)['result']['results'][0]['objects']), 4)
+
+  def test_queries_over_budget_time_out(self):
+    r = self._query(timeout=0)
+    self.assertEquals(r.status_code, 408)
+    self.assertIn('did not finish', json.loads(r.content)['error']['message'])
+    for timeout in ('soon', 'nan', 'inf', '-1'):
+      self.assertEquals(self._query(timeout=timeout).status_code, 400)
+
+  def test_budget_is_capped_at_server_maximum(self):
+    curious.settings.QUERY_MAX_TIMEOUT = 0
+    self.assertEquals(self._query().status_code, 408)
+    self.assertEquals(self._query(timeout=60).status_code, 408)
+
+  def test_sets_statement_timeout_only_when_running_queries(self):
+    deadlines.STATEMENT_TIMEOUTS['sqlite'] = ('SELECT %d', 'SELECT -1')
+    try:
+      with CaptureQueriesContext(connection) as ctx:
+        self.assertEquals(self._query(timeout=60, fc=1).status_code, 200)
+      statements = [q['sql'] for q in ctx.captured_queries]
+      self.assertEquals(statements[-1], 'SELECT -1')
+      self.assertEquals(len([sql for sql in statements if sql.startswith('SELECT -1')]), 1)
+
+      # answered from the cache
+      with CaptureQueriesContext(connection) as ctx:
+        self.assertEquals(self._query(timeout=60).status_code, 200)
+      self.assertEquals(len(ctx.captured_queries), 0)
+    finally:
+      del deadlines.STATEMENT_TIMEOUTS['sqlite']
+
+  def test_streamed_queries_report_timeout(self):
+    r = self.client.get('/curious/q/stream/', dict(q='Blog(%s) Blog.entry_set' % self.blog.pk,
+                                                   timeout=0))
+    records = [json.loads(line) for line in ''.join(r.streaming_content).splitlines()]
+    self.assertEquals(records[-1]['type'], 'error')
+    self.assertTrue(records[-1]['timeout'])
+
+  def test_recursive_traversals_check_between_levels(self):
+    deadlines.CANCEL_CHECK_INTERVAL = 0
+    qs = 'Entry(%s) Entry.responses*' % self.entries[0].pk
+    checks = []
+
+    with deadlines.within(None, lambda: checks.append(1) and False):
+      Query(qs)()
+    # one check for the initial objects and the step, one per level and one
+    # past the last level
+    self.assertEquals(len(checks), 2+len(self.entries))
+
+    # cancelled while traversing levels
+    del checks[:]
+    with deadlines.within(None, lambda: checks.append(1) or len(checks) > 3):
+      self.assertRaises(QueryCancelled, Query(qs))
+    self.assertEquals(len(checks), 4)
+
+  def test_deadlines_nest(self):
+    with deadlines.within(0):
+      with deadlines.within(60):
+        self.assertRaises(QueryTimeout, deadlines.check)
+    deadlines.check()
+
+
+class TestJobCancellation(TransactionTestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+    cache.clear()
+
+  def test_cancels_unfinished_jobs(self):
+    job_id = get_job_store().create('Blog(%s)' % self.blog.pk, 'test')
+    r = self.client.delete('/curious/jobs/%s/' % job_id)
+    self.assertEquals(r.status_code, 200)
+    self.assertEquals(json.loads(r.content)['result']['status'], 'cancelled')
+    self.assertEquals(self.client.delete('/curious/jobs/%s/' % job_id).status_code, 409)
+
+  def test_jobs_cancelled_after_their_query_stay_cancelled(self):
+    save = result_store.save
+
+    def cancel_then_save(result_id, results):
+      self.client.delete('/curious/jobs/%s/' % QueryJob.objects.get().id)
+      save(result_id, results)
+
+    result_store.save = cancel_then_save
+    try:
+      r = self.client.post('/curious/jobs/', dict(q='Blog(%s)' % self.blog.pk, app='test'))
+    finally:
+      result_store.save = save
+    job_id = json.loads(r.content)['result']['id']
+    job = json.loads(self.client.get('/curious/jobs/%s/' % job_id).content)['result']
+    self.assertEquals(job['status'], 'cancelled')
+    self.assertIsNone(job['result_id'])
+
+  def test_finished_jobs_cannot_be_cancelled(self):
+    r = self.client.post('/curious/jobs/', dict(q='Blog(%s)' % self.blog.pk, app='test'))
+    job_id = json.loads(r.content)['result']['id']
+    self.assertEquals(self.client.delete('/curious/jobs/%s/' % job_id).status_code, 409)
+    job = json.loads(self.client.get('/curious/jobs/%s/' % job_id).content)['result']
+    self.assertEquals(job['status'], 'done')
+    self.assertIsNotNone(job['result_id'])
+
+  def test_jobs_over_budget_fail(self):
+    r = self.client.post('/curious/jobs/', dict(q='Blog(%s)' % self.blog.pk, app='test', timeout=0))
+    job_id = json.loads(r.content)['result']['id']
+    job = json.loads(self.client.get('/curious/jobs/%s/' % job_id).content)['result']
+    self.assertEquals(job['status'], 'failed')
+    self.assertIn('did not finish', job['error'])
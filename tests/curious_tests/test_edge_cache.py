@@ -0,0 +1,81 @@
+from django.test import TransactionTestCase
+from curious import model_registry
+from curious.cache import cache
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author
+from curious_tests import assertQueryResultsEqual
+import curious_tests.models
+
+
+class TestEdgeCache(TransactionTestCase):
+
+  def setUp(self):
+    cache.clear()
+
+    blog = Blog(name='Databases')
+    blog.save()
+    self.blog = blog
+
+    headlines = ('MySQL is a relational DB',
+                 'Postgres is a really good relational DB',
+                 'Neo4J is a graph DB')
+    self.entries = [Entry(headline=headline, blog=blog) for headline in headlines]
+    for entry in self.entries:
+      entry.save()
+
+    self.author = Author(name='Joe')
+    self.author.save()
+    self.entries[0].authors.add(self.author)
+
+    model_registry.register(curious_tests.models)
+    model_registry.get_manager('Blog').cached_relationships = ['entry_set']
+    model_registry.get_manager('Entry').cached_relationships = ['authors']
+
+  def tearDown(self):
+    model_registry.clear()
+    cache.clear()
+
+  def test_uses_cached_adjacency_lists(self):
+    qs = 'Blog(%s) Blog.entry_set' % self.blog.pk
+    result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][0][0], [(entry, None) for entry in self.entries])
+
+    # only the query fetching the blog should hit the database
+    with self.assertNumQueries(1):
+      result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][0][0], [(entry, None) for entry in self.entries])
+
+  def test_cached_objects_can_be_traversed_further(self):
+    qs = 'Blog(%s) Blog.entry_set Entry.authors' % self.blog.pk
+    Query(qs)()
+    result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][0][0], [(self.author, None)])
+
+  def test_filtered_traversals_do_not_use_cache(self):
+    qs = 'Blog(%s) Blog.entry_set(headline__icontains="graph")' % self.blog.pk
+    Query(qs)()
+    with self.assertNumQueries(2):
+      result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][0][0], [(self.entries[2], None)])
+
+  def test_saving_target_model_invalidates_cache(self):
+    qs = 'Blog(%s) Blog.entry_set' % self.blog.pk
+    Query(qs)()
+    entry = Entry(headline='Redis is a key value store', blog=self.blog)
+    entry.save()
+    result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][0][0], [(e, None) for e in self.entries + [entry]])
+
+  def test_deleting_target_model_invalidates_cache(self):
+    qs = 'Blog(%s) Blog.entry_set' % self.blog.pk
+    Query(qs)()
+    self.entries[0].delete()
+    result = Query(qs)()
+    assertQueryResultsEqual(self, result[0][0][0], [(e, None) for e in self.entries[1:]])
+
+  def test_changing_m2m_invalidates_cache(self):
+    qs = 'Blog(%s) Blog.entry_set Entry.authors' % self.blog.pk
+    Query(qs)()
+    self.entries[0].authors.remove(self.author)
+    result = Query(qs)()
+    self.assertEquals(result[0][0][0], [])
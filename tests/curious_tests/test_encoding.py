@@ -0,0 +1,31 @@
+import json
+from unittest import TestCase
+from curious.encoding import RawJSON, dumps, iterencode
+
+
+class TestEncoding(TestCase):
+
+  def test_encodes_like_json(self):
+    obj = {'a': [1, 2.5, None, True], 'b': u'caf\xe9', 'c': (1, 'x')}
+    self.assertEquals(json.loads(dumps(obj)), json.loads(json.dumps(obj)))
+
+  def test_splices_raw_json_fragments(self):
+    obj = {'objects': [RawJSON('[1,"a"]'), RawJSON('[2,"b"]')], 'data': RawJSON('{"x":null}')}
+    self.assertEquals(json.loads(dumps(obj)),
+                      {'objects': [[1, 'a'], [2, 'b']], 'data': {'x': None}})
+
+  def test_does_not_replace_strings_looking_like_placeholders(self):
+    obj = ['"0"', RawJSON('1'), '0']
+    self.assertEquals(json.loads(dumps(obj)), ['"0"', 1, '0'])
+
+  def test_rejects_unknown_objects(self):
+    with self.assertRaises(TypeError):
+      dumps([object()])
+
+  def test_encodes_incrementally(self):
+    obj = {'results': [{'objects': [[i, None] for i in range(5)], 'tree': None}, {'objects': []}],
+           'data': [{'objects': [RawJSON('[1,"a"]'), RawJSON('[2,"b"]')]}], 'n': 1}
+    pieces = list(iterencode(obj, chunk_size=2))
+    self.assertEquals(json.loads(''.join(pieces)), json.loads(dumps(obj)))
+    # chunks of objects are encoded separately
+    self.assertEquals(len([p for p in pieces if p.endswith('null]')]), 3)
@@ -0,0 +1,134 @@
+import json
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from curious import model_registry, incremental
+from curious.api import QueryView
+from curious.cache import cache
+from curious.query import Query
+from curious_tests.models import Blog, Entry, Author
+import curious.settings
+import curious_tests.models
+
+
+class TestIncrementalResults(TransactionTestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blogs = [Blog(name=name) for name in ('Databases', 'Data Warehouses', 'Cooking')]
+    for blog in self.blogs:
+      blog.save()
+    self.entries = [Entry(headline='Entry %s' % i, blog=self.blogs[i % 3]) for i in range(6)]
+    for entry in self.entries:
+      entry.save()
+    self.authors = [Author(name=name) for name in ('Joe', 'Jane')]
+    for author in self.authors:
+      author.save()
+    self.entries[0].authors.add(self.authors[0])
+    self.entries[1].authors.add(self.authors[1])
+    model_registry.register(curious_tests.models)
+    self.max_paths = curious.settings.INCREMENTAL_MAX_PATHS
+
+  def tearDown(self):
+    curious.settings.INCREMENTAL_MAX_PATHS = self.max_paths
+    model_registry.clear()
+    cache.clear()
+
+  def _levels(self, qs):
+    return incremental.run_chain(incremental.chain_of(Query(qs)))
+
+  def _pks(self, levels):
+    return sorted(set(pk for pk, src in levels[-1]))
+
+  def test_only_simple_queries_are_incremental(self):
+    self.assertNotEquals(
+      incremental.chain_of(Query('Blog(name="a") Blog.entry_set Entry.authors')), None)
+    self.assertEquals(incremental.chain_of(Query('Blog(name="a"), Blog.entry_set')), None)
+    self.assertEquals(incremental.chain_of(Query('Blog(entry__headline="a")')), None)
+    self.assertEquals(incremental.chain_of(Query('Blog(name="a") Blog.entry_set.first(1)')), None)
+    self.assertEquals(incremental.chain_of(Query('Entry(id=1) Entry.response_to*')), None)
+
+  def test_runs_chain_like_query(self):
+    qs = 'Blog(name__icontains="Data") Blog.entry_set Entry.authors'
+    res, last_model = Query(qs)()
+    self.assertEquals(self._pks(self._levels(qs)), sorted(obj.pk for obj, src in res[0][0]))
+
+  def test_only_keeps_levels_of_cached_queries(self):
+    qs = 'Blog(name__icontains="Data") Blog.entry_set Entry.authors'
+    chains = []
+    run_chain = incremental.run_chain
+
+    def recording_run_chain(chain, **kwargs):
+      chains.append(chain)
+      return run_chain(chain, **kwargs)
+
+    incremental.run_chain = recording_run_chain
+    try:
+      self.client.get('/curious/q/', dict(q=qs))
+      self.assertEquals(chains, [])
+      self.client.get('/curious/q/', dict(q=qs, app='test'))
+      self.assertEquals(len(chains), 1)
+    finally:
+      incremental.run_chain = run_chain
+
+  def test_does_not_keep_levels_reaching_objects_by_many_paths(self):
+    for entry in self.entries:
+      entry.authors.add(*self.authors)
+    qs = 'Author(name__icontains="J") Author.entry_set Entry.authors'
+    chain = incremental.chain_of(Query(qs))
+    # each object is reached from both authors
+    self.assertNotEquals(incremental.run_chain(chain, max_paths=2), None)
+    self.assertEquals(incremental.run_chain(chain, max_paths=1), None)
+
+    curious.settings.INCREMENTAL_MAX_PATHS = 1
+    results, versions, levels = QueryView().run_versioned_query(Query(qs), True)
+    self.assertEquals(levels, None)
+    self.assertItemsEqual(results['results'][0]['objects'],
+                          [(a.pk, None) for a in self.authors])
+
+  def test_updates_levels_after_changes(self):
+    qs = 'Blog(name__icontains="Data") Blog.entry_set Entry.authors'
+    chain = incremental.chain_of(Query(qs))
+    levels = incremental.run_chain(chain)
+    self.assertEquals(self._pks(levels), [a.pk for a in self.authors])
+
+    # entry moves to a blog not matching the filter
+    self.entries[1].blog = self.blogs[2]
+    self.entries[1].save()
+    levels = incremental.update(chain, levels, {Entry: set([self.entries[1].pk])})
+    self.assertEquals(self._pks(levels), [self.authors[0].pk])
+    self.assertEquals([sorted(level) for level in levels],
+                      [sorted(level) for level in incremental.run_chain(chain)])
+
+    # author added to an entry of a matching blog
+    self.entries[3].authors.add(self.authors[1])
+    levels = incremental.update(chain, levels, {Entry: set([self.entries[3].pk]),
+                                                Author: set([self.authors[1].pk])})
+    self.assertEquals(self._pks(levels), [a.pk for a in self.authors])
+
+    # blog renamed, no longer matching the filter
+    self.blogs[0].name = 'Gardening'
+    self.blogs[0].save()
+    levels = incremental.update(chain, levels, {Blog: set([self.blogs[0].pk])})
+    self.assertEquals(self._pks(levels), [])
+    self.assertEquals(self._pks(levels), self._pks(incremental.run_chain(chain)))
+
+  def test_updates_cached_results_without_rerunning_query(self):
+    qs = 'Blog(name__icontains="Data") Blog.entry_set'
+    params = dict(q=qs, app='test', fc=1)
+    self.client.get('/curious/q/', params)
+
+    entry = Entry(headline='New', blog=self.blogs[1])
+    entry.save()
+    self.entries[0].delete()
+
+    with CaptureQueriesContext(connection) as ctx:
+      r = self.client.get('/curious/q/', dict(q=qs, app='test'))
+    result = json.loads(r.content)['result']
+    expected = [e.pk for e in self.entries[1:] + [entry]
+                if e.blog_id in (self.blogs[0].pk, self.blogs[1].pk)]
+    self.assertItemsEqual([pk for pk, src in result['results'][0]['objects']], expected)
+    # blogs are only fetched for the affected sources
+    blog_queries = [q['sql'] for q in ctx.captured_queries
+                    if 'FROM "curious_tests_blog"' in q['sql']]
+    self.assertTrue(all(' IN ' in sql for sql in blog_queries))
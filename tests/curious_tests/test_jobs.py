@@ -0,0 +1,162 @@
+import json
+import threading
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from curious import model_registry, incremental
+from curious.cache import cache
+from curious.jobs import JobRunner, DatabaseJobStore, CacheJobStore, DONE, CANCELLED
+from curious.query import Query
+from curious_tests.models import Blog, Entry
+import curious.settings
+import curious_tests.models
+
+
+class TestQueryJobs(TransactionTestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    self.entries = [Entry(headline='Entry %s' % i, blog=self.blog) for i in range(3)]
+    for entry in self.entries:
+      entry.save()
+    model_registry.register(curious_tests.models)
+    self.job_store = curious.settings.JOB_STORE
+
+  def tearDown(self):
+    curious.settings.JOB_STORE = self.job_store
+    model_registry.clear()
+    cache.clear()
+
+  def _submit(self, qs):
+    r = self.client.post('/curious/jobs/', dict(q=qs, app='test'))
+    self.assertEquals(r.status_code, 202)
+    return json.loads(r.content)['result']
+
+  def _job(self, job_id):
+    r = self.client.get('/curious/jobs/%s/' % job_id)
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def _test_runs_query_as_job(self):
+    job = self._submit('Blog(%s) Blog.entry_set' % self.blog.pk)
+    job = self._job(job['id'])
+    self.assertEquals(job['status'], 'done')
+    self.assertEquals(job['rows'], 3)
+    self.assertIsNone(job['error'])
+
+    r = self.client.get('/curious/results/%s/' % job['result_id'])
+    self.assertEquals(r.status_code, 200)
+    result = json.loads(r.content)['result']
+    self.assertItemsEqual([obj[0] for obj in result['result']['objects']],
+                          [entry.pk for entry in self.entries])
+
+  def test_runs_query_as_job(self):
+    self._test_runs_query_as_job()
+
+  def test_runs_query_as_job_with_cache_store(self):
+    curious.settings.JOB_STORE = 'curious.jobs.CacheJobStore'
+    self._test_runs_query_as_job()
+
+  def test_reports_progress_of_steps(self):
+    job = self._submit('Blog(%s) Blog.entry_set, Entry.blog' % self.blog.pk)
+    job = self._job(job['id'])
+    self.assertEquals(job['status'], 'done')
+    self.assertEquals(job['step'], 1)
+    self.assertEquals(job['rows'], 6)
+
+  def test_reports_progress_of_chain_steps(self):
+    qs = 'Blog(%s) Blog.entry_set Entry.blog' % self.blog.pk
+    progress = []
+    incremental.run_chain(incremental.chain_of(Query(qs)),
+                          progress=lambda step, rows: progress.append((step, rows)))
+    self.assertEquals(progress, [(0, 3), (1, 1)])
+
+    job = self._job(self._submit(qs)['id'])
+    self.assertEquals(job['status'], 'done')
+    self.assertEquals(job['step'], 1)
+    self.assertEquals(job['rows'], 1)
+
+  def test_runs_jobs_once_request_commits(self):
+    with transaction.atomic():
+      job = self._submit('Blog(%s)' % self.blog.pk)
+      self.assertEquals(job['status'], 'queued')
+      self.assertEquals(self._job(job['id'])['status'], 'queued')
+    self.assertEquals(self._job(job['id'])['status'], 'done')
+
+  def test_reports_failed_jobs(self):
+    job = self._submit('Blog(nonexistent=1)')
+    job = self._job(job['id'])
+    self.assertEquals(job['status'], 'failed')
+    self.assertIsNotNone(job['error'])
+    self.assertIsNone(job['result_id'])
+
+  def test_rejects_bad_queries_and_unknown_jobs(self):
+    r = self.client.post('/curious/jobs/', dict(q='Blog(', app='test'))
+    self.assertEquals(r.status_code, 400)
+    r = self.client.get('/curious/jobs/%s/' % ('0' * 32))
+    self.assertEquals(r.status_code, 404)
+
+
+class TestJobStores(TestCase):
+
+  def setUp(self):
+    cache.clear()
+
+  def tearDown(self):
+    cache.clear()
+
+  def _test_changes_status_only_from_expected_status(self, store):
+    job_id = store.create('Blog(1)', 'test')
+    self.assertTrue(store.cancel(job_id))
+    self.assertFalse(store.start(job_id))
+    self.assertEquals(store.get(job_id)['status'], CANCELLED)
+
+    job_id = store.create('Blog(1)', 'test')
+    self.assertTrue(store.start(job_id))
+    self.assertTrue(store.cancel(job_id))
+    # progress of the worker does not undo the cancellation
+    store.update(job_id, step=0, rows=1)
+    self.assertFalse(store.finish(job_id, DONE, result_id='r', rows=1))
+    job = store.get(job_id)
+    self.assertEquals((job['status'], job['step'], job['result_id']), (CANCELLED, 0, None))
+
+    job_id = store.create('Blog(1)', 'test')
+    self.assertTrue(store.start(job_id))
+    self.assertTrue(store.finish(job_id, DONE, result_id='r', rows=1))
+    self.assertFalse(store.cancel(job_id))
+    job = store.get(job_id)
+    self.assertEquals((job['status'], job['result_id'], job['rows']), (DONE, 'r', 1))
+
+  def test_database_store_changes_status_only_from_expected_status(self):
+    self._test_changes_status_only_from_expected_status(DatabaseJobStore())
+
+  def test_cache_store_changes_status_only_from_expected_status(self):
+    self._test_changes_status_only_from_expected_status(CacheJobStore())
+
+
+class TestJobRunner(TestCase):
+
+  def setUp(self):
+    self.workers = curious.settings.JOB_WORKERS
+
+  def tearDown(self):
+    curious.settings.JOB_WORKERS = self.workers
+
+  def test_runs_jobs_inline_without_workers(self):
+    ran = []
+    JobRunner().submit(lambda: ran.append(threading.current_thread()))
+    self.assertEquals(ran, [threading.current_thread()])
+
+  def test_runs_jobs_on_workers(self):
+    curious.settings.JOB_WORKERS = 2
+    done = threading.Event()
+    ran = []
+
+    def f():
+      ran.append(threading.current_thread())
+      done.set()
+
+    JobRunner().submit(f)
+    self.assertTrue(done.wait(5))
+    self.assertNotEqual(ran, [threading.current_thread()])
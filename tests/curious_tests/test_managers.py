@@ -41,3 +41,34 @@ class TestModelRegistry(TestCase):
     # Clear with force shouldnot remove it
     self.model_registry.clear(force=True)
     self.assertEqual([], self.model_registry.model_names)
+
+  def test_get_name_of_registered_model(self):
+    self.model_registry.register(models.Person)
+    self.assertEqual('Person', self.model_registry.get_name(models.Person))
+    self.assertIs(self.model_registry.get_manager_by_class(models.Person),
+                  self.model_registry.get_manager('Person'))
+
+  def test_get_name_of_unregistered_model(self):
+    self.assertEqual('curious_tests__Person', self.model_registry.get_name(models.Person))
+    with self.assertRaises(Exception):
+      self.model_registry.get_manager_by_class(models.Person)
+
+  def test_get_name_with_ambiguous_short_names(self):
+    Person = type('Person', (object,), {})
+    self.model_registry.register(models.Person)
+    self.model_registry.register(Person)
+    self.assertEqual('curious_tests__Person', self.model_registry.get_name(models.Person))
+    self.assertEqual('Person', self.model_registry.get_name(Person))
+
+    self.model_registry.register(models.Blog, short_name='Person')
+    self.assertEqual('curious_tests__Person', self.model_registry.get_name(models.Person))
+    self.assertEqual('curious_tests__Blog', self.model_registry.get_name(models.Blog))
+
+  def test_get_name_after_unregister(self):
+    self.model_registry.register(models.Person)
+    self.model_registry.register(models.Blog, short_name='Person')
+    self.model_registry.unregister('curious_tests__Blog')
+    self.assertEqual('Person', self.model_registry.get_name(models.Person))
+    self.assertEqual('curious_tests__Blog', self.model_registry.get_name(models.Blog))
+    self.model_registry.unregister('Person')
+    self.assertEqual('curious_tests__Person', self.model_registry.get_name(models.Person))
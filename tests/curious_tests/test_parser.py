@@ -200,3 +200,34 @@ class TestDateTimeParsing(TestCase):
     self.assertEquals(t.year, 2014)
     self.assertEquals(t.month, 8)
     self.assertEquals(t.day, 22)
+
+
+class TestCanonicalForm(TestCase):
+
+  def test_ignores_whitespace(self):
+    self.assertEquals(Parser('A(1) B.b(a=1,b=2)').canonical_form,
+                      Parser('A( 1 )   B.b( a = 1, b = 2 )').canonical_form)
+
+  def test_ignores_order_of_filter_arguments(self):
+    self.assertEquals(Parser('A(1) B.b(a=1, b=2)').canonical_form,
+                      Parser('A(1) B.b(b=2, a=1)').canonical_form)
+
+  def test_ignores_order_and_duplicates_of_in_values(self):
+    self.assertEquals(Parser('A(id__in=[3, 1, 2])').canonical_form,
+                      Parser('A(id__in=[1, 2, 3, 1])').canonical_form)
+
+  def test_keeps_order_of_other_array_values(self):
+    self.assertNotEquals(Parser('A(1) B.b(a=[3, 1])').canonical_form,
+                         Parser('A(1) B.b(a=[1, 3])').canonical_form)
+
+  def test_treats_id_shortcut_as_integer_id_filter(self):
+    self.assertEquals(Parser('A(1)').canonical_form, Parser('A(id=1)').canonical_form)
+    self.assertNotEquals(Parser('A(01)').canonical_form, Parser('A(id=1)').canonical_form)
+
+  def test_keeps_order_of_filters(self):
+    self.assertNotEquals(Parser('A(1) B.b.start(1).limit(2)').canonical_form,
+                         Parser('A(1) B.b.limit(2).start(1)').canonical_form)
+
+  def test_distinguishes_different_queries(self):
+    self.assertNotEquals(Parser('A(1) B.b').canonical_form, Parser('A(1) B.c').canonical_form)
+    self.assertNotEquals(Parser('A(1), B.b').canonical_form, Parser('A(1) B.b').canonical_form)
@@ -0,0 +1,352 @@
+import json
+from datetime import datetime
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from curious import model_registry, changes
+from curious.api import QueryView
+from curious.cache import cache, tiered_cache, make_key, model_versions, AdmissionPolicy, \
+  TieredCache
+from curious.jobs import get_job_store
+from curious.models import QueryJob
+from curious.query import Query
+from curious.results import result_store
+from curious_tests.models import Blog, Entry, Author
+import curious.api
+import curious.settings
+import curious_tests.models
+
+
+class TestStaleWhileRevalidate(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    model_registry.register(curious_tests.models)
+
+    # run refreshes when the test says so
+    self.refreshes = []
+    self.run_in_background = curious.api.run_in_background
+    curious.api.run_in_background = self.refreshes.append
+
+  def tearDown(self):
+    curious.api.run_in_background = self.run_in_background
+    model_registry.clear()
+    cache.clear()
+
+  def _query(self, **params):
+    params.update(q='Blog(name__icontains="Data")', app='test')
+    r = self.client.get('/curious/q/', params)
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def _age_cached_results(self, seconds):
+    k = QueryView.query_key(Query('Blog(name__icontains="Data")'))
+    cached = dict(tiered_cache.get(k))
+    cached['cached_at'] -= seconds
+    tiered_cache.set(k, cached, None)
+
+  def test_fresh_results_are_not_refreshed(self):
+    self._query(fc=1)
+    result = self._query()
+    self.assertNotIn('stale', result)
+    self.assertEquals(self.refreshes, [])
+
+  def test_returns_stale_results_and_refreshes_once(self):
+    self._query(fc=1)
+    self._age_cached_results(3600)
+
+    result = self._query()
+    self.assertTrue(result['stale'])
+    self.assertEquals(result['results'][0]['objects'], [[self.blog.pk, None]])
+    # only one refresh in flight
+    self._query()
+    self.assertEquals(len(self.refreshes), 1)
+
+    self.refreshes[0]()
+    with self.assertNumQueries(0):
+      result = self._query()
+    self.assertNotIn('stale', result)
+    self.assertEquals(result['results'][0]['objects'], [[self.blog.pk, None]])
+
+
+class TestModelVersions(TransactionTestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+    cache.clear()
+
+  def _query(self, qs):
+    r = self.client.get('/curious/q/', dict(q=qs, app='test', fc=1))
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def test_query_models(self):
+    qs = 'Blog(name="a") Blog.entry_set(authors__name="j")'
+    self.assertEquals(Query(qs).models, set([Blog, Entry, Author]))
+
+  def test_changes_to_models_read_invalidate_cached_results(self):
+    qs = 'Blog(name__icontains="Data")'
+    self._query(qs)
+    with self.assertNumQueries(0):
+      self._query(qs)
+
+    other = Blog(name='Data Warehouses')
+    other.save()
+    result = self._query(qs)
+    self.assertItemsEqual(result['results'][0]['objects'], [[self.blog.pk, None], [other.pk, None]])
+
+  def test_changes_to_models_looked_up_invalidate_cached_results(self):
+    qs = 'Blog(entry__headline__icontains="graph")'
+    self.assertEquals(self._query(qs)['results'][0]['objects'], [])
+    Entry(blog=self.blog, headline='Neo4J is a graph DB').save()
+    self.assertEquals(self._query(qs)['results'][0]['objects'], [[self.blog.pk, None]])
+
+  def test_changes_to_unregistered_models_invalidate_cached_results(self):
+    model_registry.clear()
+    model_registry.register(Blog)
+    qs = 'Blog(entry__headline__icontains="graph")'
+    self.assertEquals(self._query(qs)['results'][0]['objects'], [])
+    Entry(blog=self.blog, headline='Neo4J is a graph DB').save()
+    self.assertEquals(self._query(qs)['results'][0]['objects'], [[self.blog.pk, None]])
+
+  def test_versions_change_once_changes_commit(self):
+    versions = model_versions.versions([Blog])
+    with transaction.atomic():
+      Blog(name='Data Warehouses').save()
+      self.assertTrue(model_versions.unchanged(versions))
+    self.assertFalse(model_versions.unchanged(versions))
+
+  def test_only_tracks_models_reachable_from_registered_models(self):
+    model_registry.clear()
+    model_registry.register(Blog)
+    self.assertIn(Entry, changes.watched_models())
+    self.assertNotIn(QueryJob, changes.watched_models())
+    versions = model_versions.versions([QueryJob])
+    get_job_store().create('Blog(1)', 'test')
+    self.assertTrue(model_versions.unchanged(versions))
+
+  def test_changes_to_other_models_keep_cached_results(self):
+    qs = 'Blog(name__icontains="Data")'
+    self._query(qs)
+    Author(name='Joe').save()
+    with self.assertNumQueries(0):
+      self._query(qs)
+
+
+class TestQueryCoalescing(TransactionTestCase):
+
+  QS = 'Blog(name__icontains="Data")'
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    model_registry.register(curious_tests.models)
+    self.k = QueryView.query_key(Query(TestQueryCoalescing.QS))
+
+    self.settings = dict((name, getattr(curious.settings, name))
+                         for name in ('QUERY_COALESCE_TIMEOUT', 'QUERY_COALESCE_POLL',
+                                      'QUERY_COALESCE_MIN_TIME'))
+    curious.settings.QUERY_COALESCE_TIMEOUT = 0.2
+    curious.settings.QUERY_COALESCE_POLL = 0.01
+
+  def tearDown(self):
+    for name, value in self.settings.iteritems():
+      setattr(curious.settings, name, value)
+    model_registry.clear()
+    cache.clear()
+
+  def _query(self, **params):
+    params.update(q=TestQueryCoalescing.QS, app='test')
+    r = self.client.get('/curious/q/', params)
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def _mark_slow(self):
+    tiered_cache.set(make_key('query_slow', self.k), True, None)
+
+  def _share(self, pks, versions):
+    results = dict(last_model='Blog', computed_on=datetime(2017, 1, 1),
+                   results=[dict(model='Blog', join_index=-1, tree=None,
+                                 objects=[(pk, None) for pk in pks])])
+    result_store.save('other', results)
+    cache.set(make_key('query_done', self.k), dict(result_id='other', versions=versions))
+
+  def test_waits_for_results_of_process_holding_lease(self):
+    self._mark_slow()
+    cache.add(make_key('query_lease', self.k), True)
+    self._share([1], model_versions.versions([Blog]))
+
+    with self.assertNumQueries(0):
+      result = self._query()
+    self.assertEquals(result['results'][0]['objects'], [[1, None]])
+
+  def test_ignores_results_computed_before_changes(self):
+    self._mark_slow()
+    cache.add(make_key('query_lease', self.k), True)
+    self._share([self.blog.pk], model_versions.versions([Blog]))
+    blog = Blog(name='Data warehouses')
+    blog.save()
+
+    result = self._query()
+    self.assertItemsEqual(result['results'][0]['objects'],
+                          [[self.blog.pk, None], [blog.pk, None]])
+
+  def test_computes_results_if_waiting_times_out(self):
+    self._mark_slow()
+    cache.add(make_key('query_lease', self.k), True)
+    result = self._query()
+    self.assertEquals(result['results'][0]['objects'], [[self.blog.pk, None]])
+
+  def test_shares_results_of_slow_queries(self):
+    curious.settings.QUERY_COALESCE_MIN_TIME = -1
+    self._query()
+    self.assertTrue(tiered_cache.get(make_key('query_slow', self.k)))
+    self.assertEquals(cache.get(make_key('query_done', self.k)), None)
+
+    # the next computation of the query takes the lease
+    tiered_cache.delete(self.k)
+    self._query()
+    self.assertEquals(cache.get(make_key('query_lease', self.k)), None)
+    done = cache.get(make_key('query_done', self.k))
+    self.assertEquals(result_store.load(done['result_id'])['results'][0]['objects'],
+                      [(self.blog.pk, None)])
+
+  def test_does_not_coalesce_fast_queries(self):
+    cache.add(make_key('query_lease', self.k), True)
+    result = self._query()
+    self.assertEquals(result['results'][0]['objects'], [[self.blog.pk, None]])
+    self.assertEquals(tiered_cache.get(make_key('query_slow', self.k)), None)
+    self.assertEquals(cache.get(make_key('query_done', self.k)), None)
+
+
+class TestCacheAdmission(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+    cache.clear()
+
+  def test_admits_results_saving_enough_time(self):
+    policy = AdmissionPolicy()
+    policy.requested('k')
+    self.assertFalse(policy.admit('k', 9, 10))
+    policy.requested('k')
+    self.assertTrue(policy.admit('k', 9, 10))
+    self.assertTrue(policy.admit('other', 11, 10))
+    self.assertEquals(policy.counters, dict(admitted=2, rejected=1, forced=0))
+
+  def test_weighs_result_size(self):
+    policy = AdmissionPolicy()
+    self.assertFalse(policy.admit('k', 11, curious.settings.CACHE_ADMIT_SIZE_UNIT))
+    self.assertTrue(policy.admit('k', 21, curious.settings.CACHE_ADMIT_SIZE_UNIT))
+    self.assertFalse(policy.admit('k', 10**9, curious.settings.CACHE_ADMIT_MAX_SIZE+1))
+    self.assertTrue(policy.admit('k', 0, curious.settings.CACHE_ADMIT_MAX_SIZE+1, force=True))
+
+  def test_does_not_write_rejected_results(self):
+    qs = 'Blog(%s)' % self.blog.pk
+    self.client.get('/curious/q/', dict(q=qs, app='test'))
+    self.assertEquals(cache.get(QueryView.query_key(Query(qs))), None)
+
+  def test_reload_drops_cached_results(self):
+    qs = 'Blog(%s)' % self.blog.pk
+    self.client.get('/curious/q/', dict(q=qs, app='test', fc=1))
+    self.assertNotEquals(cache.get(QueryView.query_key(Query(qs))), None)
+    self.client.get('/curious/q/', dict(q=qs, app='test', r=1))
+    self.assertEquals(cache.get(QueryView.query_key(Query(qs))), None)
+
+  def test_caches_slow_queries_over_time_threshold(self):
+    qs = 'Blog(%s)' % self.blog.pk
+    QueryView.QUERY_TIME_CACHING_THRESHOLD = -1
+    try:
+      self.client.get('/curious/q/', dict(q=qs, app='test'))
+    finally:
+      QueryView.QUERY_TIME_CACHING_THRESHOLD = None
+    self.assertNotEquals(cache.get(QueryView.query_key(Query(qs))), None)
+
+  def test_exposes_counters(self):
+    before = json.loads(self.client.get('/curious/cache/stats/').content)['result']['admission']
+    self.client.get('/curious/q/', dict(q='Blog(%s)' % self.blog.pk, app='test', fc=1))
+    after = json.loads(self.client.get('/curious/cache/stats/').content)['result']['admission']
+    self.assertEquals(after['forced'], before['forced']+1)
+
+
+class TestTieredCache(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    # two processes sharing the cache
+    self.a = TieredCache(cache, 10000, 0, None)
+    self.b = TieredCache(cache, 10000, 0, None)
+
+  def tearDown(self):
+    cache.clear()
+
+  def test_serves_reads_from_memory(self):
+    self.a.set('k', 'v', None)
+    self.assertEquals(self.b.get('k'), 'v')
+    self.assertEquals(self.b.get('k'), 'v')
+    self.assertEquals(self.b.get('missing'), None)
+    self.assertEquals(self.b.counters, dict(local_hits=1, shared_hits=1, misses=1))
+    self.assertEquals(self.a.get('k'), 'v')
+    self.assertEquals(self.a.counters['local_hits'], 1)
+
+  def test_drops_copies_changed_by_other_processes(self):
+    self.a.set_many({'k': 1, 'j': 1}, None)
+    self.b.get_many(['k', 'j'])
+    self.a.set('k', 2, None)
+    self.assertEquals(self.b.get_many(['k', 'j']), {'k': 2, 'j': 1})
+    self.a.delete('j')
+    self.assertEquals(self.b.get('j'), None)
+
+  def test_only_logs_overwritten_and_deleted_keys(self):
+    seq_k = make_key('invalidation_seq')
+    self.a.set_many({'k': 1, 'j': 1}, None, new=True)
+    seq = cache.get(seq_k)
+    self.a.set('k', 2, None)
+    self.a.delete('j')
+    self.assertEquals(cache.get(seq_k), seq+2)
+
+  def test_drops_all_copies_when_shared_cache_is_cleared(self):
+    self.a.set('k', 1, None)
+    self.b.get('k')
+    cache.clear()
+    self.assertEquals(self.b.get('k'), None)
+
+  def test_drops_all_copies_instead_of_reading_long_logs(self):
+    self.a.set_many({'k': 1, 'j': 1}, None)
+    self.b.get_many(['k', 'j'])
+    read_keys = []
+    get_many = cache.get_many
+
+    def recording_get_many(keys):
+      read_keys.extend(keys)
+      return get_many(keys)
+
+    # many keys changed since b last synced
+    seq_k = make_key('invalidation_seq')
+    cache.set(seq_k, cache.get(seq_k)+TieredCache.MAX_LOG_READ+1)
+    cache.get_many = recording_get_many
+    try:
+      self.assertEquals(self.b.get_many(['k', 'j']), {'k': 1, 'j': 1})
+    finally:
+      del cache.get_many
+    self.assertEquals(self.b.counters['local_hits'], 0)
+    self.assertEquals(read_keys, ['k', 'j'])
+
+  def test_bounds_memory_by_bytes(self):
+    self.a.set_many({'k': 'x'*6000, 'j': 'x'*6000}, None)
+    self.assertLessEqual(self.a.local.size, 10000)
+    self.assertEquals(len(self.a.local), 1)
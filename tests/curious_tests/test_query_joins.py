@@ -82,3 +82,17 @@ class TestQueryJoins(TestCase):
                                                     (self.authors[0], self.blogs[2].pk)])
     self.assertEquals(len(result[0]), 2)
     self.assertEquals(result[1], Blog)
+
+  def test_iterating_query_yields_results_as_they_complete(self):
+    qs = 'Blog(name__icontains="Databases"), Blog.entry_set, Entry.authors'
+    res, last_model = Query(qs)()
+    events = list(Query(qs).iterate())
+
+    self.assertEquals([e for e, v in events],
+                      ['step', 'result', 'step', 'result', 'step', 'result', 'model'])
+    self.assertEquals([v[0] for e, v in events if e == 'step'], [-1, 0, 1])
+    results = [v for e, v in events if e == 'result']
+    self.assertEquals([r[1] for r in results], [r[1] for r in res])
+    for r, expected in zip(results, res):
+      assertQueryResultsEqual(self, r[0], expected[0])
+    self.assertEquals(events[-1][1], last_model)
@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from django.test import TestCase
+from curious import model_registry
+from curious.cache import cache
+from curious.results import FileResultStore
+from curious_tests.models import Blog, Entry
+import curious_tests.models
+
+
+class TestResultPaging(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    self.entries = [Entry(headline='Entry %s' % i, blog=self.blog) for i in range(5)]
+    for entry in self.entries:
+      entry.save()
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+    cache.clear()
+
+  def _query(self, **params):
+    params['q'] = 'Blog(%s), Blog.entry_set' % self.blog.pk
+    r = self.client.get('/curious/q/', params)
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def _page(self, result_id, **params):
+    r = self.client.get('/curious/results/%s/' % result_id, params)
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def test_returns_first_page_of_each_result(self):
+    result = self._query(p=2, d=1)
+    self.assertIn('result_id', result)
+    entries = result['results'][1]
+    self.assertEquals(entries['count'], 5)
+    self.assertEquals(len(entries['objects']), 2)
+    self.assertEquals(entries['next'], 2)
+    self.assertEquals(len(result['data'][1]['objects']), 2)
+    self.assertEquals(result['results'][0]['next'], None)
+
+  def test_pages_through_stored_result(self):
+    first = self._query(p=2)
+    pks = [pk for pk, src in first['results'][1]['objects']]
+    offset = first['results'][1]['next']
+    while offset is not None:
+      page = self._page(first['result_id'], i=1, offset=offset, limit=2, d=1)
+      self.assertEquals(page['result']['count'], 5)
+      self.assertEquals([row[0] for row in page['result']['data']['objects']],
+                        sorted(pk for pk, src in page['result']['objects']))
+      pks.extend(pk for pk, src in page['result']['objects'])
+      offset = page['result']['next']
+    self.assertItemsEqual(pks, [e.pk for e in self.entries])
+
+  def test_paging_does_not_rerun_query(self):
+    first = self._query(p=2)
+    with self.assertNumQueries(0):
+      page = self._page(first['result_id'], i=1, offset=2, limit=2)
+    self.assertEquals(len(page['result']['objects']), 2)
+
+  def test_unknown_result(self):
+    r = self.client.get('/curious/results/abc/')
+    self.assertEquals(r.status_code, 404)
+
+  def test_bad_result_index(self):
+    first = self._query(p=2)
+    r = self.client.get('/curious/results/%s/' % first['result_id'], dict(i=2))
+    self.assertEquals(r.status_code, 400)
+
+  def test_results_are_read_only(self):
+    first = self._query(p=2)
+    r = self.client.post('/curious/results/%s/' % first['result_id'], dict(i=0))
+    self.assertEquals(r.status_code, 405)
+
+  def test_bad_page_size(self):
+    for p in (0, -1, 'a'):
+      r = self.client.get('/curious/q/', dict(q='Blog(%s)' % self.blog.pk, p=p))
+      self.assertEquals(r.status_code, 400)
+
+
+class TestFileResultStore(TestCase):
+
+  def setUp(self):
+    cache.clear()
+    self.directory = tempfile.mkdtemp()
+    self.store = FileResultStore(cache, self.directory, 1024)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    cache.clear()
+
+  def _results(self, objects):
+    return dict(last_model='Entry', computed_on=datetime(2017, 1, 1),
+                results=[dict(model='Entry', join_index=-1, tree=None, objects=objects)])
+
+  def test_stores_pairs_in_files(self):
+    objects = [(i, i % 3 or None) for i in range(1, 11)]
+    self.store.save('a', self._results(objects))
+    self.assertEquals(os.listdir(self.directory), ['a-0.pairs'])
+    self.assertEquals(os.path.getsize(os.path.join(self.directory, 'a-0.pairs')), 160)
+    self.assertEquals(self.store.page('a', 0, 2, 3), objects[2:5])
+    self.assertEquals(self.store.page('a', 0, 8, 5), objects[8:])
+    self.assertEquals(self.store.page('a', 0, 20, 5), [])
+    self.assertEquals(self.store.load('a'), self._results(objects))
+
+  def test_stores_non_integer_pks_in_cache(self):
+    objects = [(u'x', None), (u'y', 1)]
+    self.store.save('a', self._results(objects))
+    self.assertEquals(os.listdir(self.directory), [])
+    self.assertEquals(self.store.load('a'), self._results(objects))
+
+  def test_stores_levels_in_files(self):
+    levels = [[(1, 1), (2, 2)], [(3, 1)], []]
+    self.assertEquals(self.store.load_levels('a'), None)
+    self.store.save_levels('a', levels)
+    self.assertItemsEqual(os.listdir(self.directory), ['a_levels-0.pairs', 'a_levels-1.pairs'])
+    self.assertEquals(self.store.load_levels('a'), levels)
+
+  def test_evicts_least_recently_used_files(self):
+    objects = [(i, None) for i in range(40)]
+    self.store.save('a', self._results(objects))
+    self.store.save('b', self._results(objects))
+    self.assertEquals(os.listdir(self.directory), ['b-0.pairs'])
+    self.assertEquals(self.store.load('a'), None)
+    self.assertEquals(self.store.load('b'), self._results(objects))
@@ -0,0 +1,113 @@
+from django.test import TestCase
+from curious import model_registry
+from curious.api import ModelView
+from curious.serializer import get_serializer
+from curious_tests.models import Blog, Entry, Person
+import curious_tests.models
+
+
+class TestSerializer(TestCase):
+
+  def setUp(self):
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    self.entries = [Entry(headline='Entry %d' % i, blog=self.blog) for i in range(3)]
+    for entry in self.entries:
+      entry.save()
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def test_serializes_fields_and_fks(self):
+    r = ModelView.objects_to_dict(self.entries)
+    self.assertEquals(r['fields'],
+                      ['id', 'blog_id', 'headline', 'response_to_id', 'related_blog_id'])
+    self.assertEquals(r['objects'], [
+      [e.id, ('Blog', self.blog.pk, 'Databases', None), e.headline, None, None]
+      for e in self.entries
+    ])
+    self.assertEquals(r['urls'], [None, None, None])
+
+  def test_serializes_fk_ids_without_following_fks(self):
+    r = ModelView.objects_to_dict(self.entries, follow_fk=False)
+    self.assertEquals([row[1] for row in r['objects']], [self.blog.pk] * 3)
+
+  def test_uses_urls_of_objects_and_fk_objects(self):
+    model_registry.get_manager('Blog').url_function = lambda obj: '/blogs/%s' % obj.pk
+    model_registry.get_manager('Entry').url_function = lambda obj: '/entries/%s' % obj.pk
+    r = ModelView.objects_to_dict(self.entries)
+    self.assertEquals(r['urls'], ['/entries/%s' % e.pk for e in self.entries])
+    self.assertEquals(r['objects'][0][1][3], '/blogs/%s' % self.blog.pk)
+
+  def test_only_tolerates_fk_url_functions_failing_for_missing_objects(self):
+    def blog_url(obj):
+      raise Blog.DoesNotExist()
+
+    model_registry.get_manager('Blog').url_function = blog_url
+    r = ModelView.objects_to_dict(self.entries)
+    self.assertEquals([row[1][3] for row in r['objects']], [None] * 3)
+
+    model_registry.get_manager('Blog').url_function = lambda obj: 1/0
+    self.assertRaises(ZeroDivisionError, ModelView.objects_to_dict, self.entries)
+
+  def test_reuses_compiled_serializers(self):
+    self.assertIs(get_serializer(Entry, False, True), get_serializer(Entry, False, True))
+    self.assertIsNot(get_serializer(Entry, False, True), get_serializer(Entry, False, False))
+
+  def test_recompiles_serializers_when_configuration_changes(self):
+    serializer = get_serializer(Entry, False, True)
+    model_registry.get_manager('Entry').field_excludes = ['headline']
+    self.assertIsNot(serializer, get_serializer(Entry, False, True))
+    r = ModelView.objects_to_dict(self.entries)
+    self.assertNotIn('headline', r['fields'])
+    r = ModelView.objects_to_dict(self.entries, ignore_excludes=True)
+    self.assertIn('headline', r['fields'])
+
+  def test_recompiles_serializers_when_registry_changes(self):
+    serializer = get_serializer(Entry, False, True)
+    model_registry.clear()
+    model_registry.register(curious_tests.models)
+    self.assertIsNot(serializer, get_serializer(Entry, False, True))
+
+  def test_adds_id_and_property_fields(self):
+    person = Person(gender='parrot')
+    person.save()
+    model_registry.get_manager('Person').field_excludes = ['id']
+    model_registry.get_manager('Person').property_fields = ['example_property_field']
+    r = ModelView.objects_to_dict([person])
+    self.assertEquals(r['fields'], ['alive', 'gender', 'id', 'example_property_field'])
+    self.assertEquals(r['objects'], [[True, 'parrot', person.pk, person.example_property_field]])
+
+  def test_uses_batch_url_functions(self):
+    calls = []
+
+    def blog_urls(objs):
+      calls.append(('Blog', len(objs)))
+      return dict((obj.pk, '/blogs/%s' % obj.pk) for obj in objs)
+
+    def entry_urls(objs):
+      calls.append(('Entry', len(objs)))
+      return dict((obj.pk, '/entries/%s' % obj.pk) for obj in objs)
+
+    model_registry.get_manager('Blog').url_batch_function = blog_urls
+    model_registry.get_manager('Entry').url_batch_function = entry_urls
+    r = ModelView.objects_to_dict(self.entries)
+    self.assertEquals(r['urls'], ['/entries/%s' % e.pk for e in self.entries])
+    self.assertEquals([row[1][3] for row in r['objects']], ['/blogs/%s' % self.blog.pk] * 3)
+    self.assertItemsEqual(calls, [('Blog', 1), ('Entry', 3)])
+
+  def test_uses_batch_property_functions(self):
+    calls = []
+
+    def comment_counts(objs):
+      calls.append(len(objs))
+      return dict((obj.pk, obj.pk * 10) for obj in objs)
+
+    manager = model_registry.get_manager('Entry')
+    manager.property_fields = ['comment_count']
+    manager.property_batch_functions = {'comment_count': comment_counts}
+    r = ModelView.objects_to_dict(self.entries)
+    self.assertEquals(r['fields'][-1], 'comment_count')
+    self.assertEquals([row[-1] for row in r['objects']], [e.pk * 10 for e in self.entries])
+    self.assertEquals(calls, [3])
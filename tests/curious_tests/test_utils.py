@@ -0,0 +1,76 @@
+import threading
+import time
+from unittest import TestCase
+from curious.utils import map_in_threads, LRUCache, CountMinSketch
+
+
+class TestMapInThreads(TestCase):
+
+  def test_maps_in_order_in_caller_thread(self):
+    threads = []
+
+    def f(x):
+      threads.append(threading.current_thread())
+      return x * 2
+
+    self.assertEquals(map_in_threads(f, [1, 2, 3], 1), [2, 4, 6])
+    self.assertEquals(set(threads), set([threading.current_thread()]))
+
+  def test_maps_in_order_on_thread_pool(self):
+    threads = []
+
+    def f(x):
+      threads.append(threading.current_thread())
+      return x * 2
+
+    self.assertEquals(map_in_threads(f, range(10), 3), [x * 2 for x in range(10)])
+    self.assertNotIn(threading.current_thread(), threads)
+
+
+class TestLRUCache(TestCase):
+
+  def test_evicts_least_recently_used(self):
+    lru = LRUCache(2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    self.assertEquals(lru.get('a'), 1)
+    self.assertEquals(lru.get('b'), None)
+    self.assertEquals(lru.get('c'), 3)
+    self.assertEquals(len(lru), 2)
+
+  def test_bounds_total_size(self):
+    lru = LRUCache(10, sizeof=len)
+    lru.set('a', 'x'*6)
+    lru.set('b', 'x'*6)
+    self.assertEquals(lru.get('a'), None)
+    self.assertEquals(lru.size, 6)
+    lru.set('c', 'x'*20)
+    self.assertEquals(lru.get('c'), None)
+    self.assertEquals(lru.size, 6)
+
+  def test_entries_expire(self):
+    lru = LRUCache(10, timeout=0.01)
+    lru.set('a', 1)
+    time.sleep(0.02)
+    self.assertEquals(lru.get('a'), None)
+    self.assertEquals(lru.size, 0)
+
+
+class TestCountMinSketch(TestCase):
+
+  def test_estimates_counts(self):
+    sketch = CountMinSketch(width=64, depth=4)
+    for i in range(3):
+      sketch.add('a')
+    sketch.add('b')
+    self.assertGreaterEqual(sketch.estimate('a'), 3)
+    self.assertGreaterEqual(sketch.estimate('b'), 1)
+    self.assertEquals(CountMinSketch().estimate('a'), 0)
+
+  def test_decays_counts(self):
+    sketch = CountMinSketch(width=64, depth=4, decay_every=4)
+    for i in range(4):
+      sketch.add('a')
+    self.assertEquals(sketch.estimate('a'), 2)
@@ -0,0 +1,67 @@
+import json
+from StringIO import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from curious import model_registry
+from curious.cache import cache, query_log
+from curious_tests.models import Blog
+import curious.settings
+import curious_tests.models
+
+
+class TestWarmCommand(TestCase):
+
+  QS = 'Blog(name__icontains="Data")'
+
+  def setUp(self):
+    cache.clear()
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    model_registry.register(curious_tests.models)
+    self.settings = (curious.settings.WARM_QUERIES, curious.settings.QUERY_LOG_SAMPLE_RATE)
+
+  def tearDown(self):
+    curious.settings.WARM_QUERIES, curious.settings.QUERY_LOG_SAMPLE_RATE = self.settings
+    model_registry.clear()
+    cache.clear()
+
+  def _warm(self, **options):
+    out = StringIO()
+    call_command('curious_warm', stdout=out, stderr=out, **options)
+    return out.getvalue()
+
+  def test_warms_configured_queries(self):
+    curious.settings.WARM_QUERIES = [(self.QS, 'test')]
+    out = self._warm()
+    self.assertIn('%s [test]: 1 objects' % self.QS, out)
+    self.assertIn('Warmed 1 of 1 queries', out)
+
+    with self.assertNumQueries(0):
+      r = self.client.get('/curious/q/', dict(q=self.QS, app='test'))
+    self.assertEquals(json.loads(r.content)['result']['results'][0]['objects'],
+                      [[self.blog.pk, None]])
+
+  def test_reports_failed_queries(self):
+    curious.settings.WARM_QUERIES = [('Unknown(1)', 'test'), (self.QS, 'test')]
+    out = self._warm()
+    self.assertIn('Unknown(1) [test]: failed', out)
+    self.assertIn('Warmed 1 of 2 queries', out)
+
+  def test_warms_most_frequent_logged_queries(self):
+    curious.settings.QUERY_LOG_SAMPLE_RATE = 1
+    other = 'Blog(name__icontains="Warehouse")'
+    for qs in (self.QS, other, self.QS):
+      self.client.get('/curious/q/', dict(q=qs, app='test'))
+    self.assertEquals(query_log.most_frequent(1), [(self.QS, 'test')])
+
+    # the same query written differently counts as the same query
+    for i in range(2):
+      self.client.get('/curious/q/', dict(q='Blog( name__icontains = "Warehouse" )', app='test'))
+    self.assertEquals(query_log.most_frequent(1),
+                      [('Blog( name__icontains = "Warehouse" )', 'test')])
+    self.assertEquals(len(query_log.most_frequent(5)), 2)
+
+    out = self._warm(top=1)
+    self.assertIn('Warmed 1 of 1 queries', out)
+    self.assertIn('Warehouse', out)
+    self.assertNotIn(self.QS, out)
@@ -0,0 +1,92 @@
+import json
+from django.test import TestCase
+from curious import model_registry
+from curious.encoding import RawJSON
+from curious.wire import group_objects, int_encoding, pack_ints, unpack_ints, columnar_objects, \
+                         columnar_data
+from curious_tests.models import Blog, Entry
+import curious_tests.models
+
+
+class TestWireFormats(TestCase):
+
+  def test_groups_objects_by_source(self):
+    self.assertEquals(group_objects([(1, 10), (2, 11), (3, 10), (4, None)]),
+                      [[10, [1, 3]], [11, [2]], [None, [4]]])
+
+  def test_packs_integer_columns(self):
+    self.assertEquals(int_encoding([1, None, -5]), 'int32')
+    self.assertEquals(int_encoding([1, None, 2**40]), 'int64')
+    self.assertEquals(int_encoding([1, 2**63]), None)
+    self.assertEquals(int_encoding([1, 'a']), None)
+    for values in ([1, None, -5], [1, None, -5, 2**40]):
+      encoding = int_encoding(values)
+      self.assertEquals(unpack_ints(pack_ints(values, encoding), encoding), values)
+    self.assertEquals(pack_ints([1], 'int64'), 'AQAAAAAAAAA=')
+
+  def test_falls_back_to_json_columns_for_non_integer_pks(self):
+    self.assertEquals(columnar_objects([(u'a', None), (u'b', 1)]),
+                      dict(encoding='json', pks=[u'a', u'b'], srcs=[None, 1]))
+
+  def test_transposes_data_rows(self):
+    data = dict(fields=['id', 'name'], objects=[[1, 'a'], RawJSON('[2,"b"]')], urls=[None, None])
+    self.assertEquals(columnar_data(data),
+                      dict(fields=['id', 'name'], columns=[[1, 2], ['a', 'b']], urls=[None, None]))
+
+  def test_passes_empty_data_through(self):
+    self.assertEquals(columnar_data([]), [])
+
+  def test_transposes_cached_data(self):
+    data = RawJSON('{"fields":["id","name"],"objects":[[1,"a"],[2,"b"]],"urls":[null,null]}')
+    self.assertEquals(columnar_data(data),
+                      dict(fields=['id', 'name'], columns=[[1, 2], ['a', 'b']], urls=[None, None]))
+
+
+class TestWireFormatAPI(TestCase):
+
+  def setUp(self):
+    self.blog = Blog(name='Databases')
+    self.blog.save()
+    self.entries = [Entry(headline='Entry %s' % i, blog=self.blog) for i in range(3)]
+    for entry in self.entries:
+      entry.save()
+    model_registry.register(curious_tests.models)
+
+  def tearDown(self):
+    model_registry.clear()
+
+  def _query(self, **params):
+    params['q'] = 'Blog(%s), Blog.entry_set' % self.blog.pk
+    r = self.client.get('/curious/q/', params)
+    self.assertEquals(r.status_code, 200)
+    return json.loads(r.content)['result']
+
+  def test_grouped_format(self):
+    result = self._query(format='grouped')
+    self.assertEquals(result['format'], 'grouped')
+    objects = result['results'][1]['objects']
+    self.assertEquals(len(objects), 1)
+    self.assertEquals(objects[0][0], self.blog.pk)
+    self.assertItemsEqual(objects[0][1], [e.pk for e in self.entries])
+
+  def test_columnar_format(self):
+    expected = self._query(d=1)
+    result = self._query(d=1, format='columnar')
+    objects = result['results'][1]['objects']
+    self.assertEquals(objects['encoding'], 'int32')
+    self.assertEquals(zip(unpack_ints(objects['pks'], 'int32'),
+                          unpack_ints(objects['srcs'], 'int32')),
+                      [tuple(pair) for pair in expected['results'][1]['objects']])
+    data = result['data'][1]
+    self.assertEquals(data['fields'], expected['data'][1]['fields'])
+    self.assertEquals(zip(*data['columns']), [tuple(row) for row in expected['data'][1]['objects']])
+
+  def test_unknown_format(self):
+    r = self.client.get('/curious/q/', dict(q='Blog(%s)' % self.blog.pk, format='xml'))
+    self.assertEquals(r.status_code, 400)
+
+  def test_columnar_format_of_results_without_objects(self):
+    r = self.client.get('/curious/q/', dict(q='Blog(name="Graphs"), Blog.entry_set', d=1,
+                                            format='columnar'))
+    self.assertEquals(r.status_code, 200)
+    self.assertEquals(json.loads(r.content)['result']['data'], [[], []])
@@ -74,3 +74,8 @@ LOGGING = {
   'version': 1,
   'disable_existing_loggers': True,
 }
+
+# tests clear the cache between tests; check for changes on every access
+CURIOUS_LOCAL_CACHE_SYNC_INTERVAL = 0
+# run query jobs in the request, on the test database connection
+CURIOUS_JOB_WORKERS = 0